@@ -1,40 +1,118 @@
-import os, io, uuid, base64
+import os, io, uuid, json, base64, hashlib, mimetypes
+import click
 import qrcode
 from flask import (
-    Flask, request, jsonify, session, send_file,
-    render_template, redirect, url_for, make_response
+    Blueprint, Flask, Response, request, jsonify, session, current_app,
+    render_template, redirect, url_for, make_response, stream_with_context
 )
+from sqlalchemy import select, update, func, or_, and_
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
-from functools import wraps
+from functools import wraps, partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from config import Config
-from models import db, User, Document, Share
+from models import db, User, Document, Share, Blob, UploadSession, init_db, upgrade_schema
 from utils import (
-    encrypt_bytes, decrypt_bytes,
-    save_file_bytes, read_file_bytes_as_b64,
-    audit, send_email
+    save_encrypted_stream, iter_decrypt_file, iter_plaintext, plaintext_size, iter_zip,
+    content_hmac, choose_stream_codec, ACTIVE_KEY_ID,
+    ResumableBlob, try_lock_file,
+    audit, audit_buffer, identity_cache
 )
+from mailer import MailQueue
+from passwords import PasswordHasher, PasswordHasherBusy
+import leader
+import metrics
+import rotation
+import search
+import storage
 # ==========================================================
 # ⚙️ APP SETUP
 # ==========================================================
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
+# Importing this module has no side effects: create_app() builds an app,
+# and background work (scheduled jobs, outbound mail) only runs in the one
+# server process that wins the scheduler election. CLI commands never take
+# part: a long `flask rotate-keys` must not hold the jobs hostage, or take
+# the mail queue down mid-batch when it exits.
+bp = Blueprint("main", __name__, cli_group=None)
 
-print("📧 Loaded email config:")
-print("SMTP_HOST =", os.getenv("SMTP_HOST"))
-print("SMTP_USER =", os.getenv("SMTP_USER"))
-print("FROM_EMAIL =", os.getenv("FROM_EMAIL"))
+# Scheduled jobs are added when this process becomes the leader
+scheduler = BackgroundScheduler()
 
-with app.app_context():
-    db.create_all()
+# Batch uploads encrypt files in parallel (AES-GCM releases the GIL)
+upload_pool = ThreadPoolExecutor(max_workers=Config.UPLOAD_WORKERS, thread_name_prefix="upload")
+
+# Outbound email is delivered off the scheduler thread (started with it)
+mail_queue = MailQueue(
+    workers=Config.SMTP_WORKERS,
+    batch_size=Config.SMTP_BATCH_SIZE,
+    max_retries=Config.SMTP_MAX_RETRIES,
+)
+metrics.Gauge(metrics.REGISTRY, "flyvia_mail_queue_depth", "Emails queued or awaiting retry",
+              function=lambda: mail_queue.stats()["queued"])
+
+# Password KDFs run in worker processes, off the request threads
+password_hasher = PasswordHasher(
+    Config.PASSWORD_HASH_METHOD,
+    workers=Config.PASSWORD_HASH_WORKERS,
+    max_pending=Config.PASSWORD_HASH_MAX_PENDING,
+)
+metrics.Gauge(metrics.REGISTRY, "flyvia_password_kdf_pending", "Password hashes queued or running",
+              function=password_hasher.pending)
+
+
+def _in_cli_command():
+    """True while a `flask <command>` other than `flask run` builds the app."""
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != "run"
+
+
+def create_app(config=None):
+    """Build the Flask app; `config` (a dict) overrides Config."""
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(Config)
+    flask_app.config.update(config or {})
+    init_db(flask_app)
+    metrics.init_app(flask_app)
+    flask_app.register_blueprint(bp)
+
+    if flask_app.config["SCHEMA_AUTO_UPGRADE"]:
+        with flask_app.app_context(), leader.exclusive_lock(flask_app.config["SCHEMA_LOCK_FILE"]):
+            upgrade_schema()
+            search.ensure_index()
+    audit_buffer.start(flask_app)
+    if flask_app.config["SCHEDULER_ENABLED"] and not _in_cli_command():
+        flask_app.extensions["scheduler_election"] = leader.LeaderElection(
+            flask_app.config["SCHEDULER_LOCK_FILE"],
+            partial(start_scheduler, flask_app),
+            poll_seconds=flask_app.config["SCHEDULER_POLL_SECONDS"],
+        ).start()
+    return flask_app
 
-# Scheduler setup
-scheduler = BackgroundScheduler()
-scheduler.start()
+
+def start_scheduler(flask_app):
+    """Run the scheduled jobs (and the mail queue) in this process."""
+    print(f"👑 Process {os.getpid()} is running scheduled jobs")
+    print("📧 Loaded email config:")
+    print("SMTP_HOST =", os.getenv("SMTP_HOST"))
+    print("SMTP_USER =", os.getenv("SMTP_USER"))
+    print("FROM_EMAIL =", os.getenv("FROM_EMAIL"))
+    mail_queue.start()
+    if flask_app.config["REMINDER_DIGEST"]:
+        # Runs often so a digest missed while no process was leader goes out soon after
+        scheduler.add_job(run_digest_job, "interval", minutes=15, id="digest_job", args=[flask_app],
+                          replace_existing=True)
+    else:
+        scheduler.add_job(run_reminder_job, "interval", minutes=1, id="reminder_job", args=[flask_app],
+                          replace_existing=True)
+    scheduler.add_job(run_upload_expiry_job, "interval", minutes=30, id="upload_expiry_job", args=[flask_app],
+                      replace_existing=True)
+    scheduler.add_job(run_gc_job, "interval", minutes=flask_app.config["GC_INTERVAL_MINUTES"], id="gc_job",
+                      args=[flask_app], replace_existing=True)
+    if not scheduler.running:
+        scheduler.start()
 
 
 # ==========================================================
@@ -42,25 +120,100 @@ scheduler.start()
 # ==========================================================
 def allowed(filename):
     """Checks if file extension is allowed."""
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXT"]
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in Config.ALLOWED_EXT
 
 def login_required(func):
     """Ensures routes require login."""
     @wraps(func)
     def wrapper(*args, **kwargs):
         if "user_id" not in session:
-            return redirect(url_for("login_page"))
-        user = User.query.get(session["user_id"])
+            return redirect(url_for("main.login_page"))
+        user = identity_cache.get(session["user_id"])
         if not user:
-            return redirect(url_for("login_page"))
+            return redirect(url_for("main.login_page"))
         return func(user, *args, **kwargs)
     return wrapper
 
+def encode_cursor(doc):
+    """Opaque keyset cursor for the position just after `doc`."""
+    raw = f"{doc.uploaded_at.isoformat()}|{doc.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    uploaded_at, doc_id = base64.urlsafe_b64decode(token.encode()).decode().split("|")
+    return datetime.fromisoformat(uploaded_at), int(doc_id)
+
+def filter_documents(query, args):
+    """Apply the shared listing/export filters from request args."""
+    if args.get("category"):
+        query = query.where(Document.category == args["category"])
+    if args.get("prefix"):
+        escaped = args["prefix"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(Document.filename.like(escaped + "%", escape="\\"))
+    if args.get("expires_after"):
+        query = query.where(Document.expiry_date >= date.fromisoformat(args["expires_after"]))
+    if args.get("expires_before"):
+        query = query.where(Document.expiry_date <= date.fromisoformat(args["expires_before"]))
+    return query
+
+def list_documents(owner_id, args):
+    """
+    One page of a user's documents, newest first, keyset-paginated on
+    (uploaded_at, id) so every page costs the same however deep it is.
+    Raises ValueError on malformed filters or cursors.
+    """
+    limit = int(args.get("limit") or current_app.config["DOCUMENTS_PAGE_SIZE"])
+    limit = max(1, min(limit, current_app.config["DOCUMENTS_MAX_PAGE_SIZE"]))
+    query = filter_documents(select(Document).where(Document.owner_id == owner_id), args)
+    if args.get("cursor"):
+        uploaded_at, doc_id = decode_cursor(args["cursor"])
+        query = query.where(or_(
+            Document.uploaded_at < uploaded_at,
+            and_(Document.uploaded_at == uploaded_at, Document.id < doc_id),
+        ))
+
+    query = query.order_by(Document.uploaded_at.desc(), Document.id.desc()).limit(limit + 1)
+    docs = db.session.execute(query).scalars().all()
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def document_size(doc, stored_path):
+    """Original size of a document; rows from before Document.size are uncompressed."""
+    return doc.size if doc.size is not None else plaintext_size(stored_path, doc.nonce_b64)
+
+def listing_version(user):
+    """The user's current listing version, read fresh (the cached User may lag)."""
+    return db.session.execute(select(User.listing_version).where(User.id == user.id)).scalar()
+
+def not_modified(etag, last_modified=None, weak=False):
+    """A 304 when the client's cached copy is still current, else None.
+    Call it before reading or decrypting anything."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(Response(status=304), etag, last_modified, weak)
+
+def with_validators(response, etag, last_modified=None, weak=False):
+    response.set_etag(etag, weak=weak)
+    if last_modified:
+        response.last_modified = last_modified
+    # Per-user content: browsers may keep it but must revalidate each time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def render_document_list(user):
+    try:
+        docs, next_cursor = list_documents(user.id, request.args)
+    except ValueError:
+        return jsonify({"error": "invalid filter or cursor"}), 400
+    return render_template("dashboard.html", docs=docs, user=user,
+                           next_cursor=next_cursor, filters=request.args)
+
 
 # ==========================================================
 # 🚪 AUTHENTICATION ROUTES
 # ==========================================================
-@app.route("/signup", methods=["POST"])
+@bp.route("/signup", methods=["POST"])
 def signup():
     data = request.get_json(silent=True) or request.form
     email = data.get("email")
@@ -72,37 +225,110 @@ def signup():
     if User.query.filter_by(email=email).first():
         return jsonify({"error": "email already exists"}), 400
 
-    user = User(email=email, password_hash=generate_password_hash(password))
+    user = User(email=email, password_hash=password_hasher.hash(password))
     db.session.add(user)
     db.session.commit()
     return jsonify({"message": "registered"}), 201
 
 
-@app.route("/login", methods=["POST"])
+@bp.route("/login", methods=["POST"])
 def login():
     data = request.form
     email = data.get("email")
     password = data.get("password")
 
     user = User.query.filter_by(email=email).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    if not user or not password_hasher.verify(user.password_hash, password):
         return jsonify({"error": "invalid credentials"}), 401
+    if password_hasher.needs_rehash(user.password_hash):
+        # PASSWORD_HASH_METHOD changed since this password was set. The login
+        # stands whatever happens here; a failed upgrade is retried next time.
+        try:
+            user.password_hash = password_hasher.hash(password)
+            db.session.commit()
+        except PasswordHasherBusy:
+            pass
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Could not upgrade password hash for user {user.id}: {e}")
 
     session["user_id"] = user.id
     # ✅ Redirect user directly to /home after login
-    return redirect(url_for("home_page"))
+    return redirect(url_for("main.home_page"))
 
 
-@app.route("/logout")
+@bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    # Shed load at once instead of queueing behind minutes of KDF work
+    return jsonify({"error": "too many sign-ins, please retry"}), 503, {"Retry-After": "2"}
+
+
+@bp.route("/logout")
 def logout():
     session.pop("user_id", None)
-    return redirect(url_for("login_page"))
+    return redirect(url_for("main.login_page"))
 
 
 # ==========================================================
 # 📁 DOCUMENT MANAGEMENT ROUTES
 # ==========================================================
-@app.route("/upload", methods=["POST"])
+def upload_metadata(form):
+    """Category, expiry date and (UTC) reminder time from an upload form."""
+    expiry_str = form.get("expiry_date")
+    reminder_str = form.get("reminder_at")
+
+    reminder_at = None
+    if reminder_str:
+        try:
+            local_time = datetime.fromisoformat(reminder_str)
+            reminder_at = local_time.astimezone(timezone.utc).replace(tzinfo=None)
+        except Exception as e:
+            print("⚠️ Could not parse reminder time:", e)
+
+    return {
+        "category": form.get("category", "General"),
+        "expiry_date": datetime.fromisoformat(expiry_str).date() if expiry_str else None,
+        "reminder_at": reminder_at,
+    }
+
+def store_upload(file, upload_folder):
+    """Encrypt an uploaded file into a new blob; returns (stored name, codec)."""
+    # Compress when a sample says it pays off, then encrypt straight from
+    # the (spooled) upload stream, segment by segment
+    codec = choose_stream_codec(file.stream)
+    stored_name = str(uuid.uuid4()) + ".bin"
+    stored_path = storage.new_blob_path(upload_folder, stored_name)
+    save_encrypted_stream(stored_path, file.stream, codec, ACTIVE_KEY_ID)
+    return stored_name, codec
+
+def claim_blob(user, digest, count=1):
+    """Reference the user's existing blob with this content, if there is one."""
+    blob = storage.find_blob(user.id, digest)
+    if blob is None or not storage.add_reference(blob, count):
+        return None
+    return blob
+
+def add_document(user, filename, blob, metadata):
+    """Stage a Document row for `blob` plus its search entry and audit record."""
+    doc = Document(owner_id=user.id, filename=secure_filename(filename), stored_name=blob.stored_name,
+                   content_hmac=blob.content_hmac, codec=blob.codec, size=blob.size, key_id=blob.key_id,
+                   **metadata)
+    db.session.add(doc)
+    db.session.flush()
+    search.index_document(doc)
+    audit(user.id, "upload", f"Uploaded {doc.filename}")
+    return doc
+
+def documents_committed(docs):
+    """Post-commit work for new documents (PDF text extraction)."""
+    for doc in docs:
+        if doc.filename.lower().endswith(".pdf"):
+            search.schedule_text_extraction(current_app._get_current_object(), doc.id,
+                                            storage.locate_blob(current_app.config["UPLOAD_FOLDER"], doc.stored_name),
+                                            codec=doc.codec, key_id=doc.key_id)
+
+
+@bp.route("/upload", methods=["POST"])
 @login_required
 def upload(user):
     if "file" not in request.files:
@@ -115,124 +341,642 @@ def upload(user):
     if not allowed(file.filename):
         return jsonify({"error": "invalid file type"}), 400
 
-    category = request.form.get("category", "General")
-    expiry_str = request.form.get("expiry_date")
-    reminder_str = request.form.get("reminder_at")
+    metadata = upload_metadata(request.form)
+    digest, size = storage.fingerprint_upload(user.id, file.stream, ACTIVE_KEY_ID)
+    blob = claim_blob(user, digest)
+    if blob is None:
+        stored_name, codec = store_upload(file, current_app.config["UPLOAD_FOLDER"])
+        blob = storage.register_blob(stored_name, user.id, digest, size, codec, ACTIVE_KEY_ID)
+    doc = add_document(user, file.filename, blob, metadata)
+    db.session.commit()
+    documents_committed([doc])
+    return redirect(url_for("main.documents_page"))
 
-    reminder_at = None
-    if reminder_str:
+
+@bp.route("/upload/batch", methods=["POST"])
+@login_required
+def upload_batch(user):
+    """
+    Upload many files at once. Files are fingerprinted, then the ones the
+    user doesn't already have are encrypted and written in parallel on the
+    upload pool; every Document is inserted in one transaction.
+    Responds with a per-file status list.
+    """
+    files = request.files.getlist("files")
+    if not files:
+        return jsonify({"error": "no files provided"}), 400
+    metadata = upload_metadata(request.form)
+
+    results, jobs = [], []
+    for file in files:
+        entry = {"filename": secure_filename(file.filename or "")}
+        if not file.filename:
+            entry.update(status="error", error="empty filename")
+        elif not allowed(file.filename):
+            entry.update(status="error", error="invalid file type")
+        else:
+            jobs.append((entry, file, upload_pool.submit(storage.fingerprint_upload, user.id, file.stream, ACTIVE_KEY_ID)))
+        results.append(entry)
+
+    # Files with the same content share one blob; only content the user
+    # doesn't have yet is encrypted and written
+    groups = {}
+    for entry, file, future in jobs:
         try:
-            local_time = datetime.fromisoformat(reminder_str)
-            reminder_at = local_time.astimezone(timezone.utc).replace(tzinfo=None)
+            digest, size = future.result()
         except Exception as e:
-            print("⚠️ Could not parse reminder time:", e)
+            print(f"⚠️ Could not read {entry['filename']}: {e}")
+            entry.update(status="error", error="could not store file")
+            continue
+        groups.setdefault(digest, (size, []))[1].append((entry, file))
+
+    stored = {}
+    for digest, (size, members) in groups.items():
+        blob = claim_blob(user, digest, len(members))
+        stored[digest] = blob or upload_pool.submit(store_upload, members[0][1], current_app.config["UPLOAD_FOLDER"])
+
+    docs = []
+    for digest, (size, members) in groups.items():
+        blob = stored[digest]
+        if not isinstance(blob, Blob):
+            try:
+                stored_name, codec = blob.result()
+            except Exception as e:
+                print(f"⚠️ Could not store {members[0][0]['filename']}: {e}")
+                for entry, file in members:
+                    entry.update(status="error", error="could not store file")
+                continue
+            blob = storage.register_blob(stored_name, user.id, digest, size, codec, ACTIVE_KEY_ID,
+                                         refcount=len(members))
+        for entry, file in members:
+            doc = add_document(user, file.filename, blob, metadata)
+            entry.update(status="stored", id=doc.id)
+            docs.append(doc)
+
+    if docs:
+        db.session.commit()
+        documents_committed(docs)
+    return jsonify({"results": results}), 201 if docs else 400
+
+
+# ----------------------------------------------------------
+# Resumable uploads (tus-style): create a session, PATCH chunks at the
+# current Upload-Offset, HEAD to find where to resume, then finalize.
+# ----------------------------------------------------------
+def _upload_session(user, session_id):
+    upload = db.session.get(UploadSession, session_id)
+    if not upload or upload.owner_id != user.id:
+        return None, None
+    blob = ResumableBlob(storage.locate_blob(current_app.config["UPLOAD_FOLDER"], upload.stored_name), upload.length,
+                         upload.key_id)
+    return upload, blob
+
+def _offset_response(body, status, upload, offset):
+    response = make_response(body, status)
+    response.headers["Upload-Offset"] = str(offset)
+    response.headers["Upload-Length"] = str(upload.length)
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
-    raw = file.read()
-    nonce_b64, cipher_b64 = encrypt_bytes(raw)
-    stored_name = str(uuid.uuid4()) + ".bin"
-    stored_path = os.path.join(app.config["UPLOAD_FOLDER"], stored_name)
-    save_file_bytes(stored_path, cipher_b64)
 
-    doc = Document(
+@bp.route("/upload/sessions", methods=["POST"])
+@login_required
+def create_upload_session(user):
+    data = request.get_json(silent=True) or request.form
+    filename = data.get("filename") or ""
+    try:
+        length = int(data.get("length"))
+    except (TypeError, ValueError):
+        length = -1
+    if not filename or not allowed(filename):
+        return jsonify({"error": "invalid file type"}), 400
+    if length < 0:
+        return jsonify({"error": "length required"}), 400
+
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
         owner_id=user.id,
-        filename=secure_filename(file.filename),
-        stored_name=stored_name,
-        category=category,
-        expiry_date=datetime.fromisoformat(expiry_str).date() if expiry_str else None,
-        reminder_at=reminder_at,
-        nonce_b64=nonce_b64,
+        filename=secure_filename(filename),
+        stored_name=str(uuid.uuid4()) + ".bin",
+        length=length,
+        key_id=ACTIVE_KEY_ID,
+        **upload_metadata(data),
     )
-    db.session.add(doc)
+    ResumableBlob.create(storage.new_blob_path(current_app.config["UPLOAD_FOLDER"], upload.stored_name), length,
+                         key_id=upload.key_id)
+    db.session.add(upload)
     db.session.commit()
-    audit(user.id, "upload", f"Uploaded {doc.filename}")
-    return redirect(url_for("documents_page"))
+
+    response = _offset_response(jsonify({"id": upload.id, "offset": 0, "length": length}), 201, upload, 0)
+    response.headers["Location"] = url_for("main.upload_session", session_id=upload.id)
+    return response
+
+
+@bp.route("/upload/sessions/<session_id>", methods=["GET", "HEAD"])
+@login_required
+def upload_session(user, session_id):
+    upload, blob = _upload_session(user, session_id)
+    if not upload:
+        return jsonify({"error": "upload not found"}), 404
+    offset = blob.offset()
+    return _offset_response(jsonify({"id": upload.id, "offset": offset, "length": upload.length}), 200, upload, offset)
 
 
-@app.route("/download/<int:doc_id>")
+@bp.route("/upload/sessions/<session_id>", methods=["PATCH"])
+@login_required
+def append_upload_chunk(user, session_id):
+    upload, blob = _upload_session(user, session_id)
+    if not upload:
+        return jsonify({"error": "upload not found"}), 404
+    with try_lock_file(blob.path) as locked:
+        if not locked:
+            return jsonify({"error": "another chunk is being written"}), 409
+        offset = blob.offset()
+        if request.headers.get("Upload-Offset", type=int) != offset:
+            return _offset_response(jsonify({"error": "offset mismatch", "offset": offset}), 409, upload, offset)
+        try:
+            offset = blob.append(request.stream)
+        except ValueError as e:
+            return _offset_response(jsonify({"error": str(e), "offset": blob.offset()}), 400, upload, blob.offset())
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+    return _offset_response("", 204, upload, offset)
+
+
+@bp.route("/upload/sessions/<session_id>/finalize", methods=["POST"])
+@login_required
+def finalize_upload(user, session_id):
+    upload, blob = _upload_session(user, session_id)
+    if not upload:
+        return jsonify({"error": "upload not found"}), 404
+    offset = blob.offset()
+    if offset != upload.length:
+        return _offset_response(jsonify({"error": "upload incomplete", "offset": offset}), 409, upload, offset)
+
+    # The chunks are already encrypted; fingerprint the assembled plaintext and
+    # drop this copy if the user already has the same content
+    digest, size = content_hmac(user.id, iter_decrypt_file(blob.path, key_id=upload.key_id), upload.key_id)
+    existing = claim_blob(user, digest)
+
+    metadata = {"category": upload.category, "expiry_date": upload.expiry_date, "reminder_at": upload.reminder_at}
+    doc = add_document(user, upload.filename,
+                       existing or storage.register_blob(upload.stored_name, user.id, digest, size,
+                                                         key_id=upload.key_id), metadata)
+    db.session.delete(upload)
+    db.session.commit()
+    if existing:
+        blob.remove()
+    documents_committed([doc])
+    return jsonify({"id": doc.id, "filename": doc.filename}), 201
+
+
+@bp.route("/upload/sessions/<session_id>", methods=["DELETE"])
+@login_required
+def abort_upload(user, session_id):
+    upload, blob = _upload_session(user, session_id)
+    if not upload:
+        return jsonify({"error": "upload not found"}), 404
+    db.session.delete(upload)
+    db.session.commit()
+    blob.remove()
+    return "", 204
+
+
+@bp.route("/download/<int:doc_id>")
 @login_required
 def download(user, doc_id):
     doc = Document.query.get(doc_id)
-    if not doc:
+    if not doc or doc.owner_id != user.id:
         return "File not found", 404
-    stored_path = os.path.join(app.config["UPLOAD_FOLDER"], doc.stored_name)
-    cipher_b64 = read_file_bytes_as_b64(stored_path)
-    plaintext = decrypt_bytes(doc.nonce_b64, cipher_b64)
-    return send_file(io.BytesIO(plaintext), as_attachment=True, download_name=doc.filename)
+    # A document's bytes never change, so its validators come from metadata alone
+    etag = doc.content_hmac[:32] if doc.content_hmac else f"{doc.id}-{doc.stored_name}"
+    cached = not_modified(etag, doc.uploaded_at)
+    if cached:
+        return cached
+    stored_path = storage.locate_blob(current_app.config["UPLOAD_FOLDER"], doc.stored_name)
+    size = document_size(doc, stored_path)
+
+    # Serve a single byte range if asked (PDF viewers, mobile seeking);
+    # multi-range requests, and an If-Range that no longer matches, fall
+    # back to the whole file.
+    status, start, stop = 200, 0, size
+    range_valid = "If-Range" not in request.headers or not is_resource_modified(
+        request.environ, etag=etag, last_modified=doc.uploaded_at, ignore_if_range=False)
+    if request.range and len(request.range.ranges) == 1 and range_valid:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        status, (start, stop) = 206, byte_range
+
+    mimetype = mimetypes.guess_type(doc.filename)[0] or "application/octet-stream"
+    body = iter_plaintext(stored_path, doc.nonce_b64, doc.codec, start=start, end=stop, key_id=doc.key_id)
+    response = Response(body, status=status, mimetype=mimetype, direct_passthrough=True)
+    response.headers["Content-Length"] = str(stop - start)
+    response.headers["Accept-Ranges"] = "bytes"
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    response.headers.set("Content-Disposition", "attachment", filename=doc.filename)
+    return with_validators(response, etag, doc.uploaded_at)
+
+
+@bp.route("/export")
+@login_required
+def export_documents(user):
+    """
+    Stream a ZIP of the user's documents, optionally narrowed by `id`
+    (repeatable or comma-separated), category or expiry range. Members are
+    decrypted segment by segment while the archive is being sent.
+    """
+    try:
+        query = filter_documents(select(Document).where(Document.owner_id == user.id), request.args)
+        ids = [int(i) for value in request.args.getlist("id") for i in value.split(",") if i]
+    except ValueError:
+        return jsonify({"error": "invalid filter"}), 400
+    if ids:
+        query = query.where(Document.id.in_(ids))
+    docs = db.session.execute(query.order_by(Document.id)).scalars().all()
+    if not docs:
+        return "No documents to export.", 404
+
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    members = [(doc.filename, doc.uploaded_at, doc.stored_name, doc.nonce_b64, doc.codec, doc.size, doc.key_id)
+               for doc in docs]
+    audit(user.id, "export", f"Exported {len(members)} documents")
+    db.session.commit()
+
+    def entries():
+        used = set()
+        for filename, uploaded_at, stored_name, nonce_b64, codec, size, key_id in members:
+            arcname, n = filename, 1
+            while arcname in used:
+                n += 1
+                stem, dot, ext = filename.rpartition(".")
+                arcname = f"{stem} ({n}).{ext}" if dot else f"{filename} ({n})"
+            used.add(arcname)
+            stored_path = storage.locate_blob(upload_folder, stored_name)
+            if size is None:
+                size = plaintext_size(stored_path, nonce_b64)
+            yield arcname, uploaded_at, size, iter_plaintext(stored_path, nonce_b64, codec, key_id=key_id)
+
+    response = Response(stream_with_context(iter_zip(entries())), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename="flyvia_documents.zip")
+    return response
 
 
-@app.route("/delete/<int:doc_id>")
+@bp.route("/delete/<int:doc_id>")
 @login_required
 def delete_doc(user, doc_id):
     doc = Document.query.get(doc_id)
     if not doc or doc.owner_id != user.id:
         return "Unauthorized or not found", 403
+    search.remove_document(doc.id)
+    unreferenced = storage.release_blob(doc.stored_name)
     db.session.delete(doc)
     db.session.commit()
-    return redirect(url_for("documents_page"))
+    if unreferenced:
+        storage.queue_removal(current_app.config["UPLOAD_FOLDER"], doc.stored_name)
+    return redirect(url_for("main.documents_page"))
 
 
-@app.route("/mydocs")
+@bp.route("/mydocs")
 @login_required
 def mydocs(user):
-    docs = Document.query.filter_by(owner_id=user.id).all()
-    return render_template("dashboard.html", docs=docs, user=user)
+    return render_document_list(user)
+
+
+@bp.route("/api/documents")
+@login_required
+def documents_api(user):
+    """JSON page of the listing; the dashboard fetches further pages lazily."""
+    etag = f"docs-{user.id}-{listing_version(user)}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
+    try:
+        docs, next_cursor = list_documents(user.id, request.args)
+    except ValueError:
+        return jsonify({"error": "invalid filter or cursor"}), 400
+    return with_validators(jsonify({
+        "documents": [{
+            "id": doc.id,
+            "filename": doc.filename,
+            "category": doc.category,
+            "uploaded_at": doc.uploaded_at.isoformat(),
+            "expiry_date": doc.expiry_date.isoformat() if doc.expiry_date else None,
+            "reminder_at": doc.reminder_at.isoformat() if doc.reminder_at else None,
+            "download_url": url_for("main.download", doc_id=doc.id),
+            "delete_url": url_for("main.delete_doc", doc_id=doc.id),
+        } for doc in docs],
+        "next_cursor": next_cursor,
+    }), etag, weak=True)
+
+
+@bp.route("/search")
+@login_required
+def search_page(user):
+    """Ranked full-text search over the user's documents (JSON)."""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "query required"}), 400
+    limit = max(1, min(request.args.get("limit", 20, type=int), current_app.config["DOCUMENTS_MAX_PAGE_SIZE"]))
+    results = search.search_documents(user.id, query, limit)
+    return jsonify({"results": [{
+        "id": doc.id,
+        "filename": doc.filename,
+        "category": doc.category,
+        "snippet": snippet,
+        "download_url": url_for("main.download", doc_id=doc.id),
+    } for doc, snippet in results]})
 
 
 # ==========================================================
 # ⏰ REMINDER FUNCTIONALITY
 # ==========================================================
-sent_reminders = set()
-
 def check_reminders():
     now = datetime.utcnow()
-    window_start = now - timedelta(minutes=1)
+    window_start = now - timedelta(minutes=current_app.config["REMINDER_CATCHUP_MINUTES"])
     window_end = now + timedelta(minutes=1)
-    due_docs = Document.query.filter(Document.reminder_at != None).all()
+    stale_claim = now - timedelta(minutes=current_app.config["REMINDER_CLAIM_TIMEOUT_MINUTES"])
 
-    for doc in due_docs:
-        if doc.reminder_at and window_start <= doc.reminder_at <= window_end:
-            unique_key = f"{doc.id}-{doc.reminder_at}"
-            if unique_key in sent_reminders:
-                continue
-            owner = User.query.get(doc.owner_id)
-            if owner:
-                subject = f"Reminder: {doc.filename}"
-                body = (
-                    f"Hi {owner.email},\n\n"
-                    f"Your document '{doc.filename}' is due soon.\n"
-                    f"Expiry Date: {doc.expiry_date}\n\n"
-                    f"Regards,\nFlyvia Docs"
-                )
-                success = send_email(owner.email, subject, body)
-                if success:
-                    sent_reminders.add(unique_key)
-                    audit(owner.id, "reminder_sent", f"Reminder for {doc.filename}")
+    # The mail queue holds a claim until it settles the message: renew the
+    # claims it is still working through, however long the backlog, so only
+    # claims left behind by a process that died ever go stale.
+    in_flight = [key[1] for key in mail_queue.pending_keys() if key[0] == "reminder"]
+    for i in range(0, len(in_flight), 500):
+        db.session.execute(
+            update(Document)
+            .where(Document.id.in_(in_flight[i:i + 500]), Document.reminder_sent_at == None)
+            .values(reminder_claimed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+
+    # Claim due, unsent reminders (served by the partial pending-reminder
+    # index) so a concurrent or restarted scheduler won't pick them up too.
+    claimed_ids = db.session.execute(
+        update(Document)
+        .where(
+            Document.reminder_sent_at == None,
+            Document.reminder_at >= window_start,
+            Document.reminder_at <= window_end,
+            or_(Document.reminder_claimed_at == None, Document.reminder_claimed_at < stale_claim),
+        )
+        .values(reminder_claimed_at=now)
+        .returning(Document.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    db.session.commit()
+    metrics.reminders_claimed.set(len(claimed_ids))
+    # Everything due and unsent, including claims still waiting on the mail queue
+    metrics.reminders_backlog.set(db.session.execute(
+        select(func.count()).select_from(Document).where(
+            Document.reminder_sent_at == None,
+            Document.reminder_at >= window_start,
+            Document.reminder_at <= window_end,
+        )
+    ).scalar())
+    if not claimed_ids:
+        return
+
+    due = db.session.execute(
+        select(Document, User)
+        .join(User, User.id == Document.owner_id)
+        .where(Document.id.in_(claimed_ids))
+        .order_by(Document.reminder_at)
+    ).all()
+
+    for doc, owner in due:
+        subject = f"Reminder: {doc.filename}"
+        body = (
+            f"Hi {owner.email},\n\n"
+            f"Your document '{doc.filename}' is due soon.\n"
+            f"Expiry Date: {doc.expiry_date}\n\n"
+            f"Regards,\nFlyvia Docs"
+        )
+        mail_queue.enqueue(
+            owner.email, subject, body,
+            on_sent=partial(_reminder_sent, current_app._get_current_object(), doc.id, owner.id, doc.filename),
+            on_failed=partial(_reminder_failed, current_app._get_current_object(), doc.id, owner.id, doc.filename),
+            key=("reminder", doc.id),
+        )
+
+def _reminder_sent(flask_app, doc_id, owner_id, filename):
+    with flask_app.app_context():
+        db.session.execute(
+            update(Document).where(Document.id == doc_id).values(reminder_sent_at=datetime.utcnow())
+        )
+        audit(owner_id, "reminder_sent", f"Reminder for {filename}")
+        db.session.commit()
 
-def run_reminder_job():
-    with app.app_context():
+def _reminder_failed(flask_app, doc_id, owner_id, filename, permanent):
+    with flask_app.app_context():
+        if permanent:
+            # Refused outright (bad address, 5xx): retrying every tick would
+            # only get the sender blocklisted, so settle it as done
+            db.session.execute(
+                update(Document).where(Document.id == doc_id).values(reminder_sent_at=datetime.utcnow())
+            )
+            audit(owner_id, "reminder_failed", f"Reminder for {filename} refused by the mail server")
+        else:
+            # Release the claim so the next tick retries it
+            db.session.execute(
+                update(Document).where(Document.id == doc_id).values(reminder_claimed_at=None)
+            )
+        db.session.commit()
+
+@metrics.track_job("reminder_job")
+def run_reminder_job(flask_app):
+    with flask_app.app_context():
         check_reminders()
 
-if not scheduler.get_job("reminder_job"):
-    scheduler.add_job(run_reminder_job, "interval", minutes=1, id="reminder_job", replace_existing=True)
+
+# ==========================================================
+# 📬 DAILY DIGEST
+# ==========================================================
+# In digest mode each user gets one email a day covering every due reminder
+# and every document about to expire. One grouped query finds all users
+# with something to report, so a tick costs (and sends) per user, not per
+# document.
+def digest_cutoff(now, hour):
+    """The latest scheduled digest time at or before `now`."""
+    cutoff = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    return cutoff if cutoff <= now else cutoff - timedelta(days=1)
+
+def send_digests():
+    now = datetime.utcnow()
+    today = now.date()
+    cutoff = digest_cutoff(now, current_app.config["REMINDER_DIGEST_HOUR"])
+    expiring_by = today + timedelta(days=current_app.config["EXPIRING_SOON_DAYS"])
+    # Unsent reminders that came due since the user's previous digest (a
+    # first digest looks back one day). A failed digest puts last_digest_at
+    # back, so its reminders are offered again.
+    reminder_due = and_(
+        Document.reminder_sent_at == None,
+        Document.reminder_at > func.coalesce(User.last_digest_at, cutoff - timedelta(days=1)),
+        Document.reminder_at <= now,
+    )
+    # Expiring from today up to EXPIRING_SOON_DAYS ahead; already expired
+    # documents are left out, unlike on the Expiring Soon page
+    expiring = and_(Document.expiry_date >= today, Document.expiry_date <= expiring_by)
+
+    rows = db.session.execute(
+        select(
+            User.id, User.email, User.last_digest_at,
+            func.json_group_array(func.json_object(
+                "id", Document.id,
+                "filename", Document.filename,
+                "expiry_date", Document.expiry_date,
+                "reminder", reminder_due,
+                "expiring", expiring,
+            )),
+        )
+        .join(Document, Document.owner_id == User.id)
+        .where(or_(User.last_digest_at == None, User.last_digest_at < cutoff))
+        .where(or_(reminder_due, expiring))
+        .group_by(User.id)
+    ).all()
+    if not rows:
+        return 0
+
+    # Claim the users so a concurrent or restarted scheduler skips them
+    claimed = set(db.session.execute(
+        update(User)
+        .where(User.id.in_([row.id for row in rows]))
+        .where(or_(User.last_digest_at == None, User.last_digest_at < cutoff))
+        .values(last_digest_at=now)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    db.session.commit()
+
+    flask_app = current_app._get_current_object()
+    for user_id, email, last_digest_at, docs_json in rows:
+        if user_id not in claimed:
+            continue
+        docs = sorted(json.loads(docs_json), key=lambda d: (d["expiry_date"] or "9999", d["filename"]))
+        reminders = [d for d in docs if d["reminder"]]
+        expiring_docs = [d for d in docs if d["expiring"]]
+        lines = [f"Hi {email},", "", f"Here is your Flyvia Docs summary for {today}.", ""]
+        if reminders:
+            lines.append("⏰ Reminders due:")
+            lines += [f"   • {d['filename']} (expiry: {d['expiry_date'] or 'N/A'})" for d in reminders]
+            lines.append("")
+        if expiring_docs:
+            lines.append(f"📅 Expiring within {current_app.config['EXPIRING_SOON_DAYS']} days:")
+            lines += [f"   • {d['filename']} — {d['expiry_date']}" for d in expiring_docs]
+            lines.append("")
+        lines += ["Regards,", "Flyvia Docs"]
+        mail_queue.enqueue(
+            email, f"Flyvia Docs: {len(docs)} document(s) need your attention", "\n".join(lines),
+            on_sent=partial(_digest_sent, flask_app, user_id, [d["id"] for d in reminders], len(docs)),
+            on_failed=partial(_digest_failed, flask_app, user_id, last_digest_at, [d["id"] for d in reminders]),
+        )
+    return len(claimed)
+
+def _digest_sent(flask_app, user_id, reminder_ids, count):
+    with flask_app.app_context(), db.session.begin():
+        if reminder_ids:
+            db.session.execute(
+                update(Document).where(Document.id.in_(reminder_ids)).values(reminder_sent_at=datetime.utcnow())
+            )
+        audit(user_id, "digest_sent", f"Daily digest with {count} documents")
+
+def _digest_failed(flask_app, user_id, last_digest_at, reminder_ids, permanent):
+    with flask_app.app_context():
+        if permanent:
+            # Refused outright: keep today's claim so the next attempt is
+            # tomorrow's digest, not every tick, and settle its reminders
+            if reminder_ids:
+                db.session.execute(
+                    update(Document).where(Document.id.in_(reminder_ids)).values(reminder_sent_at=datetime.utcnow())
+                )
+            audit(user_id, "digest_failed", "Daily digest refused by the mail server")
+        else:
+            # Put the previous send time back so the next tick retries the digest
+            db.session.execute(update(User).where(User.id == user_id).values(last_digest_at=last_digest_at))
+        db.session.commit()
+
+@metrics.track_job("digest_job")
+def run_digest_job(flask_app):
+    with flask_app.app_context():
+        send_digests()
+
+
+# ==========================================================
+# 🧹 RESUMABLE UPLOAD EXPIRY
+# ==========================================================
+def expire_upload_sessions():
+    """Discard resumable uploads nobody has touched within the TTL."""
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config["UPLOAD_SESSION_TTL_HOURS"])
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        ResumableBlob(storage.locate_blob(current_app.config["UPLOAD_FOLDER"], upload.stored_name), upload.length).remove()
+        db.session.delete(upload)
+    db.session.commit()
+    if stale:
+        print(f"🧹 Expired {len(stale)} stale upload sessions")
+
+@metrics.track_job("upload_expiry_job")
+def run_upload_expiry_job(flask_app):
+    with flask_app.app_context():
+        expire_upload_sessions()
+
+
+# ==========================================================
+# 🗑 STORAGE GC
+# ==========================================================
+def collect_garbage(full=False):
+    """Sweep the next slice of the uploads tree (or all of it) for orphaned files."""
+    report = storage.sweep_orphans(
+        current_app.config["UPLOAD_FOLDER"],
+        grace_minutes=current_app.config["GC_GRACE_MINUTES"],
+        max_dirs=None if full else current_app.config["GC_DIRS_PER_RUN"],
+        restart=full,
+    )
+    if report["removed"]:
+        print(f"🗑 Reclaimed {report['bytes'] / 2**20:.1f} MiB from {report['removed']} orphaned files")
+    return report
+
+@metrics.track_job("gc_job")
+def run_gc_job(flask_app):
+    with flask_app.app_context():
+        collect_garbage()
 
 
 # ==========================================================
 # 🆕 MOBILE COMPANION + EXPORT SUMMARY ROUTES
 # ==========================================================
-@app.route("/generate_qr")
-@login_required
-def generate_qr(user):
-    link = url_for("export_summary", _external=True)
+@lru_cache(maxsize=Config.QR_CACHE_SIZE)
+def qr_png_b64(link):
+    """The QR code for a link, rendered once per link."""
     qr = qrcode.make(link)
     buf = io.BytesIO()
     qr.save(buf, format="PNG")
-    qr_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    return jsonify({"qr_image": f"data:image/png;base64,{qr_b64}", "link": link})
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+@bp.route("/generate_qr")
+@login_required
+def generate_qr(user):
+    link = url_for("main.export_summary", _external=True)
+    etag = hashlib.sha256(link.encode()).hexdigest()[:32]
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    qr_b64 = qr_png_b64(link)
+    return with_validators(jsonify({"qr_image": f"data:image/png;base64,{qr_b64}", "link": link}), etag)
 
 
-@app.route("/export_summary")
+@bp.route("/export_summary")
 @login_required
 def export_summary(user):
+    # Weak: the text carries its generation time, but says the same thing
+    # until one of the user's documents changes
+    etag = f"summary-{user.id}-{listing_version(user)}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
     docs = Document.query.filter_by(owner_id=user.id).all()
     if not docs:
         return "No documents to summarize.", 404
@@ -253,58 +997,138 @@ def export_summary(user):
     response = make_response(output)
     response.headers["Content-Disposition"] = "attachment; filename=file_summary.txt"
     response.mimetype = "text/plain"
-    return response
+    return with_validators(response, etag, weak=True)
 
 
 # ==========================================================
 # 🖥 FRONTEND ROUTES
 # ==========================================================
-@app.route("/")
+@bp.route("/")
 def home():
     if "user_id" in session:
-        return redirect(url_for("home_page"))
+        return redirect(url_for("main.home_page"))
     return render_template("index.html")
 
-@app.route("/login-page")
+@bp.route("/login-page")
 def login_page():
     return render_template("login.html")
 
-@app.route("/signup-page")
+@bp.route("/signup-page")
 def signup_page():
     return render_template("signup.html")
 
 # 🏠 Home → Upload only
-@app.route("/home")
+@bp.route("/home")
 @login_required
 def home_page(user):
     return render_template("dashboard.html", docs=None, user=user)
 
 # 📄 My Documents
-@app.route("/documents")
+@bp.route("/documents")
 @login_required
 def documents_page(user):
-    docs = Document.query.filter_by(owner_id=user.id).all()
-    return render_template("dashboard.html", docs=docs, user=user)
+    return render_document_list(user)
 
 # ⏰ Expiring Soon
-@app.route("/expiring")
+@bp.route("/expiring")
 @login_required
 def expiring_page(user):
     today = datetime.utcnow().date()
+    # The list only changes with the user's documents or the date
+    etag = f"expiring-{user.id}-{listing_version(user)}-{today}"
+    cached = not_modified(etag, weak=True)
+    if cached:
+        return cached
     docs = Document.query.filter(
         Document.owner_id == user.id,
         Document.expiry_date != None,
-        Document.expiry_date <= today + timedelta(days=7)
+        Document.expiry_date <= today + timedelta(days=current_app.config["EXPIRING_SOON_DAYS"])
     ).all()
-    return render_template("dashboard.html", docs=docs, user=user)
+    return with_validators(make_response(render_template("dashboard.html", docs=docs, user=user)), etag, weak=True)
 
 # ⚙️ Settings
-@app.route("/settings")
+@bp.route("/settings")
 @login_required
 def settings_page(user):
     return render_template("settings.html", user=user)
 
 
+# ==========================================================
+# 🛠 CLI COMMANDS
+# ==========================================================
+@bp.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Add new columns and indexes to an existing database."""
+    with leader.exclusive_lock(current_app.config["SCHEMA_LOCK_FILE"]):
+        upgrade_schema()
+        search.ensure_index()
+    print("✅ Database schema is up to date")
+
+
+@bp.cli.command("migrate-storage")
+@click.option("--workers", default=8, show_default=True, help="Files moved in parallel.")
+def migrate_storage_command(workers):
+    """Move blobs from the flat uploads/ directory into the sharded layout."""
+    in_progress = set(db.session.execute(select(UploadSession.stored_name)).scalars())
+    report = storage.migrate_flat_files(current_app.config["UPLOAD_FOLDER"], workers=workers, skip=in_progress)
+    print(f"📦 Moved {report['moved']} files ({report['bytes'] / 2**20:.1f} MiB) in {report['seconds']}s; "
+          f"{report['skipped']} in-progress uploads left in place")
+
+
+@bp.cli.command("gc-storage")
+@click.option("--full", is_flag=True, help="Sweep the whole tree instead of the next slice.")
+def gc_storage_command(full):
+    """Remove files in uploads/ that no document, blob or upload refers to."""
+    report = collect_garbage(full)
+    for key, value in report.items():
+        print(f"{key:>10}: {value}")
+
+
+@bp.cli.command("rotate-keys")
+@click.option("--workers", default=4, show_default=True, help="Blobs re-encrypted in parallel.")
+@click.option("--max-mb-s", type=float, default=None, help="Read budget in MB/s (default ROTATION_MAX_MB_S).")
+@click.option("--limit", type=int, default=None, help="Stop after this many blobs.")
+def rotate_keys_command(workers, max_mb_s, limit):
+    """Re-encrypt every blob under the active key (ENCRYPTION_KEY_ID); safe to interrupt and re-run.
+
+    Dedup fingerprints are re-keyed with the blobs. To retire a key
+    (ENCRYPTION_KEY included): add the new key to ENCRYPTION_KEYS, make it
+    ENCRYPTION_KEY_ID and restart; run this until the old key is no longer
+    listed as in use (resumable uploads started under it finish or expire
+    after UPLOAD_SESSION_TTL_HOURS); then remove the old key from the
+    configuration, or leave ENCRYPTION_KEY unset.
+    """
+    def progress(report):
+        print(f"🔑 {report['rotated']} blobs, {report['bytes'] / 2**20:.1f} MiB, {report['mb_s']} MB/s")
+
+    report = rotation.rotate_keys(
+        current_app.config["UPLOAD_FOLDER"], ACTIVE_KEY_ID, workers=workers, limit=limit, progress=progress,
+        max_mb_s=current_app.config["ROTATION_MAX_MB_S"] if max_mb_s is None else max_mb_s,
+    )
+    for key, value in report.items():
+        print(f"{key:>8}: {value}")
+    print(f"🗑 Replaced files are reclaimed by the storage GC after {current_app.config['GC_GRACE_MINUTES']} minutes")
+    in_use = sorted("ENCRYPTION_KEY" if key_id is None else key_id for key_id in rotation.keys_in_use())
+    print(f"🔑 Keys still in use: {', '.join(in_use) or 'none'}")
+
+
+@bp.cli.command("storage-report")
+def storage_report_command():
+    """Print how much space deduplication saves."""
+    report = storage.report()
+    for key, value in report.items():
+        print(f"{key:>14}: {value}")
+
+
+def __getattr__(name):
+    # `app:app` (gunicorn, flask run) and `from app import app` get a default
+    # app built on first use rather than at import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    create_app().run(host="0.0.0.0", port=8080, debug=True)
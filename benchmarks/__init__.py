@@ -0,0 +1,42 @@
+"""Offline benchmarks for Flyvia Docs.
+
+Run a benchmark with ``python -m benchmarks.<name>``, or the regression
+suite with ``python -m benchmarks --json out.json --baseline base.json``.
+They use a throwaway SQLite database and encryption key, never the real
+app.db or uploads/.
+"""
+import os
+import base64
+import tempfile
+
+# utils.py refuses to import without a key; benchmarks never touch real data.
+# Point the real app (when a benchmark imports it) at a scratch directory too.
+_SCRATCH = tempfile.mkdtemp(prefix="flyvia-bench-")
+os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_SCRATCH, 'app.db')}")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_SCRATCH, "uploads"))
+# Scheduled jobs (reminder emails, GC) have no place in a benchmark run
+os.environ.setdefault("SCHEDULER_ENABLED", "0")
+
+
+def make_bench_app(workdir=None, **config):
+    """A Flask app bound to a scratch database and upload folder."""
+    from flask import Flask
+    from config import Config
+    from models import init_db, upgrade_schema
+
+    workdir = workdir or tempfile.mkdtemp(prefix="flyvia-bench-")
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(uploads, exist_ok=True)
+
+    bench_app = Flask("flyvia_bench")
+    bench_app.config.from_object(Config)
+    bench_app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        UPLOAD_FOLDER=uploads,
+    )
+    bench_app.config.update(config)
+    init_db(bench_app)
+    with bench_app.app_context():
+        upgrade_schema()
+    return bench_app
@@ -0,0 +1,102 @@
+"""Run benchmark suites, save the results as JSON and compare with a baseline.
+
+    python -m benchmarks --json results.json
+    python -m benchmarks --suite crypto --suite load --baseline results.json --tolerance 0.15
+
+Each suite is a benchmarks module whose run() returns flat metrics; the
+default set is quick enough for every change. Metrics ending in _ms or _s
+are times (lower is better), those ending in _per_s or _mb_s are rates
+(higher is better); everything else is context and is not compared. The
+exit status is 1 when any compared metric regressed past the tolerance.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+DEFAULT_SUITES = ["crypto", "load"]
+
+
+def direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if not compared."""
+    if metric.endswith(("_per_s", "_mb_s")):
+        return 1
+    if metric.endswith(("_ms", "_s")):
+        return -1
+    return 0
+
+
+def compare(results, baseline, tolerance):
+    """Rows of (suite, metric, baseline, current, change) plus the regressed subset."""
+    rows, regressions = [], []
+    for suite, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(suite, {}).get(metric)
+            sign = direction(metric)
+            if not sign or not isinstance(before, (int, float)) or not before:
+                continue
+            change = (value - before) / before
+            rows.append((suite, metric, before, value, change))
+            if change * sign < -tolerance:
+                regressions.append(rows[-1])
+    return rows, regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="append",
+                        help=f"benchmarks.bench_<suite> to run; repeatable (default: {', '.join(DEFAULT_SUITES)})")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="relative slowdown allowed before a metric counts as a regression")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for suite in args.suite or DEFAULT_SUITES:
+        print(f"▶ {suite}", file=sys.stderr)
+        report["results"][suite] = importlib.import_module(f"benchmarks.bench_{suite}").run()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        rows, regressions = compare(report["results"], baseline, args.tolerance)
+        for suite, metric, before, value, change in rows:
+            flag = " ❌" if (suite, metric, before, value, change) in regressions else ""
+            print(f"{suite + '.' + metric:>48}: {before} → {value} ({change:+.1%}){flag}", file=sys.stderr)
+        if regressions:
+            print(f"❌ {len(regressions)} metric(s) regressed more than {args.tolerance:.0%}", file=sys.stderr)
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Audit log inserts: commit-per-entry vs. the buffered bulk writer.
+
+    python -m benchmarks.bench_audit --entries 5000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from benchmarks import make_bench_app
+
+
+def run(entries=5000):
+    from models import db, AuditLog
+    from utils import audit, audit_buffer
+
+    bench_app = make_bench_app()
+    results = {"entries": entries}
+    with bench_app.app_context():
+        # What audit() used to do: one row, one transaction, one fsync
+        t0 = time.perf_counter()
+        for i in range(entries):
+            db.session.add(AuditLog(user_id=1, action="upload", detail=f"doc {i}",
+                                    timestamp=datetime.utcnow()))
+            db.session.commit()
+        results["per_commit_inserts_per_s"] = round(entries / (time.perf_counter() - t0), 1)
+
+        audit_buffer.app = bench_app
+        t0 = time.perf_counter()
+        for i in range(entries):
+            audit(1, "upload", f"doc {i}")
+        audit_buffer.flush()
+        results["buffered_inserts_per_s"] = round(entries / (time.perf_counter() - t0), 1)
+        results["rows"] = AuditLog.query.count()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=5000)
+    args = parser.parse_args()
+    for key, value in run(args.entries).items():
+        print(f"{key:>26}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Compression before encryption: stored size and throughput per codec.
+
+Runs over a generated mixed corpus (text PDFs, scanned/Flate PDFs, PNGs and
+JPEG-like files), or over real files with --corpus DIR. "range_tail_ms" is
+the time to read the last 64 KiB of a file, as a viewer seeking to its end
+would (compressed blobs decompress up to the offset; see
+COMPRESSION_MAX_BYTES).
+
+    python -m benchmarks.bench_compression --files 40 --size-kb 512
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+import benchmarks  # noqa: F401  (scratch key)
+
+WORDS = ["account", "balance", "statement", "policy", "premium", "passport", "renewal",
+         "invoice", "total", "due", "reference", "insured", "period", "amount", "tax"]
+
+
+def _text_pdf(rng, size):
+    lines, total = [b"%PDF-1.4\n1 0 obj << /Length 0 >>\nstream\n"], 0
+    while total < size:
+        line = b"BT /F1 10 Tf 72 %d Td (%s) Tj ET\n" % (
+            rng.randrange(800), " ".join(rng.choice(WORDS) for _ in range(8)).encode())
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines) + b"endstream\nendobj\n%%EOF\n"
+
+
+def _scanned_pdf(rng, size):
+    image = zlib.compress(bytes(rng.getrandbits(8) & 0xF0 for _ in range(size)), 6)
+    return (b"%%PDF-1.4\n1 0 obj << /Filter /FlateDecode /Length %d >>\nstream\n" % len(image)
+            + image + b"\nendstream\nendobj\n%%EOF\n")
+
+
+def _png(rng, size):
+    width = 512
+    rows = max(1, size // (width * 3))
+    raw = b"".join(b"\x00" + bytes((x + y + rng.randrange(16)) & 0xFF for x in range(width * 3))
+                   for y in range(rows))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, rows, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b"")
+
+
+def _jpeg_like(rng, size):
+    # Entropy-coded scan data is effectively random, which is what matters here
+    return b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + rng.randbytes(size) + b"\xff\xd9"
+
+
+GENERATORS = {"pdf-text": _text_pdf, "pdf-scan": _scanned_pdf, "png": _png, "jpg": _jpeg_like}
+
+
+def make_corpus(n_files, size_kb, seed=7):
+    rng = random.Random(seed)
+    kinds = list(GENERATORS)
+    return [(kinds[i % len(kinds)], GENERATORS[kinds[i % len(kinds)]](rng, size_kb * 1024)) for i in range(n_files)]
+
+
+def load_corpus(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                corpus.append((name.rsplit(".", 1)[-1].lower(), f.read()))
+    return corpus
+
+
+def run(n_files=40, size_kb=512, corpus_dir=None):
+    from utils import zstandard
+
+    corpus = load_corpus(corpus_dir) if corpus_dir else make_corpus(n_files, size_kb)
+    original = sum(len(data) for _, data in corpus)
+    codecs = ["none", "zlib"] + (["zstd"] if zstandard is not None else []) + ["auto"]
+    workdir = tempfile.mkdtemp(prefix="flyvia-bench-")
+
+    results = {"files": len(corpus), "original_mb": round(original / 2**20, 1)}
+    try:
+        for codec in codecs:
+            _measure(codec, corpus, original, workdir, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _measure(codec, corpus, original, workdir, results):
+    """Store the corpus with one codec policy, then read it all back."""
+    from utils import choose_stream_codec, save_encrypted_stream, iter_plaintext
+
+    stored, by_kind = 0, {}
+    t0 = time.perf_counter()
+    paths = []
+    for i, (kind, data) in enumerate(corpus):
+        stream = io.BytesIO(data)
+        chosen = choose_stream_codec(stream) if codec == "auto" else (None if codec == "none" else codec)
+        path = os.path.join(workdir, f"{codec}-{i}.bin")
+        save_encrypted_stream(path, stream, chosen)
+        size = os.path.getsize(path)
+        stored += size
+        kind_stored, kind_original = by_kind.get(kind, (0, 0))
+        by_kind[kind] = (kind_stored + size, kind_original + len(data))
+        paths.append((path, chosen, len(data)))
+    write_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for path, chosen, _ in paths:
+        for _ in iter_plaintext(path, codec=chosen):
+            pass
+    read_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for path, chosen, length in paths:
+        for _ in iter_plaintext(path, codec=chosen, start=max(0, length - 64 * 1024), end=length):
+            pass
+    range_s = time.perf_counter() - t0
+
+    results[f"{codec}_ratio"] = round(stored / original, 3)
+    for kind, (kind_stored, kind_original) in sorted(by_kind.items()):
+        results[f"{codec}_{kind}_ratio"] = round(kind_stored / kind_original, 3)
+    results[f"{codec}_write_mb_s"] = round(original / 2**20 / write_s, 1)
+    results[f"{codec}_read_mb_s"] = round(original / 2**20 / read_s, 1)
+    results[f"{codec}_range_tail_ms"] = round(range_s * 1000 / len(paths), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--size-kb", type=int, default=512)
+    parser.add_argument("--corpus", help="directory of real PDF/PNG/JPG files to use instead")
+    args = parser.parse_args()
+    for key, value in run(args.files, args.size_kb, args.corpus).items():
+        print(f"{key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
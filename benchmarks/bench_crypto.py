@@ -0,0 +1,88 @@
+"""Encryption and file I/O primitives across file sizes.
+
+Times the single-blob helpers (encrypt_bytes, decrypt_bytes, save_file_bytes,
+read_file_bytes_as_b64) next to the segmented streaming path that uploads
+and downloads use, with seeded payloads.
+
+    python -m benchmarks.bench_crypto --sizes-kb 1,64,1024,8192 --repeat 20
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import benchmarks  # noqa: F401  (scratch key)
+
+
+def _median_s(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def _label(size_kb):
+    return f"{size_kb // 1024}m" if size_kb >= 1024 and size_kb % 1024 == 0 else f"{size_kb}k"
+
+
+def run(sizes_kb=(1, 64, 1024, 8192), repeat=20, seed=42):
+    from utils import (decrypt_bytes, encrypt_bytes, iter_plaintext, read_file_bytes_as_b64,
+                       save_encrypted_stream, save_file_bytes)
+
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="flyvia-bench-")
+    results = {"repeat": repeat}
+    try:
+        for size_kb in sizes_kb:
+            data = rng.randbytes(size_kb * 1024)
+            mb = len(data) / 2**20
+            label = _label(size_kb)
+            nonce, cipher = encrypt_bytes(data)
+            path = os.path.join(workdir, f"{label}.bin")
+            stream_path = os.path.join(workdir, f"{label}.seg")
+            save_file_bytes(path, cipher)
+
+            def stream_write():
+                save_encrypted_stream(stream_path, io.BytesIO(data))
+
+            def stream_read():
+                for _ in iter_plaintext(stream_path):
+                    pass
+
+            stream_write()
+            ops = {
+                "encrypt_bytes": lambda: encrypt_bytes(data),
+                "decrypt_bytes": lambda: decrypt_bytes(nonce, cipher),
+                "save_file_bytes": lambda: save_file_bytes(path, cipher),
+                "read_file_bytes_as_b64": lambda: read_file_bytes_as_b64(path),
+                "stream_write": stream_write,
+                "stream_read": stream_read,
+            }
+            for op, fn in ops.items():
+                seconds = _median_s(fn, repeat)
+                results[f"{op}_{label}_ms"] = round(seconds * 1000, 3)
+                results[f"{op}_{label}_mb_s"] = round(mb / seconds, 1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes-kb", default="1,64,1024,8192")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    sizes = tuple(int(s) for s in args.sizes_kb.split(","))
+    for key, value in run(sizes, args.repeat, args.seed).items():
+        print(f"{key:>32}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Reminder emails: one per document (check_reminders) vs. the daily digest.
+
+    python -m benchmarks.bench_digest --users 2000 --docs-per-user 50 --due 0.1 --expiring 0.05
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+
+from benchmarks import make_bench_app
+
+
+def seed(n_users, docs_per_user, due, expiring, seed=42):
+    """Users with documents; `due`/`expiring` are the fractions due now / expiring this week."""
+    from models import db, User, Document
+
+    db.session.execute(insert(User), [
+        {"email": f"user{i}@bench.local", "password_hash": "x"} for i in range(n_users)
+    ])
+    now = datetime.utcnow()
+    rng = random.Random(seed)
+    for owner in range(1, n_users + 1):
+        db.session.execute(insert(Document), [{
+            "owner_id": owner,
+            "filename": f"doc{owner}-{i}.pdf",
+            "stored_name": f"{owner}-{i}.bin",
+            "reminder_at": now - timedelta(minutes=5) if rng.random() < due
+            else now + timedelta(minutes=rng.randint(60, 365 * 24 * 60)),
+            "expiry_date": (now + timedelta(days=rng.randint(0, 6) if rng.random() < expiring
+                                            else rng.randint(30, 3 * 365))).date(),
+        } for i in range(docs_per_user)])
+    db.session.commit()
+
+
+def run(n_users=2000, docs_per_user=50, due=0.1, expiring=0.05):
+    import app as app_module
+    from mailer import MailQueue
+    from models import db, Document
+
+    bench_app = make_bench_app()
+    results = {"users": n_users, "documents": n_users * docs_per_user}
+    with bench_app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        seed(n_users, docs_per_user, due, expiring)
+
+        # Queues that are never started: count the emails, send nothing
+        app_module.mail_queue = MailQueue()
+        t0 = time.perf_counter()
+        app_module.check_reminders()
+        results["per_document_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        results["per_document_emails"] = app_module.mail_queue.stats()["queued"]
+
+        db.session.execute(update(Document).values(reminder_claimed_at=None))
+        db.session.commit()
+        app_module.mail_queue = MailQueue()
+        t0 = time.perf_counter()
+        app_module.send_digests()
+        results["digest_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        results["digest_emails"] = app_module.mail_queue.stats()["queued"]
+
+        # Everyone has had today's digest: the next ticks find nothing
+        t0 = time.perf_counter()
+        app_module.send_digests()
+        results["idle_digest_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--docs-per-user", type=int, default=50)
+    parser.add_argument("--due", type=float, default=0.1)
+    parser.add_argument("--expiring", type=float, default=0.05)
+    args = parser.parse_args()
+    for key, value in run(args.users, args.docs_per_user, args.due, args.expiring).items():
+        print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
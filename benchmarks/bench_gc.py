@@ -0,0 +1,74 @@
+"""Storage GC: sweep rate over a sharded tree with live and orphaned files.
+
+    python -m benchmarks.bench_gc --files 100000 --orphan-ratio 0.2
+"""
+import argparse
+import os
+import time
+import uuid
+
+from benchmarks import make_bench_app
+
+
+def run(n_files=100_000, orphan_ratio=0.2, dirs_per_run=None):
+    from sqlalchemy import insert
+    from models import db, User, Document
+    from storage import new_blob_path, sweep_orphans
+
+    app = make_bench_app()
+    folder = app.config["UPLOAD_FOLDER"]
+    old = time.time() - 2 * 3600
+    live = []
+    n_orphans = int(n_files * orphan_ratio)
+    for i in range(n_files):
+        name = f"{uuid.uuid4()}.bin"
+        path = new_blob_path(folder, name)
+        with open(path, "wb") as f:
+            f.write(b"\0" * 1024)
+        os.utime(path, (old, old))
+        if i >= n_orphans:
+            live.append(name)
+
+    with app.app_context():
+        user = User(email="gc@bench.local", password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+        db.session.execute(insert(Document), [
+            {"owner_id": user.id, "filename": "f.pdf", "stored_name": name} for name in live
+        ])
+        db.session.commit()
+
+        runs, removed, reclaimed = 0, 0, 0
+        t0 = time.perf_counter()
+        while True:
+            report = sweep_orphans(folder, grace_minutes=60, max_dirs=dirs_per_run)
+            runs += 1
+            removed += report["removed"]
+            reclaimed += report["bytes"]
+            if report["checkpoint"] is None:
+                break
+        elapsed = time.perf_counter() - t0
+
+    return {
+        "files": n_files,
+        "orphans": n_orphans,
+        "runs": runs,
+        "removed": removed,
+        "reclaimed_mb": round(reclaimed / 2**20, 1),
+        "seconds": round(elapsed, 2),
+        "files_per_s": round(n_files / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--orphan-ratio", type=float, default=0.2)
+    parser.add_argument("--dirs-per-run", type=int, help="incremental sweep size (default: one full pass)")
+    args = parser.parse_args()
+    for key, value in run(args.files, args.orphan_ratio, args.dirs_per_run).items():
+        print(f"{key:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
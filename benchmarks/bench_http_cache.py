@@ -0,0 +1,67 @@
+"""Repeat views with and without validators: download, export summary, QR.
+
+    python -m benchmarks.bench_http_cache --size-kb 2048 --docs 200 --repeat 50
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import benchmarks  # noqa: F401  (scratch database, uploads and key)
+
+
+def _timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - t0) / repeat * 1000, 2)
+
+
+def run(size_kb=2048, n_docs=200, repeat=50):
+    import app as app_module
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        user = User(email=f"cache{time.time_ns()}@bench.local", password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post("/upload", data={"file": (io.BytesIO(os.urandom(size_kb * 1024)), "scan.png")},
+                    content_type="multipart/form-data")
+        for i in range(n_docs - 1):
+            client.post("/upload", data={"file": (io.BytesIO(os.urandom(64)), f"doc{i}.png")},
+                        content_type="multipart/form-data")
+    doc_id = client.get("/api/documents?limit=200").get_json()["documents"][-1]["id"]
+
+    results = {"size_kb": size_kb, "docs": n_docs}
+    for name, url in (("download", f"/download/{doc_id}"), ("summary", "/export_summary"),
+                      ("qr", "/generate_qr")):
+        etag = client.get(url).headers["ETag"]
+        if name == "qr":
+            app_module.qr_png_b64.cache_clear()
+            results["qr_uncached_ms"] = _timed(lambda: (app_module.qr_png_b64.cache_clear(), client.get(url).data),
+                                               repeat)
+        results[f"{name}_full_ms"] = _timed(lambda: client.get(url).data, repeat)
+        results[f"{name}_304_ms"] = _timed(lambda: client.get(url, headers={"If-None-Match": etag}).data, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for key, value in run(args.size_kb, args.docs, args.repeat).items():
+        print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""SQL statements per request through login_required, with and without the
+identity cache.
+
+    python -m benchmarks.bench_identity_cache --users 50 --requests 2000
+"""
+import argparse
+import random
+import time
+
+import benchmarks  # noqa: F401  (scratch database and key)
+
+ROUTES = ("/home", "/api/documents?limit=10", "/generate_qr", "/settings")
+
+
+def run(n_users=50, n_requests=2000):
+    from sqlalchemy import event, insert
+    from app import app
+    from models import db, User
+    from utils import identity_cache
+
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"email": f"load{i}@bench.local", "password_hash": "x"} for i in range(n_users)
+        ])
+        db.session.commit()
+        user_ids = [u.id for u in User.query.filter(User.email.like("load%@bench.local"))]
+        engine = db.engine
+
+    statements = [0]
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.__setitem__(0, statements[0] + 1))
+
+    clients = []
+    for user_id in user_ids:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        clients.append(client)
+
+    results = {"users": n_users, "requests": n_requests}
+    original_size = identity_cache.maxsize
+    for label, size in (("uncached", 0), ("cached", original_size)):
+        identity_cache.maxsize = size
+        identity_cache.clear()
+        identity_cache.hits = identity_cache.misses = 0
+        rng = random.Random(5)
+        statements[0] = 0
+        t0 = time.perf_counter()
+        for _ in range(n_requests):
+            rng.choice(clients).get(rng.choice(ROUTES))
+        elapsed = time.perf_counter() - t0
+        results[f"{label}_queries_per_request"] = round(statements[0] / n_requests, 3)
+        results[f"{label}_requests_per_s"] = round(n_requests / elapsed, 1)
+        results[f"{label}_hit_rate"] = identity_cache.stats()["hit_rate"]
+    identity_cache.maxsize = original_size
+    results["queries_saved_per_request"] = round(
+        results["uncached_queries_per_request"] - results["cached_queries_per_request"], 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    for key, value in run(args.users, args.requests).items():
+        print(f"{key:>30}: {value}")
+
+
+if __name__ == "__main__":
+    main()
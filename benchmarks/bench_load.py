@@ -0,0 +1,137 @@
+"""Request-level load driver over a seeded dataset.
+
+Loads a synthetic dataset (see benchmarks.datagen) into the app's scratch
+database, then drives upload, download, /documents, /expiring and the
+reminder tick through the Flask test client, optionally from several
+threads. Reports latency percentiles and throughput per scenario. Email is
+queued but never sent, so the run needs no network.
+
+    python -m benchmarks.bench_load --users 10 --docs-per-user 100 --requests 200 --concurrency 4
+"""
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmarks  # noqa: F401  (scratch database, uploads and key)
+
+
+def _summarise(name, samples, wall_s, results):
+    samples = sorted(samples)
+    cuts = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+    results[f"{name}_p50_ms"] = round(cuts[49] * 1000, 2)
+    results[f"{name}_p95_ms"] = round(cuts[94] * 1000, 2)
+    results[f"{name}_p99_ms"] = round(cuts[98] * 1000, 2)
+    results[f"{name}_req_per_s"] = round(len(samples) / wall_s, 1)
+
+
+def _drive(app, user_ids, requests, concurrency, make_request):
+    """Spread `requests` calls over `concurrency` logged-in clients; returns (latencies, wall time)."""
+    def worker(slot):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_ids[slot % len(user_ids)]
+        latencies = []
+        for i in range(slot, requests, concurrency):
+            t0 = time.perf_counter()
+            response = make_request(client, i)
+            response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                raise RuntimeError(f"request {i} failed with {response.status_code}")
+        return latencies
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [s for batch in pool.map(worker, range(concurrency)) for s in batch]
+    return latencies, time.perf_counter() - t0
+
+
+def run(users=10, docs_per_user=100, requests=200, concurrency=1, upload_kb=256, ticks=20, seed=42):
+    from sqlalchemy import select, update
+    from datetime import datetime
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+        from app import app
+    from benchmarks.datagen import generate
+    from mailer import MailQueue
+    from models import db, Document
+
+    # Never started: reminder emails pile up in memory instead of going out
+    app_module.mail_queue = MailQueue()
+
+    dataset = generate(app, users, docs_per_user, sizes_kb=(4, 64, 256), seed=seed)
+    user_ids = dataset["user_ids"]
+    with app.app_context():
+        doc_ids = {
+            owner: ids for owner, ids in
+            ((owner, db.session.execute(select(Document.id).where(Document.owner_id == owner)).scalars().all())
+             for owner in user_ids)
+        }
+
+    rng = random.Random(seed)
+    upload_payload = rng.randbytes(upload_kb * 1024)
+    picks = [rng.random() for _ in range(requests)]
+    results = {"users": users, "documents": dataset["documents"], "requests": requests,
+               "concurrency": concurrency, "dataset_s": dataset["seconds"]}
+
+    def download(client, i):
+        with client.session_transaction() as sess:
+            ids = doc_ids[sess["user_id"]]
+        return client.get(f"/download/{ids[int(picks[i] * len(ids))]}")
+
+    scenarios = {
+        "upload": lambda client, i: client.post(
+            "/upload", data={"file": (io.BytesIO(i.to_bytes(8, "big") + upload_payload), f"load{i}.png")},
+            content_type="multipart/form-data"),
+        "download": download,
+        "documents": lambda client, i: client.get("/documents"),
+        "expiring": lambda client, i: client.get("/expiring"),
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, make_request in scenarios.items():
+            latencies, wall_s = _drive(app, user_ids, requests, concurrency, make_request)
+            _summarise(name, latencies, wall_s, results)
+
+        # Reminder tick: re-arm the due reminders (and empty the queue, which
+        # would otherwise keep renewing their claims) before each run so
+        # every tick claims and queues the same batch
+        latencies = []
+        with app.app_context():
+            for _ in range(ticks):
+                app_module.mail_queue = MailQueue()
+                db.session.execute(
+                    update(Document).where(Document.reminder_at <= datetime.utcnow())
+                    .values(reminder_claimed_at=None, reminder_sent_at=None)
+                )
+                db.session.commit()
+                t0 = time.perf_counter()
+                app_module.check_reminders()
+                latencies.append(time.perf_counter() - t0)
+        _summarise("check_reminders", latencies, sum(latencies), results)
+    results["reminders_per_tick"] = dataset["due_reminders"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--docs-per-user", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--upload-kb", type=int, default=256)
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    results = run(args.users, args.docs_per_user, args.requests, args.concurrency, args.upload_kb,
+                  args.ticks, args.seed)
+    for key, value in results.items():
+        print(f"{key:>26}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Email throughput: one SMTP connection per message vs. the pooled MailQueue.
+
+Needs a local stand-in server: ``pip install aiosmtpd``.
+
+    python -m benchmarks.bench_mail --messages 500 --workers 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import socket
+import time
+
+import benchmarks  # noqa: F401  (sets a throwaway ENCRYPTION_KEY)
+
+
+class _Sink:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(messages=500, workers=4, batch_size=20):
+    from aiosmtpd.controller import Controller
+    from mailer import MailQueue
+    from utils import send_email
+
+    sink = _Sink()
+    controller = Controller(sink, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    os.environ.update(SMTP_HOST="127.0.0.1", SMTP_PORT=str(controller.port),
+                      SMTP_STARTTLS="0", FROM_EMAIL="bench@flyvia.local")
+    os.environ.pop("SMTP_USER", None)
+    results = {"messages": messages, "workers": workers}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for i in range(messages):
+                send_email(f"user{i}@bench.local", "Reminder", "body")
+            per_message_s = time.perf_counter() - t0
+
+            mail_queue = MailQueue(workers=workers, batch_size=batch_size).start()
+            t0 = time.perf_counter()
+            for i in range(messages):
+                mail_queue.enqueue(f"user{i}@bench.local", "Reminder", "body")
+            enqueue_s = time.perf_counter() - t0
+            mail_queue.flush()
+            pooled_s = time.perf_counter() - t0
+            mail_queue.stop()
+    finally:
+        controller.stop()
+
+    results["per_message_msgs_per_s"] = round(messages / per_message_s, 1)
+    results["pooled_msgs_per_s"] = round(messages / pooled_s, 1)
+    results["enqueue_ms"] = round(enqueue_s * 1000, 1)
+    results["received"] = sink.received
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20)
+    args = parser.parse_args()
+    for key, value in run(args.messages, args.workers, args.batch_size).items():
+        print(f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    main()
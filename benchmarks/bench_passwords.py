@@ -0,0 +1,118 @@
+"""Login storm: login latency and concurrent download latency per KDF mode.
+
+Runs download traffic alone, then alongside a burst of logins with the
+password KDF on the request threads ("inline") and on the bounded process
+pool ("pool"). Logins beyond the pool's queue limit get 503s, counted as
+"rejected".
+
+    python -m benchmarks.bench_passwords --logins 200 --login-threads 16 --workers 2 --max-pending 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmarks  # noqa: F401  (scratch database, uploads and key)
+
+
+def _percentiles(prefix, samples, results):
+    if len(samples) < 2:
+        return
+    cuts = statistics.quantiles(samples, n=100)
+    results[f"{prefix}_p50_ms"] = round(cuts[49] * 1000, 1)
+    results[f"{prefix}_p99_ms"] = round(cuts[98] * 1000, 1)
+
+
+def _logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    return client
+
+
+def run(logins=200, login_threads=16, workers=2, max_pending=8, method="scrypt"):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+        from app import app
+    from models import db, User
+    from passwords import PasswordHasher
+
+    email = f"storm{time.time_ns()}@bench.local"
+    inline = PasswordHasher(method, workers=0, max_pending=logins)
+    with app.app_context():
+        user = User(email=email, password_hash=inline.hash("hunter2"))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    downloader = _logged_in_client(app, user_id)
+    with contextlib.redirect_stdout(io.StringIO()):
+        downloader.post("/upload", data={"file": (io.BytesIO(os.urandom(256 * 1024)), "scan.png")},
+                        content_type="multipart/form-data")
+    doc_id = downloader.get("/api/documents").get_json()["documents"][0]["id"]
+
+    def downloads_until(done):
+        samples = []
+        while not done.is_set():
+            t0 = time.perf_counter()
+            downloader.get(f"/download/{doc_id}").get_data()
+            samples.append(time.perf_counter() - t0)
+        return samples
+
+    results = {"logins": logins, "login_threads": login_threads, "workers": workers, "max_pending": max_pending}
+    done = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(downloads_until, done)
+        time.sleep(2)
+        done.set()
+        _percentiles("idle_download", future.result(), results)
+
+    pooled = PasswordHasher(method, workers=workers, max_pending=max_pending)
+    pooled.hash("warm-up")  # start the worker processes outside the timing
+    for mode, hasher in (("inline", inline), ("pool", pooled)):
+        app_module.password_hasher = hasher
+        latencies, statuses = [], []
+        lock = threading.Lock()
+
+        def login(_):
+            client = app.test_client()
+            t0 = time.perf_counter()
+            response = client.post("/login", data={"email": email, "password": "hunter2"})
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+                statuses.append(response.status_code)
+
+        done = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as background:
+            downloads = background.submit(downloads_until, done)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=login_threads) as pool:
+                list(pool.map(login, range(logins)))
+            wall_s = time.perf_counter() - t0
+            done.set()
+            _percentiles(f"{mode}_download", downloads.result(), results)
+        # Rejections return in microseconds; the percentiles are for logins that ran
+        _percentiles(f"{mode}_login", [t for t, status in zip(latencies, statuses) if status == 302], results)
+        results[f"{mode}_logins_per_s"] = round(statuses.count(302) / wall_s, 1)
+        results[f"{mode}_rejected"] = statuses.count(503)
+    pooled.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--login-threads", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=8)
+    parser.add_argument("--method", default="scrypt")
+    args = parser.parse_args()
+    for key, value in run(args.logins, args.login_threads, args.workers, args.max_pending, args.method).items():
+        print(f"{key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
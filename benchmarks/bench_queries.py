@@ -0,0 +1,109 @@
+"""Hot queries on a default SQLite file vs. the performance profile + indexes.
+
+Times the queries behind /documents (full list and one keyset page),
+/expiring and the reminder scan.
+
+    python -m benchmarks.bench_queries --docs 100000
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks import make_bench_app
+
+NEW_INDEXES = ("ix_document_owner_uploaded", "ix_document_owner_expiry", "ix_document_reminder_pending")
+
+
+def seed(n_docs, n_users):
+    from models import db, User, Document
+
+    db.session.execute(insert(User), [
+        {"email": f"user{i}@bench.local", "password_hash": "x"} for i in range(n_users)
+    ])
+    rng, now, today = random.Random(7), datetime.utcnow(), date.today()
+    rows = [{
+        "owner_id": rng.randint(1, n_users),
+        "filename": f"doc{i}.pdf",
+        "stored_name": f"{i}.bin",
+        "category": rng.choice(["ID", "Bank", "Certificate", "General"]),
+        "uploaded_at": now - timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+        "expiry_date": today + timedelta(days=rng.randint(-30, 5 * 365)) if rng.random() < 0.6 else None,
+        "reminder_at": now + timedelta(minutes=rng.randint(-60, 365 * 24 * 60)) if rng.random() < 0.3 else None,
+    } for i in range(n_docs)]
+    for start in range(0, n_docs, 50_000):
+        db.session.execute(insert(Document), rows[start:start + 50_000])
+    db.session.commit()
+
+
+def time_queries(n_users, repeats):
+    from models import db, Document
+
+    rng, today, now = random.Random(1), date.today(), datetime.utcnow()
+    owners = [rng.randint(1, n_users) for _ in range(repeats)]
+    timings = {}
+
+    t0 = time.perf_counter()
+    for owner_id in owners:
+        Document.query.filter_by(owner_id=owner_id).order_by(Document.uploaded_at.desc()).all()
+    timings["documents_ms"] = (time.perf_counter() - t0) * 1000 / repeats
+
+    # Keyset page as served by /documents and /api/documents since pagination
+    t0 = time.perf_counter()
+    for owner_id in owners:
+        Document.query.filter_by(owner_id=owner_id).order_by(
+            Document.uploaded_at.desc(), Document.id.desc()).limit(51).all()
+    timings["documents_page_ms"] = (time.perf_counter() - t0) * 1000 / repeats
+
+    t0 = time.perf_counter()
+    for owner_id in owners:
+        Document.query.filter(
+            Document.owner_id == owner_id,
+            Document.expiry_date != None,
+            Document.expiry_date <= today + timedelta(days=7),
+        ).all()
+    timings["expiring_ms"] = (time.perf_counter() - t0) * 1000 / repeats
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        db.session.query(Document.id).filter(
+            Document.reminder_sent_at == None,
+            Document.reminder_at >= now - timedelta(days=1),
+            Document.reminder_at <= now + timedelta(minutes=1),
+        ).all()
+    timings["reminder_scan_ms"] = (time.perf_counter() - t0) * 1000 / repeats
+    db.session.remove()
+    return {key: round(value, 3) for key, value in timings.items()}
+
+
+def run(n_docs=100_000, n_users=100, repeats=50):
+    from models import db
+
+    results = {"docs": n_docs, "users": n_users}
+    for label, profile, keep_indexes in (("baseline", "default", False), ("tuned", "performance", True)):
+        bench_app = make_bench_app(DB_PROFILE=profile)
+        with bench_app.app_context():
+            if not keep_indexes:
+                for name in NEW_INDEXES:
+                    db.session.execute(db.text(f"DROP INDEX IF EXISTS {name}"))
+            seed(n_docs, n_users)
+            db.session.execute(db.text("ANALYZE"))
+            for key, value in time_queries(n_users, repeats).items():
+                results[f"{label}_{key}"] = value
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    for key, value in run(args.docs, args.users, args.repeats).items():
+        print(f"{key:>26}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Reminder scheduler tick: full-table scan vs. the indexed claim query.
+
+    python -m benchmarks.bench_reminders --docs 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks import make_bench_app
+
+
+def seed(n_docs, n_users, due_now):
+    """Insert users and documents with reminders spread over a year."""
+    from models import db, User, Document
+
+    db.session.execute(insert(User), [
+        {"email": f"user{i}@bench.local", "password_hash": "x"} for i in range(n_users)
+    ])
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    batch = []
+    for i in range(n_docs):
+        if i < due_now:
+            reminder_at = now
+        else:
+            reminder_at = now + timedelta(minutes=rng.randint(5, 365 * 24 * 60))
+        batch.append({
+            "owner_id": rng.randint(1, n_users),
+            "filename": f"doc{i}.pdf",
+            "stored_name": f"{i}.bin",
+            "category": "General",
+            "reminder_at": reminder_at,
+        })
+        if len(batch) == 50_000:
+            db.session.execute(insert(Document), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Document), batch)
+    db.session.commit()
+
+
+def legacy_tick():
+    """The pre-index implementation: load every reminder, filter in Python."""
+    from models import db, User, Document
+
+    now = datetime.utcnow()
+    window_start, window_end = now - timedelta(minutes=1), now + timedelta(minutes=1)
+    due = 0
+    for doc in Document.query.filter(Document.reminder_at != None).all():
+        if window_start <= doc.reminder_at <= window_end:
+            db.session.get(User, doc.owner_id)
+            due += 1
+    db.session.rollback()
+    return due
+
+
+class NullSMTP:
+    def send_message(self, msg):
+        pass
+
+    def quit(self):
+        pass
+
+
+def run(n_docs=1_000_000, n_users=1000, due_now=50, legacy=True):
+    import app as app_module
+    from mailer import MailQueue
+    from models import db
+
+    bench_app = make_bench_app()
+    app_module.mail_queue = MailQueue(workers=1, connect=NullSMTP).start()
+    results = {"docs": n_docs, "due": due_now}
+    with bench_app.app_context():
+        t0 = time.perf_counter()
+        seed(n_docs, n_users, due_now)
+        results["seed_s"] = round(time.perf_counter() - t0, 2)
+
+        if legacy:
+            t0 = time.perf_counter()
+            legacy_tick()
+            results["legacy_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        t0 = time.perf_counter()
+        app_module.check_reminders()
+        results["indexed_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        app_module.mail_queue.flush()
+
+        # A second tick finds nothing new: its cost is the index probe alone
+        t0 = time.perf_counter()
+        app_module.check_reminders()
+        results["idle_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--due", type=int, default=50)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+    results = run(args.docs, args.users, args.due, legacy=not args.skip_legacy)
+    for key, value in results.items():
+        print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Key rotation throughput: re-encrypting N blobs with 1..W workers, and
+how closely --max-mb-s is held.
+
+    python -m benchmarks.bench_rotation --files 200 --size-kb 1024 --workers 1,2,4
+"""
+import argparse
+import io
+import os
+import time
+import uuid
+
+from benchmarks import make_bench_app
+
+
+def _seed(app, n_files, size_kb, key_id):
+    from sqlalchemy import insert
+    from models import db, Document
+    from storage import new_blob_path
+    from utils import save_encrypted_stream
+
+    payload = os.urandom(size_kb * 1024)
+    rows = []
+    for i in range(n_files):
+        name = f"{uuid.uuid4()}.bin"
+        save_encrypted_stream(new_blob_path(app.config["UPLOAD_FOLDER"], name), io.BytesIO(payload), key_id=key_id)
+        rows.append({"owner_id": 1, "filename": f"f{i}.pdf", "stored_name": name, "key_id": key_id})
+    with app.app_context():
+        db.session.execute(insert(Document), rows)
+        db.session.commit()
+
+
+def run(n_files=200, size_kb=1024, workers=(1, 2, 4), throttle_mb_s=20):
+    import utils
+    from rotation import rotate_keys
+
+    utils.KEYRING.setdefault("bench-a", os.urandom(32))
+    utils.KEYRING.setdefault("bench-b", os.urandom(32))
+    app = make_bench_app()
+    results = {"files": n_files, "size_kb": size_kb, "cpus": os.cpu_count()}
+    _seed(app, n_files, size_kb, "bench-a")
+
+    # Alternate the target key so every pass has the whole store to rotate
+    target = "bench-b"
+    with app.app_context():
+        for count in workers:
+            report = rotate_keys(app.config["UPLOAD_FOLDER"], target, workers=count)
+            results[f"workers_{count}_mb_s"] = report["mb_s"]
+            target = "bench-a" if target == "bench-b" else "bench-b"
+
+        t0 = time.perf_counter()
+        report = rotate_keys(app.config["UPLOAD_FOLDER"], target, workers=max(workers), max_mb_s=throttle_mb_s,
+                             limit=max(1, n_files // 4))
+        results["throttle_target_mb_s"] = throttle_mb_s
+        results["throttled_mb_s"] = round(report["bytes"] / 2**20 / (time.perf_counter() - t0), 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--throttle-mb-s", type=float, default=20)
+    args = parser.parse_args()
+    workers = tuple(int(w) for w in args.workers.split(","))
+    for key, value in run(args.files, args.size_kb, workers, args.throttle_mb_s).items():
+        print(f"{key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Full-text search latency for one user, alone or among many.
+
+Compares FTS5 ranked search with a LIKE scan over the same text. With
+--owners the documents are spread over that many users and the searches
+run as one of them, whose cost should follow their own document count,
+not the size of the whole index.
+
+    python -m benchmarks.bench_search --docs 50000
+    python -m benchmarks.bench_search --docs 200000 --owners 200
+"""
+import argparse
+import itertools
+import random
+import time
+
+from sqlalchemy import insert, text
+
+from benchmarks import make_bench_app
+
+WORDS = ("passport visa invoice salary bank statement insurance policy tax return "
+         "certificate degree transcript lease rental medical report aadhaar license "
+         "vehicle registration warranty receipt utility electricity water gas").split()
+
+
+def _vocabulary(size, rng):
+    """Pseudo-words for document bodies, drawn with a Zipf-like skew."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+
+def seed(n_docs, owners=1):
+    from models import db, User, Document
+
+    db.session.execute(insert(User), [{"email": f"user{i}@bench.local", "password_hash": "x"} for i in range(owners)])
+    rng = random.Random(3)
+    vocabulary = _vocabulary(20_000, rng)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    docs, fts = [], []
+    for i in range(1, n_docs + 1):
+        name = "_".join(rng.sample(WORDS, 2)) + f"_{i}.pdf"
+        category = rng.choice(["ID", "Bank", "Certificate", "General"])
+        body = " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=150))
+        owner_id = (i - 1) % owners + 1
+        docs.append({"id": i, "owner_id": owner_id, "filename": name, "stored_name": f"{i}.bin", "category": category})
+        fts.append({"id": i, "filename": name, "category": category, "body": body, "owner": f"o{owner_id}"})
+    db.session.execute(insert(Document), docs)
+    db.session.execute(text("INSERT INTO document_fts (rowid, filename, category, body, owner) "
+                            "VALUES (:id, :filename, :category, :body, :owner)"), fts)
+    db.session.commit()
+    return vocabulary
+
+
+def run(n_docs=50_000, repeats=50, owners=1):
+    import search
+    from models import db
+
+    bench_app = make_bench_app()
+    results = {"docs": n_docs, "owners": owners, "searcher_docs": len(range(0, n_docs, owners))}
+    with bench_app.app_context():
+        search.ensure_index()
+        t0 = time.perf_counter()
+        vocabulary = seed(n_docs, owners)
+        results["seed_and_index_s"] = round(time.perf_counter() - t0, 2)
+
+        rng = random.Random(9)
+        cases = {
+            "fts_body_term_ms": [rng.choice(vocabulary[200:5000]) for _ in range(repeats)],
+            "fts_name_and_prefix_ms": [f"{rng.choice(WORDS)} {rng.choice(vocabulary[200:5000])[:3]}"
+                                       for _ in range(repeats)],
+            "fts_common_name_ms": [rng.choice(WORDS) for _ in range(repeats)],
+        }
+        for label, queries in cases.items():
+            t0 = time.perf_counter()
+            for q in queries:
+                search.search_documents(1, q, limit=20)
+            results[label] = round((time.perf_counter() - t0) * 1000 / repeats, 2)
+
+        # The only alternative without the index: scan every body/filename
+        t0 = time.perf_counter()
+        for q in cases["fts_body_term_ms"][:5]:
+            db.session.execute(text("SELECT rowid FROM document_fts WHERE owner = 'o1' AND "
+                                    "(filename LIKE :q OR body LIKE :q) LIMIT 20"), {"q": f"%{q}%"}).all()
+        results["like_scan_ms"] = round((time.perf_counter() - t0) * 1000 / 5, 2)
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=50_000)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--owners", type=int, default=1, help="users the documents are spread over")
+    args = parser.parse_args()
+    for key, value in run(args.docs, args.repeats, args.owners).items():
+        print(f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    main()
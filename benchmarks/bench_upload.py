@@ -0,0 +1,62 @@
+"""Upload throughput: one /upload request per file vs. /upload/batch.
+
+    python -m benchmarks.bench_upload --files 100 --size-kb 1024 --batch 50
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import benchmarks  # noqa: F401  (scratch database, uploads and key)
+
+
+def run(n_files=100, size_kb=1024, batch=50):
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        user = User(email=f"uploader{time.time_ns()}@bench.local", password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+    payloads = [os.urandom(size_kb * 1024) for _ in range(min(n_files, 8))]
+
+    def payload(i):
+        # Distinct content per file, so deduplication doesn't skip the work
+        return i.to_bytes(8, "big") + payloads[i % len(payloads)]
+
+    results = {"files": n_files, "size_kb": size_kb, "workers": app.config["UPLOAD_WORKERS"]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for i in range(n_files):
+            client.post("/upload", data={"file": (io.BytesIO(payload(i)), f"s{i}.png")},
+                        content_type="multipart/form-data")
+        results["single_files_per_s"] = round(n_files / (time.perf_counter() - t0), 1)
+
+        t0 = time.perf_counter()
+        for start in range(0, n_files, batch):
+            files = [(io.BytesIO(payload(n_files + i)), f"b{i}.png")
+                     for i in range(start, min(start + batch, n_files))]
+            response = client.post("/upload/batch", data={"files": files}, content_type="multipart/form-data")
+            assert response.status_code == 201
+        results["batch_files_per_s"] = round(n_files / (time.perf_counter() - t0), 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--batch", type=int, default=50)
+    args = parser.parse_args()
+    for key, value in run(args.files, args.size_kb, args.batch).items():
+        print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
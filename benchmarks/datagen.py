@@ -0,0 +1,128 @@
+"""Seeded synthetic dataset: users, documents and their encrypted blobs.
+
+The same seed and scale always produce the same users, filenames, dates
+(relative to the run), reminders and plaintexts, so runs on different
+machines or commits load identical data. Only the ciphertexts differ, by
+their random nonces.
+
+    python -m benchmarks.datagen --users 20 --docs-per-user 200 --sizes-kb 4,64,512
+"""
+import argparse
+import io
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks import make_bench_app
+from benchmarks.bench_compression import GENERATORS
+
+CATEGORIES = ["Passport", "Insurance", "Bank", "Tax", "Medical", "Vehicle", "General"]
+
+
+class _Templates:
+    """One generated plaintext per (kind, size); each document gets a unique prefix."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self._cache = {}
+
+    def payload(self, kind, size, serial):
+        key = (kind, size)
+        if key not in self._cache:
+            self._cache[key] = GENERATORS[kind](self.rng, size)
+        return serial.to_bytes(8, "big") + self._cache[key]
+
+
+def generate(app, users=10, docs_per_user=100, sizes_kb=(4, 64, 512), due_reminders=0.05, seed=42):
+    """
+    Insert users and documents into `app`'s database and write a blob for
+    every document. `due_reminders` is the fraction of documents whose
+    reminder falls due now. Returns the user ids and dataset totals.
+    """
+    from sqlalchemy import insert
+    from models import db, Blob, Document, User
+    from storage import new_blob_path
+    from utils import ACTIVE_KEY_ID, choose_stream_codec, content_hmac, save_encrypted_stream
+
+    rng = random.Random(seed)
+    templates = _Templates(random.Random(seed + 1))
+    kinds = sorted(GENERATORS)
+    folder = app.config["UPLOAD_FOLDER"]
+    now = datetime.utcnow().replace(microsecond=0)
+    started = time.perf_counter()
+    report = {"users": users, "documents": 0, "due_reminders": 0, "plaintext_mb": 0.0, "stored_mb": 0.0}
+    stored_bytes = plaintext_bytes = 0
+
+    with app.app_context():
+        run_tag = uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+        db.session.execute(insert(User), [
+            {"email": f"user{i}-{run_tag}@bench.local", "password_hash": "x"} for i in range(users)
+        ])
+        user_ids = db.session.execute(
+            db.select(User.id).where(User.email.like(f"%-{run_tag}@bench.local")).order_by(User.id)
+        ).scalars().all()
+
+        for owner_id in user_ids:
+            documents, blobs = [], []
+            for _ in range(docs_per_user):
+                serial = report["documents"]
+                kind = kinds[serial % len(kinds)]
+                data = templates.payload(kind, rng.choice(sizes_kb) * 1024, serial)
+                stored_name = f"{uuid.UUID(int=rng.getrandbits(128))}.bin"
+                stream = io.BytesIO(data)
+                codec = choose_stream_codec(stream)
+                stored_bytes += save_encrypted_stream(new_blob_path(folder, stored_name), stream, codec,
+                                                      ACTIVE_KEY_ID)
+                digest, size = content_hmac(owner_id, [data])
+                plaintext_bytes += size
+
+                expiry = (now + timedelta(days=rng.randint(-30, 365))).date()
+                if rng.random() < due_reminders:
+                    reminder_at = now
+                    report["due_reminders"] += 1
+                else:
+                    reminder_at = now + timedelta(minutes=rng.randint(60, 365 * 24 * 60))
+                documents.append({
+                    "owner_id": owner_id, "filename": f"{kind}-{serial}.{kind.split('-')[0]}",
+                    "stored_name": stored_name, "category": rng.choice(CATEGORIES),
+                    "uploaded_at": now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+                    "expiry_date": expiry, "reminder_at": reminder_at, "content_hmac": digest,
+                    "codec": codec, "size": size, "key_id": ACTIVE_KEY_ID,
+                })
+                blobs.append({
+                    "stored_name": stored_name, "owner_id": owner_id, "content_hmac": digest, "size": size,
+                    "codec": codec, "key_id": ACTIVE_KEY_ID, "refcount": 1,
+                })
+                report["documents"] += 1
+            db.session.execute(insert(Document), documents)
+            db.session.execute(insert(Blob), blobs)
+            db.session.commit()
+
+    report["user_ids"] = user_ids
+    report["plaintext_mb"] = round(plaintext_bytes / 2**20, 1)
+    report["stored_mb"] = round(stored_bytes / 2**20, 1)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--docs-per-user", type=int, default=100)
+    parser.add_argument("--sizes-kb", default="4,64,512", help="comma-separated blob sizes to draw from")
+    parser.add_argument("--due-reminders", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="keep the database and uploads here (default: a temp dir)")
+    args = parser.parse_args()
+    app = make_bench_app(args.workdir)
+    sizes = tuple(int(s) for s in args.sizes_kb.split(","))
+    report = generate(app, args.users, args.docs_per_user, sizes, args.due_reminders, args.seed)
+    report.pop("user_ids")
+    report["database"] = app.config["SQLALCHEMY_DATABASE_URI"]
+    for key, value in report.items():
+        print(f"{key:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
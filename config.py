@@ -3,18 +3,124 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+UPLOAD_DIR = os.getenv("UPLOAD_FOLDER") or os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 class Config:
     SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "dev-secret")
-    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'app.db')}"
+    SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL") or f"sqlite:///{os.path.join(BASE_DIR, 'app.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite connection profile (see models.SQLITE_PROFILES): "performance" or "default"
+    DB_PROFILE = os.getenv("DB_PROFILE", "performance")
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB") or 64 * 1024)
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE") or 256 * 1024 * 1024)
     UPLOAD_FOLDER = UPLOAD_DIR
     ALLOWED_EXT = {"pdf","png","jpg","jpeg"}
 
-    # AES-256-GCM key in base64 (decode before use)
+    # AES-256-GCM key in base64 (decode before use); may be left unset once
+    # `flask rotate-keys` has moved everything to a key in ENCRYPTION_KEYS
     ENCRYPTION_KEY_B64 = os.getenv("ENCRYPTION_KEY")
+    # Key rotation: extra keys as "id:base64,id2:base64" and the id new blobs
+    # are written with (unset = ENCRYPTION_KEY). Old keys stay listed until
+    # `flask rotate-keys` has moved every blob off them.
+    ENCRYPTION_KEYS = os.getenv("ENCRYPTION_KEYS")
+    ENCRYPTION_KEY_ID = os.getenv("ENCRYPTION_KEY_ID")
+    # Default read budget for key rotation, in MB/s (0 = unthrottled)
+    ROTATION_MAX_MB_S = float(os.getenv("ROTATION_MAX_MB_S") or 0)
+    # Plaintext bytes per AES-GCM segment; bounds per-upload memory
+    ENCRYPTION_SEGMENT_SIZE = int(os.getenv("ENCRYPTION_SEGMENT_SIZE") or 64 * 1024)
+    # Compress before encrypting ("zstd", "zlib" or "none"; zstd falls back to
+    # zlib when zstandard isn't installed) when a sample shrinks by at least
+    # COMPRESSION_MIN_SAVING
+    COMPRESSION_CODEC = os.getenv("COMPRESSION_CODEC", "zstd")
+    COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL") or 3)
+    COMPRESSION_MIN_SAVING = float(os.getenv("COMPRESSION_MIN_SAVING") or 0.1)
+    # Larger files are stored uncompressed, so Range requests seek straight
+    # to the segment they need instead of decompressing up to it
+    COMPRESSION_MAX_BYTES = int(os.getenv("COMPRESSION_MAX_BYTES") or 8 * 1024 * 1024)
+
+    # Password hashing: a werkzeug method ("scrypt", "scrypt:32768:8:1",
+    # "pbkdf2:sha256:600000", ...). Hashes run on PASSWORD_HASH_WORKERS
+    # processes (0 = on the request thread); with PASSWORD_HASH_MAX_PENDING
+    # already waiting, logins and signups get an immediate 503. Stored hashes
+    # made with other parameters are replaced at the user's next login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD") or "scrypt"
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or min(4, os.cpu_count() or 1))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING") or 32)
+
+    # login_required keeps recently seen users in memory (entries, seconds)
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE") or 1024)
+    IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL") or 60)
+
+    # Threads encrypting and writing files for /upload/batch
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS") or min(8, os.cpu_count() or 1))
+
+    # Scheduled jobs run in one server process at a time: whichever holds
+    # the lock file (default uploads/.scheduler.lock). The others retry every
+    # SCHEDULER_POLL_SECONDS and take over if the leader dies. `flask`
+    # commands other than `flask run` never campaign.
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+    SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE") or os.path.join(UPLOAD_DIR, ".scheduler.lock")
+    SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS") or 15)
+    # Apply schema upgrades in create_app(). Workers take turns on the lock
+    # file (default uploads/.schema.lock); set 0 to run `flask upgrade-db`
+    # once per deploy instead
+    SCHEMA_AUTO_UPGRADE = os.getenv("SCHEMA_AUTO_UPGRADE", "1") != "0"
+    SCHEMA_LOCK_FILE = os.getenv("SCHEMA_LOCK_FILE") or os.path.join(UPLOAD_DIR, ".schema.lock")
+
+    # Resumable uploads idle for longer than this are discarded
+    UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS") or 24)
+
+    # Storage GC: files no row refers to are removed once older than the
+    # grace period; each run sweeps this many shard directories
+    GC_GRACE_MINUTES = int(os.getenv("GC_GRACE_MINUTES") or 60)
+    GC_DIRS_PER_RUN = int(os.getenv("GC_DIRS_PER_RUN") or 4096)
+    GC_INTERVAL_MINUTES = int(os.getenv("GC_INTERVAL_MINUTES") or 15)
+
+    # Document listings are keyset-paginated
+    DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE") or 50)
+    DOCUMENTS_MAX_PAGE_SIZE = 200
+
+    # Rendered QR codes kept in memory (one per distinct export link)
+    QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE") or 64)
+
+    # Full-text search: index text extracted from PDFs (stored unencrypted
+    # in the search index, so it can be turned off)
+    SEARCH_INDEX_CONTENT = os.getenv("SEARCH_INDEX_CONTENT", "1") != "0"
+    SEARCH_MAX_EXTRACT_BYTES = int(os.getenv("SEARCH_MAX_EXTRACT_BYTES") or 25 * 1024 * 1024)
+    SEARCH_MAX_TEXT_CHARS = int(os.getenv("SEARCH_MAX_TEXT_CHARS") or 200_000)
+
+    # Reminders: how far back a per-document tick looks for unsent reminders
+    # (covers downtime/restarts; digests look back to each user's previous
+    # digest instead) and how long a claim may go unrenewed before another
+    # tick retries it. The leader renews every claim its mail queue still
+    # holds on each tick, so this only expires claims of a process that died.
+    REMINDER_CATCHUP_MINUTES = int(os.getenv("REMINDER_CATCHUP_MINUTES") or 24 * 60)
+    REMINDER_CLAIM_TIMEOUT_MINUTES = int(os.getenv("REMINDER_CLAIM_TIMEOUT_MINUTES") or 10)
+    # Digest mode (REMINDER_DIGEST=1): instead of one email per reminder, each
+    # user gets at most one email a day, after REMINDER_DIGEST_HOUR (UTC),
+    # listing the reminders that came due since their previous digest and
+    # documents expiring between today and EXPIRING_SOON_DAYS from now
+    # (the Expiring Soon page also lists already expired ones)
+    REMINDER_DIGEST = os.getenv("REMINDER_DIGEST", "0") == "1"
+    REMINDER_DIGEST_HOUR = int(os.getenv("REMINDER_DIGEST_HOUR") or 8)
+    EXPIRING_SOON_DAYS = int(os.getenv("EXPIRING_SOON_DAYS") or 7)
+
+    # /metrics (Prometheus text) needs this bearer token; without one it is
+    # only served in debug mode. With several worker processes, point
+    # METRICS_DIR at a directory they share (emptied at each deploy): each
+    # worker writes its values there every METRICS_WRITE_SECONDS and a
+    # scrape adds them all up. Unset, a scrape only sees the worker that
+    # answered it, so run a single worker.
+    # REQUEST_LOG_JSON=1 prints one JSON line per request
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_WRITE_SECONDS = float(os.getenv("METRICS_WRITE_SECONDS") or 5)
+    REQUEST_LOG_JSON = os.getenv("REQUEST_LOG_JSON", "0") == "1"
+
+    # Audit log entries are buffered and bulk-inserted
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE") or 200)
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL") or 2.0)
 
     # SMTP (optional)
     SMTP_HOST = os.getenv("SMTP_HOST")
@@ -22,3 +128,7 @@ class Config:
     SMTP_USER = os.getenv("SMTP_USER")
     SMTP_PASS = os.getenv("SMTP_PASS")
     FROM_EMAIL = os.getenv("FROM_EMAIL") or os.getenv("SMTP_USER")
+    # Outbound mail queue: worker threads, messages per SMTP session wake-up, retries
+    SMTP_WORKERS = int(os.getenv("SMTP_WORKERS") or 2)
+    SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE") or 20)
+    SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES") or 3)
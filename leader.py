@@ -0,0 +1,93 @@
+import os
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process file locks, every process leads
+    fcntl = None
+
+
+# ==========================================================
+# 👑 SCHEDULER LEADER ELECTION
+# ==========================================================
+# Every web worker takes part, but only the process holding an exclusive
+# lock on a shared file runs the scheduled jobs. The leader keeps the file
+# open for as long as it lives, so the OS drops the lock the moment it
+# exits or crashes; the others keep polling and one of them takes over.
+class LeaderElection:
+    """Calls `on_elected` once, in whichever process wins the lock file."""
+
+    def __init__(self, lock_path, on_elected, poll_seconds=15.0):
+        self.lock_path = lock_path
+        self.on_elected = on_elected
+        self.poll_seconds = poll_seconds
+        self.is_leader = False
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def try_acquire(self):
+        """One non-blocking attempt at the lock; True once this process leads."""
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self.is_leader = True
+            return True
+        f = open(self.lock_path, "a+b")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._file = f
+        # For operators: which process is running the jobs
+        f.truncate(0)
+        f.write(f"{os.getpid()}\n".encode())
+        f.flush()
+        self.is_leader = True
+        return True
+
+    def start(self):
+        """Campaign from a background thread until elected (or stopped)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop campaigning and give up the lock if this process holds it."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self.is_leader = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.try_acquire():
+                try:
+                    self.on_elected()
+                except Exception as e:
+                    print(f"⚠️ Scheduler failed to start: {e}")
+                return
+            self._stop.wait(self.poll_seconds)
+
+
+# ==========================================================
+# 🔒 ONE PROCESS AT A TIME
+# ==========================================================
+@contextmanager
+def exclusive_lock(lock_path):
+    """Block until this process holds `lock_path` exclusively; release on exit."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,196 @@
+import queue
+import smtplib
+import threading
+import time
+
+import metrics
+from utils import build_message, open_smtp
+
+
+# ==========================================================
+# 📬 OUTBOUND MAIL QUEUE
+# ==========================================================
+class _Outgoing:
+    __slots__ = ("msg", "to_email", "on_sent", "on_failed", "key", "attempts")
+
+    def __init__(self, msg, to_email, on_sent, on_failed, key):
+        self.msg = msg
+        self.to_email = to_email
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.key = key
+        self.attempts = 0
+
+
+_STOP = object()
+
+
+class MailQueue:
+    """
+    Delivers email from a small pool of worker threads.
+    Each worker keeps its authenticated SMTP session open between messages,
+    drains up to `batch_size` queued messages per wake-up over that session,
+    and retries transient failures with exponential backoff.
+    """
+
+    def __init__(self, workers=2, batch_size=20, max_retries=3, backoff=2.0,
+                 idle_timeout=30.0, connect=open_smtp):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.connect = connect
+        self._queue = queue.Queue()
+        self._threads = []
+        self._pending = 0
+        self._keys = {}
+        self._idle = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self._threads:
+            return self
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"mail-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def enqueue(self, to_email, subject, body, on_sent=None, on_failed=None, key=None):
+        """Queue a message; callbacks run on the worker thread after delivery.
+
+        `on_failed(permanent)` is told whether the server refused the message
+        outright (5xx, refused recipient), so retrying it later is pointless,
+        or transient failures ran out of retries. `key` (any hashable) is
+        listed by pending_keys() until the message is sent or given up on.
+        """
+        with self._idle:
+            self._pending += 1
+            if key is not None:
+                self._keys[key] = self._keys.get(key, 0) + 1
+        self._queue.put(_Outgoing(build_message(to_email, subject, body), to_email, on_sent, on_failed, key))
+
+    def flush(self, timeout=None):
+        """Block until every queued message (including retries) is settled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Deliver what is queued, then close every worker's session."""
+        self.flush(timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        return {"queued": self._pending, "sent": self.sent, "failed": self.failed}
+
+    def pending_keys(self):
+        """Keys of messages queued, in flight or awaiting a retry."""
+        with self._idle:
+            return list(self._keys)
+
+    # ------------------------------------------------------
+    # Worker internals
+    # ------------------------------------------------------
+    def _run(self):
+        server = None
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                server = self._close(server)
+                continue
+            if item is _STOP:
+                self._close(server)
+                return
+
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    extra = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is _STOP:
+                    self._queue.put(_STOP)
+                    break
+                batch.append(extra)
+
+            for outgoing in batch:
+                server = self._deliver(server, outgoing)
+
+    def _deliver(self, server, outgoing):
+        outgoing.attempts += 1
+        started = time.perf_counter()
+        try:
+            if server is None:
+                server = self.connect()
+            try:
+                server.send_message(outgoing.msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped our kept-alive session; reconnect once
+                self._close(server)
+                server = None
+                server = self.connect()
+                server.send_message(outgoing.msg)
+        except Exception as e:
+            metrics.smtp_send_seconds.observe(time.perf_counter() - started, result="error")
+            permanent = isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+            permanent = permanent or isinstance(e, smtplib.SMTPRecipientsRefused)
+            if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                server = self._close(server)
+            if permanent or outgoing.attempts > self.max_retries:
+                print(f"❌ Email send failed to {outgoing.to_email}: {e}")
+                self._settle(outgoing, delivered=False, permanent=permanent)
+            else:
+                delay = self.backoff * (2 ** (outgoing.attempts - 1))
+                print(f"⚠️ Email to {outgoing.to_email} failed ({e}); retrying in {delay:.0f}s")
+                timer = threading.Timer(delay, self._queue.put, (outgoing,))
+                timer.daemon = True
+                timer.start()
+            return server
+
+        metrics.smtp_send_seconds.observe(time.perf_counter() - started, result="sent")
+        print(f"✅ Email successfully sent to {outgoing.to_email}")
+        self._settle(outgoing, delivered=True)
+        return server
+
+    def _settle(self, outgoing, delivered, permanent=False):
+        try:
+            if delivered and outgoing.on_sent:
+                outgoing.on_sent()
+            elif not delivered and outgoing.on_failed:
+                outgoing.on_failed(permanent)
+        except Exception as e:
+            print(f"⚠️ Mail callback failed: {e}")
+        finally:
+            with self._idle:
+                if outgoing.key is not None:
+                    self._keys[outgoing.key] -= 1
+                    if not self._keys[outgoing.key]:
+                        del self._keys[outgoing.key]
+                if delivered:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                self._pending -= 1
+                self._idle.notify_all()
+
+    @staticmethod
+    def _close(server):
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+        return None
@@ -0,0 +1,368 @@
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# ==========================================================
+# 📈 METRICS REGISTRY (Prometheus text exposition)
+# ==========================================================
+# A deliberately small in-process registry: counters, gauges and histograms
+# with labels, rendered in the Prometheus text format on /metrics. Label
+# values must come from a bounded set (route rules, job ids, operation names).
+# Under several worker processes, METRICS_DIR makes every scrape report
+# the sum over all of them (see SharedDirectory).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self):
+        """This process's values as JSON-ready [label values, value] pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def _merged(self, snapshots):
+        """This process's values added to `snapshots` from other processes."""
+        merged = {}
+        for pairs in [self.snapshot(), *snapshots]:
+            for key, value in pairs:
+                key = tuple(key)
+                merged[key] = self._add(merged[key], value) if key in merged else value
+        return sorted(merged.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    @staticmethod
+    def _add(a, b):
+        return a + b
+
+    def render(self, snapshots=()):
+        items = self._merged(snapshots)
+        return self.header() + [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, registry, name, help_text, labels=(), function=None):
+        super().__init__(registry, name, help_text, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def snapshot(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                pass  # a failing probe must not break the scrape
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # cumulative buckets, sum, count
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    @staticmethod
+    def _add(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, snapshots=()):
+        lines = self.header()
+        for key, (counts, total, count) in self._merged(snapshots):
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {bucket}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.shared = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def share(self, directory, interval=5.0):
+        """Add up the values of every process writing to `directory` (see SharedDirectory)."""
+        if self.shared is None:
+            self.shared = SharedDirectory(self, directory, interval).start()
+        return self.shared
+
+    def render(self):
+        others = self.shared.read_others() if self.shared else []
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render([
+                values.get(metric.name, []) for values, alive in others if alive or metric.kind != "gauge"
+            ]))
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedDirectory:
+    """
+    Shares metric values between the worker processes of one server. Each
+    process writes its values to `directory`/<pid>.json every `interval`
+    seconds and at exit; a scrape, answered by whichever worker gets it,
+    adds its own live values to every other file. Counters and histograms
+    of workers that have exited keep counting, their gauges are dropped.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write(self):
+        path = self._path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump({"pid": os.getpid(), "metrics": self.registry.snapshot()}, f)
+        os.replace(path + ".tmp", path)
+
+    def read_others(self):
+        """[(values by metric name, process alive)] for every other process's file."""
+        own = os.path.basename(self._path(os.getpid()))
+        others = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed, or a worker from another version
+            others.append((data["metrics"], _process_alive(data["pid"])))
+        return others
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.write)
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError as e:
+                print(f"⚠️ Could not write metrics: {e}")
+            time.sleep(self.interval)
+
+
+REGISTRY = Registry()
+
+http_request_seconds = Histogram(
+    REGISTRY, "flyvia_http_request_duration_seconds",
+    "Time to handle a request (streamed bodies excluded)", ["route", "method", "status"])
+sql_queries_per_request = Histogram(
+    REGISTRY, "flyvia_sql_queries_per_request", "SQL statements executed per request", ["route"],
+    buckets=COUNT_BUCKETS)
+sql_seconds_per_request = Histogram(
+    REGISTRY, "flyvia_sql_seconds_per_request", "Time spent in SQL per request", ["route"])
+sql_queries = Counter(REGISTRY, "flyvia_sql_queries_total", "SQL statements executed")
+blob_io_seconds = Histogram(
+    REGISTRY, "flyvia_blob_io_duration_seconds", "Encryption, decryption and blob file I/O", ["op"])
+blob_io_bytes = Counter(REGISTRY, "flyvia_blob_io_bytes_total", "Bytes through each blob operation", ["op"])
+smtp_send_seconds = Histogram(REGISTRY, "flyvia_smtp_send_duration_seconds", "SMTP send time", ["result"])
+password_kdf_seconds = Histogram(
+    REGISTRY, "flyvia_password_kdf_duration_seconds", "Password hash/verify time, queueing included", ["op"])
+password_kdf_rejected = Counter(
+    REGISTRY, "flyvia_password_kdf_rejected_total", "Logins and signups turned away with the KDF pool full")
+job_seconds = Histogram(REGISTRY, "flyvia_job_duration_seconds", "Scheduler job run time", ["job"])
+job_runs = Counter(REGISTRY, "flyvia_job_runs_total", "Scheduler job runs", ["job", "result"])
+reminders_claimed = Gauge(REGISTRY, "flyvia_reminders_claimed", "Reminders claimed by the last tick")
+reminders_backlog = Gauge(REGISTRY, "flyvia_reminders_backlog", "Due reminders not yet sent after the last tick")
+
+
+@contextmanager
+def blob_op(op, nbytes=0):
+    """Time one blob operation (encrypt, decrypt, file read/write)."""
+    with blob_io_seconds.time(op=op):
+        yield
+    if nbytes:
+        blob_io_bytes.inc(nbytes, op=op)
+
+
+def track_job(job):
+    """Decorator recording a scheduler job's duration and outcome."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                job_runs.inc(job=job, result="error")
+                raise
+            finally:
+                job_seconds.observe(time.perf_counter() - started, job=job)
+            job_runs.inc(job=job, result="ok")
+            return result
+        return wrapper
+    return decorator
+
+
+# ==========================================================
+# 🔌 FLASK + SQLALCHEMY HOOKS
+# ==========================================================
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    sql_queries.inc()
+    if has_request_context() and "sql_count" in g:
+        g.sql_count += 1
+        g.sql_seconds += time.perf_counter() - started
+
+
+@event.listens_for(Engine, "handle_error")
+def _cursor_error(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def init_app(app):
+    """Record per-request metrics and serve them on /metrics."""
+
+    @app.before_request
+    def _start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_count, g.sql_seconds = 0, 0.0
+
+    @app.after_request
+    def _record_request_metrics(response):
+        if "request_started" not in g:
+            return response
+        route = _route_label()
+        elapsed = time.perf_counter() - g.request_started
+        http_request_seconds.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        sql_queries_per_request.observe(g.sql_count, route=route)
+        sql_seconds_per_request.observe(g.sql_seconds, route=route)
+        if app.config["REQUEST_LOG_JSON"]:
+            print(json.dumps({
+                "event": "request", "method": request.method, "route": route, "path": request.path,
+                "status": response.status_code, "duration_ms": round(elapsed * 1000, 2),
+                "sql_queries": g.sql_count, "sql_ms": round(g.sql_seconds * 1000, 2),
+            }), flush=True)
+        return response
+
+    if app.config["METRICS_DIR"]:
+        REGISTRY.share(app.config["METRICS_DIR"], app.config["METRICS_WRITE_SECONDS"])
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        # Closed unless a token is configured; open without one in debug only
+        token = app.config["METRICS_TOKEN"]
+        if token:
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+                abort(403)
+        elif not app.debug:
+            abort(403)
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -1,13 +1,47 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, date
 
 db = SQLAlchemy()
 
+# Pragmas applied to every new SQLite connection, chosen by Config.DB_PROFILE
+SQLITE_PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",        # readers no longer block the writer
+        "synchronous": "NORMAL",      # safe with WAL; fsync on checkpoint only
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def init_db(app):
+    """Bind the database to `app` and install its SQLite connection pragmas."""
+    db.init_app(app)
+    pragmas = dict(SQLITE_PROFILES[app.config.get("DB_PROFILE", "default")])
+    if pragmas:
+        pragmas["cache_size"] = -app.config.get("SQLITE_CACHE_SIZE_KB", 64 * 1024)
+        pragmas["mmap_size"] = app.config.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == "sqlite" and pragmas:
+        @event.listens_for(engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(200), unique=True, nullable=False)
     password_hash = db.Column(db.String(300), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped whenever one of the user's documents changes (HTTP validators)
+    listing_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_digest_at = db.Column(db.DateTime)  # when the daily digest was last sent (digest mode)
 
 class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,7 +52,57 @@ class Document(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     expiry_date = db.Column(db.Date)        
     reminder_at = db.Column(db.DateTime)    
-    nonce_b64 = db.Column(db.String(100))   # encryption nonce
+    nonce_b64 = db.Column(db.String(100))   # legacy single-blob nonce; None for segmented blobs
+    reminder_claimed_at = db.Column(db.DateTime)  # set while a scheduler tick is sending it
+    reminder_sent_at = db.Column(db.DateTime)
+    content_hmac = db.Column(db.String(64))  # per-owner keyed hash of the plaintext
+    codec = db.Column(db.String(10))         # compression applied before encryption, if any
+    size = db.Column(db.BigInteger)          # original (uncompressed) bytes
+    key_id = db.Column(db.String(32))        # encryption key id; None = ENCRYPTION_KEY
+
+    __table_args__ = (
+        # Per-owner listings (newest first) and the expiring-soon page
+        db.Index("ix_document_owner_uploaded", "owner_id", "uploaded_at", "id"),
+        db.Index("ix_document_owner_expiry", "owner_id", "expiry_date"),
+        # Storage GC checks directory listings against stored names in bulk
+        db.Index("ix_document_stored_name", "stored_name"),
+        # Only pending reminders are indexed, so the scheduler's window scan
+        # touches due rows and nothing else.
+        db.Index("ix_document_reminder_pending", "reminder_at",
+                 sqlite_where=db.text("reminder_sent_at IS NULL")),
+    )
+
+
+class Blob(db.Model):
+    """An encrypted file on disk, shared by an owner's identical documents."""
+    stored_name = db.Column(db.String(300), primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    content_hmac = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)                  # plaintext bytes
+    codec = db.Column(db.String(10))
+    key_id = db.Column(db.String(32))
+    hmac_key_id = db.Column(db.String(32))   # key content_hmac was made with; None = ENCRYPTION_KEY
+    refcount = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_blob_owner_hmac", "owner_id", "content_hmac"),
+    )
+
+
+class UploadSession(db.Model):
+    """A resumable upload in progress; the blob on disk records how far it got."""
+    id = db.Column(db.String(32), primary_key=True)                  # uuid4 hex, used in URLs
+    owner_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    stored_name = db.Column(db.String(300), nullable=False, index=True)
+    length = db.Column(db.BigInteger, nullable=False)                # declared plaintext size
+    key_id = db.Column(db.String(32))
+    category = db.Column(db.String(100))
+    expiry_date = db.Column(db.Date)
+    reminder_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 
 class Share(db.Model):
@@ -33,3 +117,58 @@ class AuditLog(db.Model):
     action = db.Column(db.String(200))
     detail = db.Column(db.String(1000))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def already_applied(error):
+    """True when a DDL statement failed because another process applied it first."""
+    message = str(error).lower()
+    return "duplicate column" in message or "already exists" in message
+
+
+def _apply(step, *args, **kwargs):
+    """Run one DDL step; False if another process had already applied it."""
+    try:
+        step(*args, **kwargs)
+    except OperationalError as e:
+        if not already_applied(e):
+            raise
+        return False
+    return True
+
+
+# Run once, in the same upgrade that adds the column, so existing rows say
+# what the code before it already did
+COLUMN_BACKFILLS = {
+    # Reminders already due were sent by the in-memory scheduler that came before
+    ("document", "reminder_sent_at"):
+        "UPDATE document SET reminder_sent_at = reminder_at WHERE reminder_at <= CURRENT_TIMESTAMP",
+}
+
+
+def upgrade_schema():
+    """Create missing tables, columns and indexes on an existing database.
+
+    create_all() only creates whole tables, so columns added to a model later
+    are applied here with ALTER TABLE. Changes are additive only: new columns
+    must be nullable or carry a server default. Callers serialise upgrades
+    (see leader.exclusive_lock); a step that another process got to first
+    still counts as done.
+    """
+    _apply(db.create_all)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            _apply(table.create, conn, checkfirst=True)  # create_all may have stopped at a lost race
+            existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(conn.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                if _apply(conn.exec_driver_sql, ddl) and backfill:
+                    conn.exec_driver_sql(backfill)
+            for index in table.indexes:
+                _apply(index.create, conn, checkfirst=True)
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA optimize")  # refresh planner stats for new indexes
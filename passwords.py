@@ -0,0 +1,103 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+import metrics
+
+
+# ==========================================================
+# 🔑 PASSWORD HASHING (bounded process pool)
+# ==========================================================
+# Password KDFs are slow on purpose. Running them on request threads lets a
+# wave of logins starve every other request, so they go to a small process
+# pool instead, and once too many are waiting new ones are turned away at
+# once rather than queued behind minutes of work.
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already waiting; retry later."""
+
+
+def stored_method(method):
+    """The method string werkzeug stores in hashes made with `method`, defaults filled in."""
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        args = ["32768", "8", "1"]
+    elif name == "pbkdf2":
+        args += ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)][len(args):]
+    return ":".join([name, *args])
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords with `method` (a werkzeug method string) on
+    `workers` processes, or inline when `workers` is 0. At most
+    `max_pending` calls may be queued or running at once.
+    """
+
+    def __init__(self, method="scrypt", workers=2, max_pending=32):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._prefix = stored_method(method)
+
+    def _executor(self):
+        # Created on first use: importing the app starts no processes, and
+        # "spawn" keeps the children clear of the parent's threads and locks
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _run(self, op, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                metrics.password_kdf_rejected.inc()
+                raise PasswordHasherBusy()
+            self._pending += 1
+        try:
+            with metrics.password_kdf_seconds.time(op=op):
+                if not self.workers:
+                    return func(*args)
+                pool = self._executor()
+                try:
+                    return pool.submit(func, *args).result()
+                except BrokenProcessPool:
+                    # A worker died (OOM kill, crash): replace the pool, retry once
+                    self._discard(pool)
+                    return self._executor().submit(func, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def hash(self, password):
+        return self._run("hash", generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run("verify", check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if a stored hash was made with other parameters than `method`."""
+        return password_hash.split("$", 1)[0] != self._prefix
+
+    def pending(self):
+        return self._pending
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
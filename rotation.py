@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import and_, case, or_, select, union, update
+
+import storage
+from models import db, Blob, Document, UploadSession
+from utils import ChunkReader, StoredContentMac, iter_decrypt_file, save_encrypted_stream
+
+
+# ==========================================================
+# 🔑 ENCRYPTION KEY ROTATION
+# ==========================================================
+# Every blob not yet under the target key is re-encrypted into a new file
+# (compressed blobs stay compressed: only the encryption layer changes),
+# with its dedup fingerprint re-keyed to match (the same pass also fixes
+# blobs already under the target key whose fingerprint is not),
+# then its Document/Blob rows are repointed in one commit. The old file is
+# left to the storage GC, which removes it once GC_GRACE_MINUTES have
+# passed, so downloads and exports that already resolved it can finish.
+# The database is the checkpoint: an interrupted run loses at most the
+# blobs in flight, whose half-written files the storage GC sweeps.
+class Throttle:
+    """Caps the combined read rate of all workers."""
+
+    def __init__(self, max_mb_s=0):
+        self.rate = max_mb_s * 2**20
+        self.started = time.monotonic()
+        self.consumed = 0
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            self.consumed += nbytes
+            due = self.started + self.consumed / self.rate
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _reencrypt(upload_folder, stored_name, nonce_b64, key_id, codec, owner_id, target_key_id, throttle):
+    """Write a copy of a blob under the target key; returns (new name, bytes, fingerprint)."""
+    source = storage.locate_blob(upload_folder, stored_name)
+    new_name = str(uuid.uuid4()) + ".bin"
+    mac = StoredContentMac(owner_id, codec, target_key_id)
+    copied = 0
+
+    def chunks():
+        nonlocal copied
+        for chunk in iter_decrypt_file(source, nonce_b64, key_id=key_id):
+            throttle.consume(len(chunk))
+            mac.update(chunk)
+            copied += len(chunk)
+            yield chunk
+
+    save_encrypted_stream(storage.new_blob_path(upload_folder, new_name), ChunkReader(chunks()),
+                          key_id=target_key_id)
+    return new_name, copied, mac.hexdigest()
+
+
+def _repoint(old_name, new_name, target_key_id, digest):
+    """Move every row off the old blob; False if they all went away meanwhile."""
+    moved = db.session.execute(
+        update(Document)
+        .where(Document.stored_name == old_name)
+        .values(stored_name=new_name, nonce_b64=None, key_id=target_key_id,
+                content_hmac=case((Document.content_hmac != None, digest), else_=None))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(
+        update(Blob)
+        .where(Blob.stored_name == old_name)
+        .values(stored_name=new_name, key_id=target_key_id, content_hmac=digest, hmac_key_id=target_key_id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return moved > 0
+
+
+def rotate_keys(upload_folder, target_key_id=None, workers=4, max_mb_s=0, batch_size=64, limit=None,
+                progress=None):
+    """
+    Re-encrypt every blob that isn't under `target_key_id`, or whose
+    fingerprint isn't keyed with it. Returns blobs
+    rotated/failed, plaintext bytes and throughput; `progress` (if given)
+    is called with the running report after each batch.
+    """
+    throttle = Throttle(max_mb_s)
+    report = {"rotated": 0, "failed": 0, "bytes": 0}
+    started = time.perf_counter()
+    last = ""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="key-rotation") as pool:
+        while limit is None or report["rotated"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - report["rotated"])
+            rows = db.session.execute(
+                select(Document.stored_name, Document.nonce_b64, Document.key_id, Document.codec, Document.owner_id)
+                .outerjoin(Blob, Blob.stored_name == Document.stored_name)
+                .where(or_(Document.key_id.is_distinct_from(target_key_id),
+                           and_(Blob.stored_name != None, Blob.hmac_key_id.is_distinct_from(target_key_id))))
+                .where(Document.stored_name > last)
+                .distinct()
+                .order_by(Document.stored_name)
+                .limit(size)
+            ).all()
+            if not rows:
+                break
+            last = rows[-1].stored_name
+
+            jobs = {
+                pool.submit(_reencrypt, upload_folder, row.stored_name, row.nonce_b64, row.key_id,
+                            row.codec, row.owner_id, target_key_id, throttle): row.stored_name
+                for row in rows
+            }
+            for future in as_completed(jobs):
+                old_name = jobs[future]
+                try:
+                    new_name, copied, digest = future.result()
+                except Exception as e:
+                    print(f"⚠️ Could not re-encrypt {old_name}: {e}")
+                    report["failed"] += 1
+                    continue
+                if _repoint(old_name, new_name, target_key_id, digest):
+                    storage.retire_blob(upload_folder, old_name)
+                    report["rotated"] += 1
+                    report["bytes"] += copied
+                else:
+                    storage.remove_blob_file(upload_folder, new_name)
+
+            if progress:
+                progress(_with_rate(report, started))
+    return _with_rate(report, started)
+
+
+def _with_rate(report, started):
+    seconds = time.perf_counter() - started
+    return {**report, "seconds": round(seconds, 2),
+            "mb_s": round(report["bytes"] / 2**20 / seconds, 1) if seconds else 0.0}
+
+
+def keys_in_use():
+    """Every key id a document, blob, fingerprint or resumable upload still needs."""
+    return set(db.session.execute(union(
+        select(Document.key_id), select(Blob.key_id), select(Blob.hmac_key_id), select(UploadSession.key_id),
+    )).scalars())
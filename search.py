@@ -0,0 +1,148 @@
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import DDL, event, text
+
+from models import db, Document
+from utils import iter_plaintext
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF text extraction is optional; names/categories are still indexed
+    PdfReader = None
+
+
+# ==========================================================
+# 🔎 FULL-TEXT SEARCH INDEX (SQLite FTS5)
+# ==========================================================
+# rowid mirrors Document.id. The owner is indexed as a token ("o42") and
+# every query matches on it first, so FTS5 narrows to the user's own rows
+# before looking at the search terms and the cost follows the size of that
+# user's library, not of the whole index.
+FTS_COLUMNS = "filename, category, body, owner, tokenize = 'unicode61 remove_diacritics 2'"
+FTS_DDL = f"CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5({FTS_COLUMNS})"
+
+# create_all()/drop_all() manage the virtual table alongside the models
+event.listen(db.metadata, "after_create", DDL(FTS_DDL).execute_if(dialect="sqlite"))
+event.listen(db.metadata, "before_drop", DDL("DROP TABLE IF EXISTS document_fts").execute_if(dialect="sqlite"))
+
+# Text extraction decrypts and parses PDFs, so it runs off the request thread
+_extractor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-text")
+
+
+def owner_token(owner_id):
+    return f"o{owner_id}"
+
+
+def ensure_index():
+    """
+    Create the index on an existing database and backfill names/categories
+    of documents it lacks. create_all() may already have made the table
+    (empty) for an upgraded database, so what counts is the missing rows.
+    """
+    with db.engine.begin() as conn:
+        columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(document_fts)")}
+        if columns and "owner" not in columns:
+            # Index from before owner tokens (owner_id UNINDEXED): copy it over,
+            # extracted PDF text included
+            conn.exec_driver_sql(f"CREATE VIRTUAL TABLE document_fts_owner USING fts5({FTS_COLUMNS})")
+            conn.exec_driver_sql(
+                "INSERT INTO document_fts_owner (rowid, filename, category, body, owner) "
+                "SELECT rowid, filename, category, body, 'o' || owner_id FROM document_fts"
+            )
+            conn.exec_driver_sql("DROP TABLE document_fts")
+            conn.exec_driver_sql("ALTER TABLE document_fts_owner RENAME TO document_fts")
+        conn.exec_driver_sql(FTS_DDL)
+        conn.exec_driver_sql(
+            "INSERT INTO document_fts (rowid, filename, category, body, owner) "
+            "SELECT id, filename, coalesce(category, ''), '', 'o' || owner_id FROM document "
+            "WHERE id NOT IN (SELECT rowid FROM document_fts)"
+        )
+
+
+def index_document(doc, body=""):
+    """Add or refresh a document's row, inside the caller's transaction."""
+    db.session.execute(
+        text("INSERT OR REPLACE INTO document_fts (rowid, filename, category, body, owner) "
+             "VALUES (:id, :filename, :category, :body, :owner)"),
+        {"id": doc.id, "filename": doc.filename, "category": doc.category or "",
+         "body": body, "owner": owner_token(doc.owner_id)},
+    )
+
+
+def remove_document(doc_id):
+    db.session.execute(text("DELETE FROM document_fts WHERE rowid = :id"), {"id": doc_id})
+
+
+def _match_expression(owner_id, query):
+    # Every word must match, as a prefix, in the name, category or text; user
+    # input never reaches FTS syntax
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"*' for word in words)
+    return f'owner : "{owner_token(owner_id)}" AND {{filename category body}} : ({terms})'
+
+
+def search_documents(owner_id, query, limit=20):
+    """Best matches first (bm25, filename weighted over category over body)."""
+    match = _match_expression(owner_id, query)
+    if not match:
+        return []
+    rows = db.session.execute(
+        text(
+            "SELECT rowid, snippet(document_fts, 2, '[', ']', '…', 12) AS snippet "
+            "FROM document_fts "
+            "WHERE document_fts MATCH :match "
+            "ORDER BY bm25(document_fts, 10.0, 5.0, 1.0, 0.0) LIMIT :limit"
+        ),
+        {"match": match, "limit": limit},
+    ).all()
+    docs = {doc.id: doc for doc in Document.query.filter(Document.id.in_([r.rowid for r in rows]))}
+    return [(docs[r.rowid], r.snippet) for r in rows if r.rowid in docs]
+
+
+# ==========================================================
+# 📄 PDF TEXT EXTRACTION
+# ==========================================================
+def extract_pdf_text(data: bytes, max_chars: int) -> str:
+    reader = PdfReader(io.BytesIO(data))
+    parts, size = [], 0
+    for page in reader.pages:
+        page_text = page.extract_text() or ""
+        parts.append(page_text)
+        size += len(page_text)
+        if size >= max_chars:
+            break
+    return "\n".join(parts)[:max_chars]
+
+
+def schedule_text_extraction(app, doc_id, stored_path, nonce_b64=None, codec=None, key_id=None):
+    """Queue PDF text extraction for a freshly uploaded document."""
+    if PdfReader is None or not app.config["SEARCH_INDEX_CONTENT"]:
+        return None
+    return _extractor.submit(_extract_and_index, app, doc_id, stored_path, nonce_b64, codec, key_id)
+
+
+def _extract_and_index(app, doc_id, stored_path, nonce_b64, codec, key_id):
+    max_bytes = app.config["SEARCH_MAX_EXTRACT_BYTES"]
+    try:
+        chunks, size = [], 0
+        for chunk in iter_plaintext(stored_path, nonce_b64, codec, key_id=key_id):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                print(f"⚠️ Skipping text extraction for document {doc_id}: too large")
+                return
+        body = extract_pdf_text(b"".join(chunks), app.config["SEARCH_MAX_TEXT_CHARS"])
+    except Exception as e:
+        print(f"⚠️ Text extraction failed for document {doc_id}: {e}")
+        return
+
+    with app.app_context():
+        db.session.execute(
+            text("UPDATE document_fts SET body = :body WHERE rowid = :id"),
+            {"body": body, "id": doc_id},
+        )
+        db.session.commit()
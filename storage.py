@@ -0,0 +1,312 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import delete, func, select, update
+
+from models import db, Blob, Document, UploadSession
+from utils import content_hmac, iter_stream
+
+
+# ==========================================================
+# 🗂 BLOB PATHS (sharded layout)
+# ==========================================================
+# Blobs live two hex levels deep (uploads/c0/9a/c09ae494-….bin) so no single
+# directory grows to millions of entries. Files from before the layout sit
+# directly in uploads/ until `flask migrate-storage` moves them; readers look
+# in both places meanwhile.
+def blob_path(upload_folder, stored_name):
+    return os.path.join(upload_folder, stored_name[:2], stored_name[2:4], stored_name)
+
+
+def new_blob_path(upload_folder, stored_name):
+    """Where to write a new blob; creates its shard directory."""
+    path = blob_path(upload_folder, stored_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def locate_blob(upload_folder, stored_name):
+    """Path of an existing blob, in the sharded or the old flat layout."""
+    sharded = blob_path(upload_folder, stored_name)
+    if os.path.exists(sharded):
+        return sharded
+    flat = os.path.join(upload_folder, stored_name)
+    if os.path.exists(flat):
+        return flat
+    # Moved by the migration between the two checks
+    return sharded
+
+
+def _move_to_shard(upload_folder, name):
+    """Move one flat blob into its shard; returns the bytes moved (0 if it vanished)."""
+    flat = os.path.join(upload_folder, name)
+    target = new_blob_path(upload_folder, name)
+    try:
+        size = os.path.getsize(flat)
+        # Link, then unlink: at every moment one of the two paths exists
+        try:
+            os.link(flat, target)
+        except FileExistsError:
+            pass
+        os.remove(flat)
+    except FileNotFoundError:  # deleted while we were migrating
+        return 0
+    return size
+
+
+def migrate_flat_files(upload_folder, workers=8, skip=(), batch_size=1000):
+    """
+    Move blobs from the flat layout into their shards. Safe to run while the
+    app serves traffic, and to interrupt and re-run: whatever is still in the
+    top-level directory is what is left to do. Names in `skip` (resumable
+    uploads in progress) are left alone.
+    """
+    started = time.perf_counter()
+    report = {"moved": 0, "bytes": 0, "skipped": 0}
+
+    def run_batch(pool, names):
+        for size in pool.map(lambda name: _move_to_shard(upload_folder, name), names):
+            report["moved"] += 1 if size else 0
+            report["bytes"] += size
+
+    with os.scandir(upload_folder) as entries, ThreadPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for entry in entries:
+            if not entry.name.endswith(".bin") or not entry.is_file():
+                continue
+            if entry.name in skip:
+                report["skipped"] += 1
+                continue
+            batch.append(entry.name)
+            if len(batch) >= batch_size:
+                run_batch(pool, batch)
+                batch = []
+        run_batch(pool, batch)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+# ==========================================================
+# 🧬 CONTENT-ADDRESSED BLOBS (per-owner deduplication)
+# ==========================================================
+# An owner's identical uploads share one encrypted file. Blob rows count the
+# documents pointing at each file; the file goes away with the last of them.
+def fingerprint_upload(owner_id, stream, key_id=None):
+    """Keyed hash and size of an upload; rewinds the stream for encryption."""
+    digest, size = content_hmac(owner_id, iter_stream(stream), key_id)
+    stream.seek(0)
+    return digest, size
+
+
+def find_blob(owner_id, digest):
+    return db.session.execute(
+        select(Blob).where(Blob.owner_id == owner_id, Blob.content_hmac == digest).limit(1)
+    ).scalar()
+
+
+def add_reference(blob, count=1):
+    """Point `count` more documents at an existing blob; False if it was just released."""
+    result = db.session.execute(
+        update(Blob)
+        .where(Blob.stored_name == blob.stored_name)
+        .where(Blob.refcount > 0)
+        .values(refcount=Blob.refcount + count)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def register_blob(stored_name, owner_id, digest, size, codec=None, key_id=None, refcount=1):
+    """Record a freshly written blob and the documents about to reference it.
+
+    `digest` must be keyed with the blob's own `key_id` (see content_hmac).
+    """
+    blob = Blob(stored_name=stored_name, owner_id=owner_id, content_hmac=digest, size=size,
+                codec=codec, key_id=key_id, hmac_key_id=key_id, refcount=refcount)
+    db.session.add(blob)
+    return blob
+
+
+def release_blob(stored_name):
+    """
+    Drop one reference to a blob, inside the caller's transaction.
+    Returns True when nothing points at the file any more and it may be
+    removed once the transaction commits.
+    """
+    refcount = db.session.execute(
+        update(Blob)
+        .where(Blob.stored_name == stored_name)
+        .values(refcount=Blob.refcount - 1)
+        .returning(Blob.refcount)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if refcount is None:
+        # Stored before deduplication: the document owned its file alone
+        return True
+    if refcount > 0:
+        return False
+    db.session.execute(
+        delete(Blob).where(Blob.stored_name == stored_name).execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def remove_blob_file(upload_folder, stored_name):
+    for path in (blob_path(upload_folder, stored_name), os.path.join(upload_folder, stored_name)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Unlinking happens off the request thread, after the delete has committed
+_reaper = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-reaper")
+
+
+def queue_removal(upload_folder, stored_name):
+    return _reaper.submit(remove_blob_file, upload_folder, stored_name)
+
+
+def retire_blob(upload_folder, stored_name):
+    """
+    Leave a blob no row points at any more to the orphan GC. Its mtime is
+    reset, so the sweep keeps it for the grace period and readers that
+    resolved it before it was replaced can finish.
+    """
+    for path in (blob_path(upload_folder, stored_name), os.path.join(upload_folder, stored_name)):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+
+def report(owner_id=None):
+    """Documents, unique blobs, bytes on disk and bytes saved by dedup."""
+    blobs = select(
+        func.count(Blob.stored_name),
+        func.coalesce(func.sum(Blob.size), 0),
+        func.coalesce(func.sum((Blob.refcount - 1) * Blob.size), 0),
+    )
+    documents = select(func.count(Document.id))
+    if owner_id is not None:
+        blobs = blobs.where(Blob.owner_id == owner_id)
+        documents = documents.where(Document.owner_id == owner_id)
+    unique_blobs, bytes_stored, bytes_saved = db.session.execute(blobs).one()
+    return {
+        "documents": db.session.execute(documents).scalar(),
+        "unique_blobs": unique_blobs,
+        "bytes_stored": int(bytes_stored),
+        "bytes_saved": int(bytes_saved),
+    }
+
+
+# ==========================================================
+# 🧹 ORPHAN GC
+# ==========================================================
+# Files can outlive their rows (a crash between writing a blob and
+# committing its Document, an interrupted .part write, an unlink that never
+# ran). The sweep walks the tree one shard directory at a time, checks each
+# batch of names against the database with indexed IN queries, and removes
+# what nothing refers to once it is older than the grace period. A
+# checkpoint file lets large trees be swept across many runs.
+GC_CHECKPOINT = ".gc-checkpoint"
+_SIDECAR_SUFFIXES = (".tail.part", ".tail", ".part")
+
+
+def _shard_dirs(upload_folder):
+    """Shard directories in a stable order; "" stands for the flat top level."""
+    yield ""
+    for top in sorted(e.name for e in os.scandir(upload_folder) if e.is_dir() and len(e.name) == 2):
+        top_path = os.path.join(upload_folder, top)
+        for sub in sorted(e.name for e in os.scandir(top_path) if e.is_dir() and len(e.name) == 2):
+            yield f"{top}/{sub}"
+
+
+def _base_name(filename):
+    for suffix in _SIDECAR_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)]
+    return filename
+
+
+def _referenced(names):
+    """The subset of stored names some row still points at."""
+    names = list(names)
+    found = set()
+    for column in (Document.stored_name, Blob.stored_name, UploadSession.stored_name):
+        found.update(db.session.execute(select(column).where(column.in_(names))).scalars())
+    return found
+
+
+class _Sweep:
+    """Collects (directory, name, stat) across shards and checks them in batches."""
+
+    def __init__(self, cutoff, batch_size, report):
+        self.cutoff = cutoff
+        self.batch_size = batch_size
+        self.report = report
+        self.batch = []
+
+    def scan(self, path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                self.report["scanned"] += 1
+                stat = entry.stat()
+                if stat.st_mtime > self.cutoff:
+                    continue  # too new to judge: its row may not be committed yet
+                self.batch.append((path, entry.name, stat))
+                if len(self.batch) >= self.batch_size:
+                    self.flush()
+
+    def flush(self):
+        live = _referenced({_base_name(name) for _, name, _ in self.batch})
+        for path, name, stat in self.batch:
+            if _base_name(name) in live:
+                continue
+            try:
+                os.remove(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            self.report["removed"] += 1
+            self.report["bytes"] += stat.st_size
+        self.batch = []
+
+
+def sweep_orphans(upload_folder, grace_minutes=60, max_dirs=None, batch_size=500, restart=False):
+    """
+    Remove unreferenced files from up to `max_dirs` shard directories,
+    continuing after the last checkpoint. Returns what was scanned and
+    reclaimed; `checkpoint` is None once a full pass has completed.
+    """
+    checkpoint_path = os.path.join(upload_folder, GC_CHECKPOINT)
+    checkpoint = None
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = f.read().strip()
+
+    started = time.perf_counter()
+    cutoff = time.time() - grace_minutes * 60
+    report = {"dirs": 0, "scanned": 0, "removed": 0, "bytes": 0, "checkpoint": None}
+    sweep = _Sweep(cutoff, batch_size, report)
+    for shard in _shard_dirs(upload_folder):
+        if checkpoint is not None and shard <= checkpoint:
+            continue
+        if max_dirs is not None and report["dirs"] >= max_dirs:
+            report["checkpoint"] = checkpoint
+            break
+        sweep.scan(os.path.join(upload_folder, shard))
+        report["dirs"] += 1
+        checkpoint = shard
+    if sweep.batch:
+        sweep.flush()
+
+    if report["checkpoint"] is not None:
+        with open(checkpoint_path, "w") as f:
+            f.write(report["checkpoint"])
+    elif os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
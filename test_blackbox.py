@@ -1,12 +1,17 @@
+import io
+import os
+import zipfile
 import pytest
-from app import app, db
-from models import User, Document
+from app import create_app
+from models import db, User, Document
+import search
+import storage
 from datetime import datetime, timedelta
 
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "SCHEDULER_ENABLED": False})
+
 @pytest.fixture
 def client():
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -14,6 +19,15 @@ def client():
         with app.app_context():
             db.drop_all()
 
+
+@pytest.fixture
+def logged_in_client(client, tmp_path, monkeypatch):
+    """`client` signed in as user@example.com, storing uploads under tmp_path."""
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    client.post("/signup", data={"email": "user@example.com", "password": "pass"})
+    client.post("/login", data={"email": "user@example.com", "password": "pass"})
+    return client
+
 # ----------------------------
 # 🧪 BLACK BOX TESTS
 # ----------------------------
@@ -54,3 +68,257 @@ def test_upload_without_file(client):
     response = client.post("/upload", data={})
     assert response.status_code == 400
     assert b"no file" in response.data
+
+'''Test Case: An uploaded file should download back byte-for-byte.'''
+
+def test_upload_download_roundtrip(logged_in_client):
+    payload = os.urandom(200_000)
+    response = logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), "scan.pdf")},
+                                     content_type="multipart/form-data")
+    assert response.status_code == 302
+    with app.app_context():
+        doc = Document.query.filter_by(filename="scan.pdf").first()
+    assert doc.nonce_b64 is None
+    response = logged_in_client.get(f"/download/{doc.id}")
+    assert response.status_code == 200
+    assert response.data == payload
+
+'''Test Case: Range requests should return only the requested bytes.'''
+
+def test_download_range(logged_in_client):
+    payload = os.urandom(300_000)
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), "big.pdf")},
+                          content_type="multipart/form-data")
+    with app.app_context():
+        doc = Document.query.filter_by(filename="big.pdf").first()
+    response = logged_in_client.get(f"/download/{doc.id}", headers={"Range": "bytes=70000-140000"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 70000-140000/300000"
+    assert response.data == payload[70000:140001]
+    response = logged_in_client.get(f"/download/{doc.id}", headers={"Range": "bytes=400000-"})
+    assert response.status_code == 416
+
+'''Test Case: The JSON listing should page through documents with a cursor
+    and apply server-side filters.'''
+
+def test_documents_api_keyset_pagination(logged_in_client):
+    with app.app_context():
+        owner = User.query.filter_by(email="user@example.com").first()
+        base = datetime(2025, 1, 1)
+        for i in range(5):
+            db.session.add(Document(owner_id=owner.id, filename=f"scan{i}.pdf", stored_name=f"{i}.bin",
+                                    category="Bank" if i % 2 else "ID",
+                                    uploaded_at=base + timedelta(days=i)))
+        db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/documents?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        page = logged_in_client.get(url).get_json()
+        seen += [d["filename"] for d in page["documents"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [f"scan{i}.pdf" for i in reversed(range(5))]
+
+    page = logged_in_client.get("/api/documents?category=Bank").get_json()
+    assert [d["filename"] for d in page["documents"]] == ["scan3.pdf", "scan1.pdf"]
+    assert logged_in_client.get("/api/documents?cursor=not-a-cursor").status_code == 400
+    assert b"Load more" in logged_in_client.get("/documents?limit=2").data
+
+def make_pdf(text):
+    """A minimal one-page PDF whose page shows `text`."""
+    stream = b"BT /F1 24 Tf 72 700 Td (" + text.encode() + b") Tj ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        b" /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+'''Test Case: Search should find documents by name and by PDF text,
+    and forget them once deleted.'''
+
+def test_search_by_name_and_content(logged_in_client):
+    pdf = make_pdf("Passport renewal form")
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(pdf), "travel_scan.pdf"), "category": "ID"},
+                          content_type="multipart/form-data")
+    search._extractor.submit(lambda: None).result()  # wait for text extraction
+
+    hits = logged_in_client.get("/search?q=trav").get_json()["results"]
+    assert [h["filename"] for h in hits] == ["travel_scan.pdf"]
+    hits = logged_in_client.get("/search?q=renewal").get_json()["results"]
+    assert [h["filename"] for h in hits] == ["travel_scan.pdf"]
+    assert logged_in_client.get("/search?q=invoice").get_json()["results"] == []
+
+    logged_in_client.get(f"/delete/{hits[0]['id']}")
+    assert logged_in_client.get("/search?q=renewal").get_json()["results"] == []
+
+'''Test Case: Exporting should stream a ZIP holding the decrypted files,
+    honouring the category filter.'''
+
+def test_export_zip(logged_in_client):
+    files = {"a.pdf": os.urandom(150_000), "b.png": os.urandom(10), "c.jpg": b""}
+    for name, payload in files.items():
+        logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), name),
+                                               "category": "Bank" if name != "b.png" else "ID"},
+                              content_type="multipart/form-data")
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(b"dup"), "a.pdf"), "category": "Bank"},
+                          content_type="multipart/form-data")
+
+    response = logged_in_client.get("/export?category=Bank")
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(archive.namelist()) == ["a (2).pdf", "a.pdf", "c.jpg"]
+    assert archive.read("a.pdf") == files["a.pdf"]
+    assert archive.read("a (2).pdf") == b"dup"
+    assert archive.read("c.jpg") == b""
+    assert logged_in_client.get("/export?id=abc").status_code == 400
+
+'''Test Case: A batch upload should store every valid file in one go
+    and report the invalid ones.'''
+
+def test_batch_upload(logged_in_client):
+    payloads = [os.urandom(70_000 + i) for i in range(5)]
+    files = [(io.BytesIO(p), f"scan{i}.pdf") for i, p in enumerate(payloads)]
+    files.append((io.BytesIO(b"MZ"), "tool.exe"))
+    response = logged_in_client.post("/upload/batch", data={"files": files, "category": "Bank"},
+                                     content_type="multipart/form-data")
+    assert response.status_code == 201
+    results = response.get_json()["results"]
+    assert [r["status"] for r in results] == ["stored"] * 5 + ["error"]
+    for result, payload in zip(results, payloads):
+        assert logged_in_client.get(f"/download/{result['id']}").data == payload
+    assert logged_in_client.post("/upload/batch", data={}).status_code == 400
+
+'''Test Case: A resumable upload should accept chunks at the current offset,
+    reject out-of-order ones, and become a document once finalized.'''
+
+def test_resumable_upload(logged_in_client):
+    payload = os.urandom(200_000)
+    response = logged_in_client.post("/upload/sessions", json={"filename": "scan.pdf", "length": len(payload),
+                                                                "category": "ID"})
+    assert response.status_code == 201
+    url = response.headers["Location"]
+
+    def patch(offset, chunk):
+        return logged_in_client.patch(url, data=chunk, headers={"Upload-Offset": str(offset),
+                                                                "Content-Type": "application/offset+octet-stream"})
+
+    assert patch(0, payload[:50_000]).headers["Upload-Offset"] == "50000"
+    assert patch(10, payload[10:20]).status_code == 409
+    assert logged_in_client.post(url + "/finalize").status_code == 409
+    assert logged_in_client.head(url).headers["Upload-Offset"] == "50000"   # e.g. after a dropped connection
+    assert patch(50_000, payload[50_000:120_001]).headers["Upload-Offset"] == "120001"
+    assert patch(120_001, payload[120_001:]).status_code == 204
+
+    response = logged_in_client.post(url + "/finalize")
+    assert response.status_code == 201
+    assert logged_in_client.get(f"/download/{response.get_json()['id']}").data == payload
+    assert logged_in_client.head(url).status_code == 404
+
+'''Test Case: Uploading the same content again should reuse the stored blob,
+    which is only removed when the last document using it is deleted.'''
+
+def test_duplicate_upload_shares_blob(logged_in_client, tmp_path):
+    payload = os.urandom(100_000)
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), "passport.pdf")},
+                          content_type="multipart/form-data")
+    files = [(io.BytesIO(payload), "copy.pdf"), (io.BytesIO(payload), "copy2.pdf")]
+    results = logged_in_client.post("/upload/batch", data={"files": files},
+                                    content_type="multipart/form-data").get_json()["results"]
+    def stored_files():
+        return [name for _, _, names in os.walk(tmp_path) for name in names]
+
+    assert len(stored_files()) == 1
+
+    docs = logged_in_client.get("/api/documents").get_json()["documents"]
+    assert len(docs) == 3
+    for doc in docs[:2]:
+        logged_in_client.get(f"/delete/{doc['id']}")
+        assert len(stored_files()) == 1
+    assert logged_in_client.get(docs[2]["download_url"]).data == payload
+    logged_in_client.get(f"/delete/{docs[2]['id']}")
+    storage._reaper.submit(lambda: None).result()   # unlinking happens in the background
+    assert stored_files() == []
+
+'''Test Case: A compressible upload should be stored compressed and still
+    download (whole or by range) exactly as uploaded.'''
+
+def test_compressed_upload_download(logged_in_client, tmp_path):
+    payload = b"%PDF-1.4\n" + b"".join(b"BT /F1 12 Tf (Line %d) Tj ET\n" % i for i in range(30000))
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), "statement.pdf")},
+                          content_type="multipart/form-data")
+    with app.app_context():
+        doc = Document.query.filter_by(filename="statement.pdf").first()
+    assert doc.codec and doc.size == len(payload)
+    assert os.path.getsize(storage.blob_path(str(tmp_path), doc.stored_name)) < len(payload) // 3
+    assert logged_in_client.get(f"/download/{doc.id}").data == payload
+    response = logged_in_client.get(f"/download/{doc.id}", headers={"Range": "bytes=500000-500099"})
+    assert response.status_code == 206
+    assert response.data == payload[500000:500100]
+
+'''Test Case: Downloads and the export summary should answer a matching
+    If-None-Match with 304, until the user's documents change.'''
+
+def test_conditional_requests(logged_in_client):
+    payload = os.urandom(50_000)
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(payload), "id.pdf")},
+                          content_type="multipart/form-data")
+    doc_id = logged_in_client.get("/api/documents").get_json()["documents"][0]["id"]
+
+    first = logged_in_client.get(f"/download/{doc_id}")
+    assert first.headers["ETag"] and first.headers["Last-Modified"]
+    again = logged_in_client.get(f"/download/{doc_id}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    stale = logged_in_client.get(f"/download/{doc_id}", headers={"If-Range": '"other"', "Range": "bytes=0-9"})
+    assert stale.status_code == 200 and stale.data == payload
+
+    summary = logged_in_client.get("/export_summary")
+    etag = summary.headers["ETag"]
+    assert logged_in_client.get("/export_summary", headers={"If-None-Match": etag}).status_code == 304
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(b"%PDF-1.4 x"), "visa.pdf")},
+                          content_type="multipart/form-data")
+    assert logged_in_client.get("/export_summary", headers={"If-None-Match": etag}).status_code == 200
+
+'''Test Case: /metrics should expose request latency, SQL counts and blob
+    I/O timings in the Prometheus text format.'''
+
+def test_metrics_endpoint(logged_in_client, monkeypatch):
+    logged_in_client.post("/upload", data={"file": (io.BytesIO(b"%PDF-1.4 hello"), "a.pdf")},
+                          content_type="multipart/form-data")
+    logged_in_client.get("/api/documents")
+
+    # Closed by default outside debug mode
+    assert logged_in_client.get("/metrics").status_code == 403
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "s3cret")
+    assert logged_in_client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = logged_in_client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert '# TYPE flyvia_http_request_duration_seconds histogram' in text
+    assert 'flyvia_http_request_duration_seconds_count{route="/api/documents",method="GET",status="200"}' in text
+    assert 'flyvia_sql_queries_per_request_count{route="/upload"}' in text
+    assert 'flyvia_blob_io_duration_seconds_count{op="encrypt_stream"}' in text
+
+'''Test Case: When the password-hashing queue is full, login should be
+    turned away at once with 503 and a Retry-After header.'''
+
+def test_login_rejected_when_hashing_saturated(client, monkeypatch):
+    import app as app_module
+    client.post("/signup", data={"email": "busy@example.com", "password": "pass"})
+    monkeypatch.setattr(app_module.password_hasher, "max_pending", 0)
+    response = client.post("/login", data={"email": "busy@example.com", "password": "pass"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
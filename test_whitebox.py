@@ -1,16 +1,18 @@
+import smtplib
+
 import pytest
-from app import app
+from app import create_app
 from utils import encrypt_bytes, decrypt_bytes, audit
 from models import db, AuditLog
 
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "SCHEDULER_ENABLED": False})
+
 # ----------------------------------------------------------
 # ✅ Flask app fixture for testing database and context
 # ----------------------------------------------------------
 @pytest.fixture
 def test_app():
     """Creates a temporary Flask app context for white box testing."""
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"  # in-memory DB
     with app.app_context():
         db.create_all()
         yield app
@@ -61,3 +63,660 @@ def test_unique_ciphertexts():
     nonce2, cipher2 = encrypt_bytes(data)
     assert nonce1 != nonce2 or cipher1 != cipher2, \
         "Encryption must produce unique outputs for identical input data"
+
+
+# ==========================================================
+# ✅ TEST 5 – SEGMENTED STREAM ENCRYPTION
+# ==========================================================
+def test_segmented_stream_roundtrip(tmp_path):
+    import io, os
+    from utils import encrypt_stream, iter_decrypt_file
+    data = os.urandom(10_000)
+    path = tmp_path / "doc.bin"
+    with open(path, "wb") as f:
+        assert encrypt_stream(io.BytesIO(data), f, segment_size=4096) == len(data)
+    chunks = list(iter_decrypt_file(str(path)))
+    assert len(chunks) == 3
+    assert b"".join(chunks) == data
+
+
+def test_segmented_stream_detects_truncation(tmp_path):
+    import io, os
+    from cryptography.exceptions import InvalidTag
+    from utils import encrypt_stream, iter_decrypt_file, SEGMENT_HEADER, SEGMENT_TAG_SIZE
+    path = tmp_path / "doc.bin"
+    with open(path, "wb") as f:
+        encrypt_stream(io.BytesIO(os.urandom(8192)), f, segment_size=4096)
+    with open(path, "r+b") as f:
+        f.truncate(SEGMENT_HEADER.size + 4096 + SEGMENT_TAG_SIZE)
+    with pytest.raises(InvalidTag):
+        list(iter_decrypt_file(str(path)))
+
+
+def test_legacy_blob_still_decrypts(tmp_path):
+    import base64
+    from utils import iter_decrypt_file
+    nonce_b64, cipher_b64 = encrypt_bytes(b"old format")
+    path = tmp_path / "legacy.bin"
+    path.write_bytes(base64.b64decode(cipher_b64))
+    assert b"".join(iter_decrypt_file(str(path), nonce_b64)) == b"old format"
+
+
+# ==========================================================
+# ✅ TEST 6 – RANGED DECRYPTION
+# ==========================================================
+def test_segmented_range_decrypt(tmp_path):
+    import io, os
+    from utils import encrypt_stream, iter_decrypt_file, plaintext_size
+    data = os.urandom(10_000)
+    path = tmp_path / "doc.bin"
+    with open(path, "wb") as f:
+        encrypt_stream(io.BytesIO(data), f, segment_size=4096)
+    assert plaintext_size(str(path)) == len(data)
+    for start, end in [(0, 1), (4000, 4200), (4096, 8192), (9999, 10_000), (123, None)]:
+        assert b"".join(iter_decrypt_file(str(path), start=start, end=end)) == data[start:end]
+
+
+class FakeSMTP:
+    """Stands in for an smtplib.SMTP session; optionally fails N sends or refuses addresses."""
+    def __init__(self, fail_first=0, refused=()):
+        self.recipients = []
+        self.attempts = []
+        self.fail_first = fail_first
+        self.refused = set(refused)
+
+    def send_message(self, msg):
+        self.attempts.append(msg["To"])
+        if msg["To"] in self.refused:
+            raise smtplib.SMTPRecipientsRefused({msg["To"]: (550, b"No such user")})
+        if self.fail_first:
+            self.fail_first -= 1
+            raise ConnectionResetError("dropped")
+        self.recipients.append(msg["To"])
+
+    def quit(self):
+        pass
+
+
+# ==========================================================
+# ✅ TEST 7 – REMINDERS ARE SENT ONCE AND PERSISTED
+# ==========================================================
+def test_check_reminders_sends_once(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime, timedelta
+    from models import User, Document
+    from mailer import MailQueue
+    smtp = FakeSMTP()
+    mail_queue = MailQueue(workers=1, connect=lambda: smtp).start()
+    monkeypatch.setattr(app_module, "mail_queue", mail_queue)
+    user = User(email="remind@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    now = datetime.utcnow()
+    db.session.add_all([
+        Document(owner_id=user.id, filename="due.pdf", stored_name="a.bin", reminder_at=now),
+        Document(owner_id=user.id, filename="later.pdf", stored_name="b.bin",
+                 reminder_at=now + timedelta(days=3)),
+    ])
+    db.session.commit()
+
+    app_module.check_reminders()
+    assert mail_queue.flush(timeout=5)
+    app_module.check_reminders()
+    assert mail_queue.flush(timeout=5)
+    mail_queue.stop()
+    assert smtp.recipients == ["remind@example.com"]
+    assert Document.query.filter_by(filename="due.pdf").one().reminder_sent_at is not None
+    assert Document.query.filter_by(filename="later.pdf").one().reminder_sent_at is None
+
+
+def test_upgrade_marks_past_reminders_sent(test_app):
+    from datetime import datetime, timedelta
+    from models import User, Document, upgrade_schema
+    from sqlalchemy import text
+    user = User(email="upgrade@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    now = datetime.utcnow()
+    db.session.add_all([
+        Document(owner_id=user.id, filename="past.pdf", stored_name="p.bin", reminder_at=now - timedelta(hours=2)),
+        Document(owner_id=user.id, filename="future.pdf", stored_name="f.bin", reminder_at=now + timedelta(hours=2)),
+    ])
+    db.session.commit()
+    # A database from before reminder_sent_at: the old scheduler already sent past.pdf's reminder
+    db.session.execute(text("DROP INDEX ix_document_reminder_pending"))
+    db.session.execute(text("ALTER TABLE document DROP COLUMN reminder_sent_at"))
+    db.session.commit()
+    upgrade_schema()
+    db.session.expire_all()
+    sent = {d.filename: d.reminder_sent_at for d in Document.query.all()}
+    assert sent["past.pdf"] is not None and sent["future.pdf"] is None
+    upgrade_schema()  # the column exists now: no second backfill
+    assert Document.query.filter_by(filename="future.pdf").one().reminder_sent_at is None
+
+
+def test_queued_reminder_claim_does_not_expire(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime
+    from models import User, Document
+    from mailer import MailQueue
+    mail_queue = MailQueue()   # never started: the reminder sits in the backlog
+    monkeypatch.setattr(app_module, "mail_queue", mail_queue)
+    monkeypatch.setitem(test_app.config, "REMINDER_CLAIM_TIMEOUT_MINUTES", 0)
+    user = User(email="backlog@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    db.session.add(Document(owner_id=user.id, filename="due.pdf", stored_name="a.bin", reminder_at=datetime.utcnow()))
+    db.session.commit()
+
+    app_module.check_reminders()
+    app_module.check_reminders()   # the claim is past its timeout, but still queued
+    assert mail_queue.stats()["queued"] == 1
+    assert mail_queue.pending_keys() == [("reminder", Document.query.one().id)]
+
+
+def test_refused_reminder_is_not_retried(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime
+    from models import User, Document
+    from mailer import MailQueue
+    smtp = FakeSMTP(refused={"gone@example.com"})
+    mail_queue = MailQueue(workers=1, connect=lambda: smtp).start()
+    monkeypatch.setattr(app_module, "mail_queue", mail_queue)
+    user = User(email="gone@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    db.session.add(Document(owner_id=user.id, filename="due.pdf", stored_name="a.bin", reminder_at=datetime.utcnow()))
+    db.session.commit()
+
+    for _ in range(4):
+        app_module.check_reminders()
+        assert mail_queue.flush(timeout=5)
+    mail_queue.stop()
+    assert smtp.attempts == ["gone@example.com"]
+    assert Document.query.one().reminder_sent_at is not None
+    assert AuditLog.query.filter_by(user_id=user.id, action="reminder_failed").count() == 1
+
+
+# ==========================================================
+# ✅ TEST 8 – MAIL QUEUE REUSES SESSIONS AND RETRIES
+# ==========================================================
+def test_mail_queue_reuses_connection_and_retries():
+    from mailer import MailQueue
+    smtp, connects, failed = FakeSMTP(fail_first=1), [], []
+    mail_queue = MailQueue(workers=1, backoff=0.01, connect=lambda: connects.append(1) or smtp).start()
+    for i in range(5):
+        mail_queue.enqueue(f"user{i}@example.com", "hi", "body", on_failed=failed.append)
+    assert mail_queue.flush(timeout=5)
+    mail_queue.stop()
+    assert sorted(smtp.recipients) == [f"user{i}@example.com" for i in range(5)]
+    assert len(connects) == 2  # one reconnect after the dropped send
+    assert not failed
+
+
+# ==========================================================
+# ✅ TEST 9 – BUFFERED AUDIT ENTRIES ARE BULK-WRITTEN
+# ==========================================================
+def test_audit_entries_follow_their_transaction(test_app, monkeypatch):
+    from utils import audit_buffer
+    monkeypatch.setattr(audit_buffer, "app", None)  # keep the background flusher out of it
+    audit(8, "login", "outside any transaction")
+    db.session.execute(db.text("SELECT 1"))
+    audit(7, "upload", "a")
+    db.session.rollback()                # the upload failed: its entry goes with it
+    db.session.execute(db.text("SELECT 1"))
+    audit(7, "upload", "b")
+    audit(7, "upload", "c")
+    db.session.commit()
+    # The shared buffer is left to the flusher, not written by whoever commits next
+    assert [row["user_id"] for row in audit_buffer.drain()] == [8]
+    db.session.remove()
+    assert [log.detail for log in AuditLog.query.order_by(AuditLog.id)] == ["b", "c"]
+
+
+# ==========================================================
+# ✅ TEST 10 – IDENTITY CACHE HITS AND INVALIDATION
+# ==========================================================
+def test_identity_cache(test_app):
+    from models import User
+    from utils import identity_cache as cache
+    cache.clear()
+    hits = cache.hits
+    user = User(email="cached@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+
+    assert cache.get(user_id).email == "cached@example.com"   # miss, loads and caches
+    db.session.remove()
+    assert cache.get(user_id).email == "cached@example.com"   # hit, no query
+    assert cache.hits == hits + 1
+
+    cache.invalidate(user_id)
+    db.session.remove()
+    cached = cache.get(user_id)
+    cached.email = "renamed@example.com"
+    db.session.commit()
+    db.session.remove()
+    assert cache.get(user_id).email == "renamed@example.com"
+
+
+# ==========================================================
+# ✅ TEST 11 – RESUMABLE BLOBS SURVIVE TORN WRITES
+# ==========================================================
+def test_resumable_blob_recovers_from_torn_write(tmp_path):
+    import io, os
+    from utils import ResumableBlob, iter_decrypt_file
+    data = os.urandom(9000)
+    path = str(tmp_path / "doc.bin")
+    blob = ResumableBlob.create(path, len(data), segment_size=4096)
+    assert blob.append(io.BytesIO(data[:5000])) == 5000
+    with open(path, "ab") as f:
+        f.write(b"half a segment")   # crash in the middle of the next append
+    size = os.path.getsize(path)
+    assert blob.offset() == 5000
+    assert os.path.getsize(path) == size   # a status probe never cuts into a chunk being written
+    assert blob.append(io.BytesIO(data[5000:])) == len(data)
+    assert b"".join(iter_decrypt_file(path)) == data
+
+
+# ==========================================================
+# ✅ TEST 12 – COMPRESSION BEFORE ENCRYPTION
+# ==========================================================
+def test_compressed_blob_roundtrip(tmp_path, monkeypatch):
+    import io, os
+    from config import Config
+    from utils import choose_codec, choose_stream_codec, sample_stream, save_encrypted_stream, iter_plaintext
+    assert choose_codec(os.urandom(48 * 1024)) is None       # e.g. JPEG data: stored as-is
+    text = b"".join(b"%d Statement line, balance carried forward\n" % i for i in range(20000))
+    for codec in ("zlib", choose_codec(sample_stream(io.BytesIO(text)))):
+        path = str(tmp_path / f"{codec}.bin")
+        save_encrypted_stream(path, io.BytesIO(text), codec)
+        assert os.path.getsize(path) < len(text) // 3
+        assert b"".join(iter_plaintext(path, codec=codec)) == text
+        assert b"".join(iter_plaintext(path, codec=codec, start=300_000, end=300_100)) == text[300_000:300_100]
+    monkeypatch.setattr(Config, "COMPRESSION_MAX_BYTES", len(text) - 1)
+    assert choose_stream_codec(io.BytesIO(text)) is None     # too large to give up cheap Range seeks
+
+
+# ==========================================================
+# ✅ TEST 13 – FLAT BLOBS MIGRATE INTO SHARDS
+# ==========================================================
+def test_migrate_flat_files(tmp_path):
+    import os
+    from storage import blob_path, locate_blob, migrate_flat_files
+    folder = str(tmp_path)
+    names = [f"{i:02x}3e94b2-0000.bin" for i in range(5)]
+    for name in names:
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(name.encode())
+    assert locate_blob(folder, names[0]) == os.path.join(folder, names[0])
+
+    report = migrate_flat_files(folder, workers=2, skip={names[4]}, batch_size=2)
+    assert (report["moved"], report["skipped"]) == (4, 1)
+    for name in names[:4]:
+        assert locate_blob(folder, name) == blob_path(folder, name)
+        with open(locate_blob(folder, name), "rb") as f:
+            assert f.read() == name.encode()
+    assert sorted(os.listdir(folder))[-1] == names[4]
+    assert migrate_flat_files(folder, skip={names[4]})["moved"] == 0   # re-running is a no-op
+
+
+# ==========================================================
+# ✅ TEST 14 – STORAGE GC REMOVES ONLY OLD ORPHANS
+# ==========================================================
+def test_sweep_orphans(test_app, tmp_path):
+    import os, time
+    from models import Document
+    from storage import new_blob_path, sweep_orphans
+    folder = str(tmp_path)
+    old = time.time() - 2 * 3600
+
+    def put(name, age=old):
+        path = new_blob_path(folder, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(path, (age, age))
+        return path
+
+    kept = put("aa11-live.bin")
+    db.session.add(Document(owner_id=1, filename="live.pdf", stored_name="aa11-live.bin"))
+    db.session.commit()
+    orphan, part = put("aa11-orphan.bin"), put("bb22-crashed.bin.part")
+    fresh = put("cc33-uploading.bin", age=time.time())
+
+    first = sweep_orphans(folder, grace_minutes=60, max_dirs=2)      # flat level + aa/11
+    assert first["checkpoint"] == "aa/11" and first["removed"] == 1
+    rest = sweep_orphans(folder, grace_minutes=60)
+    assert rest["checkpoint"] is None and rest["bytes"] == 100
+    assert os.path.exists(kept) and os.path.exists(fresh)
+    assert not os.path.exists(orphan) and not os.path.exists(part)
+
+
+# ==========================================================
+# ✅ TEST 15 – KEY ROTATION RE-ENCRYPTS EVERY BLOB ONCE
+# ==========================================================
+def test_rotate_keys(test_app, tmp_path, monkeypatch):
+    import io, os
+    import storage, utils
+    from models import Document, Blob
+    from rotation import keys_in_use, rotate_keys
+    monkeypatch.setitem(utils.KEYRING, "k2", os.urandom(32))
+    folder = str(tmp_path)
+    legacy, text = os.urandom(5000), b"quarterly statement\n" * 5000
+
+    nonce_b64, cipher_b64 = encrypt_bytes(legacy)
+    utils.save_file_bytes(storage.new_blob_path(folder, "aa-legacy.bin"), cipher_b64)
+    utils.save_encrypted_stream(storage.new_blob_path(folder, "bb-shared.bin"), io.BytesIO(text), "zlib")
+    db.session.add_all([
+        Document(owner_id=1, filename="old.png", stored_name="aa-legacy.bin", nonce_b64=nonce_b64),
+        Document(owner_id=1, filename="a.pdf", stored_name="bb-shared.bin", codec="zlib", content_hmac="x"),
+        Document(owner_id=1, filename="b.pdf", stored_name="bb-shared.bin", codec="zlib", content_hmac="x"),
+        Blob(stored_name="bb-shared.bin", owner_id=1, content_hmac="x", size=len(text), codec="zlib", refcount=2),
+    ])
+    db.session.commit()
+
+    report = rotate_keys(folder, "k2", workers=2, batch_size=1)
+    assert (report["rotated"], report["failed"]) == (2, 0)
+    docs = Document.query.order_by(Document.filename).all()
+    assert {(d.key_id, d.nonce_b64) for d in docs} == {("k2", None)}
+    assert docs[0].stored_name == docs[1].stored_name == Blob.query.one().stored_name
+    for doc, expected in zip(docs, (text, text, legacy)):
+        path = storage.locate_blob(folder, doc.stored_name)
+        assert b"".join(utils.iter_plaintext(path, codec=doc.codec, key_id=doc.key_id)) == expected
+    # Replaced files outlive the rotation until the GC's grace period is over
+    old_files = [storage.blob_path(folder, name) for name in ("aa-legacy.bin", "bb-shared.bin")]
+    assert all(os.path.exists(path) for path in old_files)
+    assert storage.sweep_orphans(folder, grace_minutes=60)["removed"] == 0
+    assert storage.sweep_orphans(folder, grace_minutes=0)["removed"] == 2
+    assert not any(os.path.exists(path) for path in old_files)
+    assert rotate_keys(folder, "k2")["rotated"] == 0
+    # Dedup fingerprints moved off ENCRYPTION_KEY with the blobs
+    digest, _ = utils.content_hmac(1, [text], "k2")
+    blob = Blob.query.one()
+    assert (blob.content_hmac, blob.hmac_key_id) == (digest, "k2")
+    assert docs[0].content_hmac == docs[1].content_hmac == digest and docs[2].content_hmac is None
+    assert keys_in_use() == {"k2"}
+
+    # A blob already under k2 whose fingerprint isn't gets rewritten too
+    blob.hmac_key_id, blob.content_hmac = None, "x"
+    db.session.commit()
+    assert rotate_keys(folder, "k2")["rotated"] == 1
+    assert Blob.query.one().content_hmac == digest
+
+
+def test_encryption_key_can_be_retired():
+    import base64
+    import os
+    import subprocess
+    import sys
+    env = {k: v for k, v in os.environ.items() if k != "ENCRYPTION_KEY"}
+    env.update(ENCRYPTION_KEYS="k2:" + base64.b64encode(os.urandom(32)).decode(), ENCRYPTION_KEY_ID="k2")
+    result = subprocess.run([sys.executable, "-c", "import utils; print(sorted(utils.KEYRING))"], env=env,
+                            cwd=os.path.dirname(__file__), capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "['k2']"
+
+
+# ==========================================================
+# ✅ TEST 16 – ONE SCHEDULER LEADER, TAKEOVER WHEN IT STOPS
+# ==========================================================
+def test_scheduler_leader_election(tmp_path):
+    from leader import LeaderElection
+    lock_path = str(tmp_path / "scheduler.lock")
+    first = LeaderElection(lock_path, on_elected=lambda: None)
+    second = LeaderElection(lock_path, on_elected=lambda: None)
+    assert first.try_acquire() is True
+    assert second.try_acquire() is False
+    first.stop()
+    assert second.try_acquire() is True
+    assert first.try_acquire() is False
+    second.stop()
+
+
+def test_cli_commands_skip_scheduler_election(tmp_path):
+    import click
+    config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+              "SCHEDULER_LOCK_FILE": str(tmp_path / "scheduler.lock")}
+    # `flask <command>` loads the app from within the `flask` group's context
+    with click.Context(click.Group("flask"), info_name="flask"):
+        assert "scheduler_election" not in create_app(config).extensions
+
+
+# ==========================================================
+# ✅ TEST 17 – PASSWORD HASHES ARE UPGRADED WHEN PARAMETERS CHANGE
+# ==========================================================
+def test_password_rehash_on_method_change(test_app, monkeypatch):
+    import app as app_module
+    from models import User
+    from passwords import PasswordHasher
+    old = PasswordHasher("pbkdf2:sha256:1000", workers=0)
+    new = PasswordHasher("pbkdf2:sha256:2000", workers=1)
+    try:
+        stored = old.hash("pw")
+        assert new.verify(stored, "pw") and new.needs_rehash(stored)
+        assert not new.needs_rehash(new.hash("pw"))
+
+        db.session.add(User(email="rehash@example.com", password_hash=stored))
+        db.session.commit()
+        monkeypatch.setattr(app_module, "password_hasher", new)
+        response = test_app.test_client().post("/login", data={"email": "rehash@example.com", "password": "pw"})
+        assert response.status_code == 302
+        upgraded = User.query.filter_by(email="rehash@example.com").one().password_hash
+        assert upgraded.startswith("pbkdf2:sha256:2000$") and new.verify(upgraded, "pw")
+    finally:
+        new.shutdown()
+
+
+def test_password_rehash_never_fails_login(test_app, monkeypatch):
+    import app as app_module
+    import metrics
+    from models import User
+    from passwords import PasswordHasher
+    from werkzeug.security import generate_password_hash
+    hasher = PasswordHasher("scrypt", workers=0)
+    hashed = metrics.password_kdf_seconds.count(op="hash")
+    assert not hasher.needs_rehash(generate_password_hash("pw", "scrypt"))
+    assert hasher.needs_rehash(generate_password_hash("pw", "pbkdf2:sha256:1000"))
+    assert metrics.password_kdf_seconds.count(op="hash") == hashed  # no KDF run to find the prefix
+
+    stored = generate_password_hash("pw", "pbkdf2:sha256:1000")
+    db.session.add(User(email="stuck@example.com", password_hash=stored))
+    db.session.commit()
+
+    def broken(password):
+        raise RuntimeError("hash pool gone")
+    monkeypatch.setattr(hasher, "hash", broken)
+    monkeypatch.setattr(app_module, "password_hasher", hasher)
+    response = test_app.test_client().post("/login", data={"email": "stuck@example.com", "password": "pw"})
+    assert response.status_code == 302
+    assert User.query.filter_by(email="stuck@example.com").one().password_hash == stored
+
+
+def test_password_pool_replaced_after_worker_dies():
+    import os
+    import signal
+    from passwords import PasswordHasher
+    hasher = PasswordHasher("pbkdf2:sha256:1000", workers=1)
+    try:
+        stored = hasher.hash("pw")
+        for process in list(hasher._pool._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        assert hasher.verify(stored, "pw")
+    finally:
+        hasher.shutdown()
+
+
+# ==========================================================
+# ✅ TEST 18 – ONE DIGEST EMAIL PER USER PER DAY
+# ==========================================================
+def test_send_digests_groups_by_user(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime, timedelta
+    from models import User, Document
+    from mailer import MailQueue
+    smtp = FakeSMTP()
+    mail_queue = MailQueue(workers=1, connect=lambda: smtp).start()
+    monkeypatch.setattr(app_module, "mail_queue", mail_queue)
+    alice = User(email="alice@example.com", password_hash="x")
+    bob = User(email="bob@example.com", password_hash="x")
+    carol = User(email="carol@example.com", password_hash="x")
+    db.session.add_all([alice, bob, carol])
+    db.session.commit()
+    now = datetime.utcnow()
+    db.session.add_all([
+        Document(owner_id=alice.id, filename="due1.pdf", stored_name="a1.bin", reminder_at=now - timedelta(minutes=5)),
+        Document(owner_id=alice.id, filename="due2.pdf", stored_name="a2.bin", reminder_at=now - timedelta(hours=1)),
+        Document(owner_id=alice.id, filename="visa.pdf", stored_name="a3.bin", expiry_date=now.date() + timedelta(days=3)),
+        Document(owner_id=bob.id, filename="passport.pdf", stored_name="b1.bin", expiry_date=now.date()),
+        Document(owner_id=carol.id, filename="later.pdf", stored_name="c1.bin",
+                 reminder_at=now + timedelta(days=3), expiry_date=now.date() + timedelta(days=60)),
+    ])
+    db.session.commit()
+
+    assert app_module.send_digests() == 2
+    assert mail_queue.flush(timeout=5)
+    assert sorted(smtp.recipients) == ["alice@example.com", "bob@example.com"]
+    # Already sent today: nothing more until the next digest time
+    assert app_module.send_digests() == 0
+    mail_queue.stop()
+    sent = {d.filename: d.reminder_sent_at for d in Document.query.all()}
+    assert sent["due1.pdf"] and sent["due2.pdf"] and sent["later.pdf"] is None
+
+
+# ==========================================================
+# ✅ TEST 19 – METRICS ADD UP ACROSS WORKER PROCESSES
+# ==========================================================
+def test_metrics_add_up_across_workers(tmp_path):
+    import json
+    import os
+    import subprocess
+    import sys
+    from metrics import Counter, Gauge, Histogram, Registry, SharedDirectory
+    registry = Registry()
+    requests = Counter(registry, "t_requests_total", "Requests", ["route"])
+    latency = Histogram(registry, "t_seconds", "Latency", buckets=(0.1, 1))
+    depth = Gauge(registry, "t_depth", "Depth")
+    requests.inc(route="/a")
+    latency.observe(0.05)
+    depth.set(4)
+    registry.shared = SharedDirectory(registry, str(tmp_path))
+
+    # A worker that has exited, and one that is still running
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    (tmp_path / f"{exited.pid}.json").write_text(json.dumps({"pid": exited.pid, "metrics": {
+        "t_requests_total": [[["/a"], 5]], "t_seconds": [[[], [[0, 1], 2.0, 1]]], "t_depth": [[[], 100]]}}))
+    (tmp_path / "live.json").write_text(json.dumps({"pid": os.getppid(), "metrics": {
+        "t_requests_total": [[["/b"], 1]], "t_depth": [[[], 7]]}}))
+
+    text = registry.render()
+    assert 't_requests_total{route="/a"} 6' in text and 't_requests_total{route="/b"} 1' in text
+    assert 't_seconds_bucket{le="0.1"} 1' in text and 't_seconds_bucket{le="1"} 2' in text
+    assert "t_seconds_count 2" in text
+    assert "t_depth 11" in text  # the exited worker's gauge is dropped
+
+    registry.shared.write()
+    assert json.loads((tmp_path / f"{os.getpid()}.json").read_text())["metrics"]["t_depth"] == [[[], 4]]
+
+
+# ==========================================================
+# ✅ TEST 20 – WORKERS STARTING TOGETHER UPGRADE THE SCHEMA ONCE
+# ==========================================================
+def test_concurrent_schema_upgrade(tmp_path):
+    import os
+    import subprocess
+    import sys
+    from sqlalchemy import create_engine, inspect
+    db_path = tmp_path / "shared.db"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", UPLOAD_FOLDER=str(tmp_path / "uploads"),
+               SCHEDULER_ENABLED="0")
+    script = "from app import create_app; create_app()"
+    workers = [subprocess.Popen([sys.executable, "-c", script], env=env, cwd=os.path.dirname(__file__),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) for _ in range(4)]
+    for worker in workers:
+        assert worker.wait(timeout=60) == 0, worker.stderr.read().decode()
+    tables = inspect(create_engine(f"sqlite:///{db_path}")).get_table_names()
+    assert "document" in tables and "document_fts" in tables
+
+
+# ==========================================================
+# ✅ TEST 21 – A DIGEST LISTS THE REMINDERS SINCE THE PREVIOUS ONE
+# ==========================================================
+def test_digest_reminders_since_previous_digest(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime, timedelta
+    from models import User, Document
+    from mailer import MailQueue
+    monkeypatch.setitem(test_app.config, "REMINDER_CATCHUP_MINUTES", 30)
+    monkeypatch.setattr(app_module, "mail_queue", MailQueue())
+    now = datetime.utcnow()
+    cutoff = app_module.digest_cutoff(now, test_app.config["REMINDER_DIGEST_HOUR"])
+    dave = User(email="dave@example.com", password_hash="x", last_digest_at=cutoff - timedelta(days=1))
+    db.session.add(dave)
+    db.session.commit()
+    db.session.add_all([
+        # Due long before the catch-up window, but after dave's last digest
+        Document(owner_id=dave.id, filename="since.pdf", stored_name="d1.bin",
+                 reminder_at=cutoff - timedelta(hours=2)),
+        # Due before the last digest: already offered in it
+        Document(owner_id=dave.id, filename="before.pdf", stored_name="d2.bin",
+                 reminder_at=cutoff - timedelta(days=1, hours=1)),
+    ])
+    db.session.commit()
+
+    assert app_module.send_digests() == 1
+    body = app_module.mail_queue._queue.get_nowait().msg.get_payload(0).get_payload(decode=True).decode()
+    assert "since.pdf" in body and "before.pdf" not in body
+
+
+def test_refused_digest_is_not_retried(test_app, monkeypatch):
+    import app as app_module
+    from datetime import datetime, timedelta
+    from models import User, Document
+    from mailer import MailQueue
+    smtp = FakeSMTP(refused={"gone@example.com"})
+    mail_queue = MailQueue(workers=1, connect=lambda: smtp).start()
+    monkeypatch.setattr(app_module, "mail_queue", mail_queue)
+    user = User(email="gone@example.com", password_hash="x")
+    db.session.add(user)
+    db.session.commit()
+    now = datetime.utcnow()
+    db.session.add_all([
+        Document(owner_id=user.id, filename="visa.pdf", stored_name="g1.bin", expiry_date=now.date() + timedelta(days=2)),
+        Document(owner_id=user.id, filename="due.pdf", stored_name="g2.bin", reminder_at=now - timedelta(minutes=5)),
+    ])
+    db.session.commit()
+
+    for _ in range(4):
+        app_module.send_digests()
+        assert mail_queue.flush(timeout=5)
+    mail_queue.stop()
+    assert smtp.attempts == ["gone@example.com"]
+    assert Document.query.filter_by(filename="due.pdf").one().reminder_sent_at is not None
+    assert AuditLog.query.filter_by(user_id=user.id, action="digest_failed").count() == 1
+
+
+# ==========================================================
+# ✅ TEST 22 – UPGRADING A DATABASE INDEXES ITS EXISTING DOCUMENTS
+# ==========================================================
+def test_upgrade_indexes_existing_documents(test_app):
+    import search
+    from models import User, Document, upgrade_schema
+    from sqlalchemy import text
+    erin = User(email="erin@example.com", password_hash="x")
+    db.session.add(erin)
+    db.session.commit()
+    db.session.add(Document(owner_id=erin.id, filename="tax_return_2023.pdf", stored_name="e1.bin", category="Tax"))
+    db.session.commit()
+    # A database from before the search index: upgrade_schema()'s create_all()
+    # creates the table empty, ensure_index() has to fill it
+    db.session.execute(text("DROP TABLE document_fts"))
+    db.session.commit()
+    upgrade_schema()
+    search.ensure_index()
+    assert [doc.filename for doc, snippet in search.search_documents(erin.id, "tax")] == ["tax_return_2023.pdf"]
+    search.ensure_index()  # nothing left to backfill
+    assert db.session.execute(text("SELECT count(*) FROM document_fts")).scalar() == 1
@@ -1,20 +1,71 @@
 import os
+import io
+import hmac
+import atexit
 import base64
+import struct
 import smtplib
+import threading
+import time
+import zlib
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
+try:
+    import fcntl
+except ImportError:  # Windows: file locks fall back to in-process locks
+    fcntl = None
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from datetime import datetime
+from flask import has_app_context
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, make_transient_to_detached
 from config import Config
-from models import db, AuditLog
+import metrics
+from models import db, AuditLog, Document, User
 
 
 # --- Encryption setup ---
-if not Config.ENCRYPTION_KEY_B64:
-    raise RuntimeError("ENCRYPTION_KEY not set in .env — generate one using base64 key generator")
+def _load_keyring():
+    """ENCRYPTION_KEY (key id None), if set, plus any "id:base64" keys in ENCRYPTION_KEYS."""
+    keyring = {}
+    if Config.ENCRYPTION_KEY_B64:
+        keyring[None] = base64.b64decode(Config.ENCRYPTION_KEY_B64)
+    for item in filter(None, (part.strip() for part in (Config.ENCRYPTION_KEYS or "").split(","))):
+        key_id, _, key_b64 = item.partition(":")
+        key = base64.b64decode(key_b64)
+        if not key_id or len(key) != 32:
+            raise RuntimeError(f"ENCRYPTION_KEYS entry {key_id or item!r} must be id:<base64 32-byte key>")
+        keyring[key_id] = key
+    return keyring
 
-ENCRYPTION_KEY = base64.b64decode(Config.ENCRYPTION_KEY_B64)
+
+# Blobs record the id of the key they were written with; new blobs use the
+# active key, older ones stay readable until `flask rotate-keys` rewrites them.
+# Once nothing uses ENCRYPTION_KEY any more it can be left out entirely.
+KEYRING = _load_keyring()
+ACTIVE_KEY_ID = Config.ENCRYPTION_KEY_ID or None
+if ACTIVE_KEY_ID is None and None not in KEYRING:
+    raise RuntimeError("ENCRYPTION_KEY not set in .env — generate one using base64 key generator "
+                       "(or set ENCRYPTION_KEYS and ENCRYPTION_KEY_ID)")
+if ACTIVE_KEY_ID not in KEYRING:
+    raise RuntimeError(f"ENCRYPTION_KEY_ID {ACTIVE_KEY_ID!r} is not in ENCRYPTION_KEYS")
+
+
+def master_key(key_id: str = None) -> bytes:
+    try:
+        return KEYRING[key_id]
+    except KeyError:
+        raise ValueError(f"Unknown encryption key id: {key_id}") from None
 
 
 # ==========================================================
@@ -22,18 +73,466 @@ ENCRYPTION_KEY = base64.b64decode(Config.ENCRYPTION_KEY_B64)
 # ==========================================================
 def encrypt_bytes(data: bytes):
     """Encrypt file bytes using AES-GCM (256-bit)."""
-    aesgcm = AESGCM(ENCRYPTION_KEY)
+    aesgcm = AESGCM(master_key(None))
     nonce = os.urandom(12)  # 96-bit nonce
-    ciphertext = aesgcm.encrypt(nonce, data, None)
+    with metrics.blob_op("encrypt_bytes", len(data)):
+        ciphertext = aesgcm.encrypt(nonce, data, None)
     return base64.b64encode(nonce).decode(), base64.b64encode(ciphertext).decode()
 
 
 def decrypt_bytes(nonce_b64: str, cipher_b64: str) -> bytes:
     """Decrypt file bytes using AES-GCM."""
-    aesgcm = AESGCM(ENCRYPTION_KEY)
+    aesgcm = AESGCM(master_key(None))
     nonce = base64.b64decode(nonce_b64)
     ciphertext = base64.b64decode(cipher_b64)
-    return aesgcm.decrypt(nonce, ciphertext, None)
+    with metrics.blob_op("decrypt_bytes", len(ciphertext)):
+        return aesgcm.decrypt(nonce, ciphertext, None)
+
+
+# ==========================================================
+# 🧱 SEGMENTED (STREAMING) ENCRYPTION
+# ==========================================================
+# On-disk layout of a segmented blob:
+#   header  = MAGIC | version | segment size | HKDF salt | nonce prefix
+#   body    = one AES-GCM record (ciphertext + 16-byte tag) per segment
+# Every blob gets its own subkey (HKDF over a random salt), and segment i is
+# sealed with nonce = prefix | i | final-flag, so segments cannot be reordered,
+# dropped or truncated without failing authentication. Legacy single-blob
+# files have no header; they are recognised by their Document.nonce_b64.
+SEGMENT_MAGIC = b"FVDS"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct(">4sBI16s7s")
+SEGMENT_TAG_SIZE = 16
+
+
+def _segment_key(salt: bytes, key_id: str = None) -> AESGCM:
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"flyvia-segment-v1")
+    return AESGCM(hkdf.derive(master_key(key_id)))
+
+
+def _segment_nonce(prefix: bytes, index: int, final: bool) -> bytes:
+    return prefix + struct.pack(">I?", index, final)
+
+
+def _read_exact(stream, size: int) -> bytes:
+    """Read up to `size` bytes, looping over short reads until EOF."""
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def encrypt_stream(src, dst, segment_size: int = None, key_id: str = None) -> int:
+    """Encrypt a readable stream into `dst` one segment at a time.
+
+    Returns the number of plaintext bytes written. At most two segments of
+    plaintext are held in memory, whatever the size of the input.
+    """
+    segment_size = segment_size or Config.ENCRYPTION_SEGMENT_SIZE
+    salt, prefix = os.urandom(16), os.urandom(7)
+    header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, segment_size, salt, prefix)
+    aesgcm = _segment_key(salt, key_id)
+    dst.write(header)
+
+    total, index = 0, 0
+    chunk = _read_exact(src, segment_size)
+    while True:
+        following = _read_exact(src, segment_size) if len(chunk) == segment_size else b""
+        final = not following
+        dst.write(aesgcm.encrypt(_segment_nonce(prefix, index, final), chunk, header))
+        total += len(chunk)
+        if final:
+            return total
+        chunk, index = following, index + 1
+
+
+def _read_segment_header(f, stored_path: str):
+    header = f.read(SEGMENT_HEADER.size)
+    if len(header) != SEGMENT_HEADER.size:
+        raise ValueError(f"Truncated blob header: {stored_path}")
+    magic, version, segment_size, salt, prefix = SEGMENT_HEADER.unpack(header)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        raise ValueError(f"Unrecognised blob format: {stored_path}")
+    return header, segment_size, salt, prefix
+
+
+def _segment_count(file_size: int, segment_size: int) -> int:
+    body = file_size - SEGMENT_HEADER.size
+    record_size = segment_size + SEGMENT_TAG_SIZE
+    return max(1, -(-body // record_size))
+
+
+def plaintext_size(stored_path: str, nonce_b64: str = None) -> int:
+    """Size of the decrypted blob, computed from the file size alone."""
+    file_size = os.path.getsize(stored_path)
+    if nonce_b64:
+        return file_size - SEGMENT_TAG_SIZE
+    with open(stored_path, "rb") as f:
+        _, segment_size, _, _ = _read_segment_header(f, stored_path)
+    count = _segment_count(file_size, segment_size)
+    return file_size - SEGMENT_HEADER.size - count * SEGMENT_TAG_SIZE
+
+
+def iter_decrypt_file(stored_path: str, nonce_b64: str = None, start: int = 0, end: int = None,
+                      key_id: str = None):
+    """Yield the plaintext of a stored blob, one segment at a time.
+
+    `start`/`end` select a byte range of the plaintext; only the segments
+    covering it are read and decrypted. Documents with a `nonce_b64` use the
+    legacy single-blob format and are decrypted in one piece.
+    """
+    with open(stored_path, "rb") as f:
+        if nonce_b64:
+            aesgcm = AESGCM(master_key(key_id))
+            plaintext = aesgcm.decrypt(base64.b64decode(nonce_b64), f.read(), None)
+            yield plaintext[start:end]
+            return
+
+        header, segment_size, salt, prefix = _read_segment_header(f, stored_path)
+        aesgcm = _segment_key(salt, key_id)
+        record_size = segment_size + SEGMENT_TAG_SIZE
+        count = _segment_count(os.fstat(f.fileno()).st_size, segment_size)
+
+        first = start // segment_size
+        last = count - 1 if end is None else min(count - 1, max(end - 1, 0) // segment_size)
+        f.seek(SEGMENT_HEADER.size + first * record_size)
+        spent, produced = 0.0, 0  # read + decrypt time, excluding the consumer's
+        try:
+            for index in range(first, last + 1):
+                started = time.perf_counter()
+                record = _read_exact(f, record_size)
+                segment = aesgcm.decrypt(_segment_nonce(prefix, index, index == count - 1), record, header)
+                spent += time.perf_counter() - started
+                produced += len(segment)
+                offset = index * segment_size
+                lo = max(start - offset, 0)
+                hi = len(segment) if end is None else min(end - offset, len(segment))
+                if lo or hi < len(segment):
+                    segment = segment[lo:hi]
+                if segment:
+                    yield segment
+        finally:
+            metrics.blob_io_seconds.observe(spent, op="decrypt_stream")
+            metrics.blob_io_bytes.inc(produced, op="decrypt_stream")
+
+
+class ResumableBlob:
+    """
+    A segmented blob written across many requests (resumable uploads).
+
+    The total plaintext length is fixed up front, so every segment knows
+    whether it is the final one and is sealed as soon as it is full. Bytes
+    that do not yet fill a segment are kept in an encrypted `.tail` sidecar
+    between requests. The files themselves are the record of progress: a
+    crash mid-append loses at most the unacknowledged part of one chunk.
+    """
+
+    TAIL_HEADER = struct.Struct(">I12s")  # segment index, nonce
+
+    def __init__(self, stored_path: str, length: int, key_id: str = None):
+        self.path = stored_path
+        self.tail_path = stored_path + ".tail"
+        self.length = length
+        self.key_id = key_id
+
+    @classmethod
+    def create(cls, stored_path: str, length: int, segment_size: int = None, key_id: str = None):
+        segment_size = segment_size or Config.ENCRYPTION_SEGMENT_SIZE
+        header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, segment_size, os.urandom(16), os.urandom(7))
+        with open(stored_path, "xb") as f:
+            f.write(header)
+        blob = cls(stored_path, length, key_id)
+        if length == 0:
+            blob.append(io.BytesIO(b""))  # seal the single empty final segment
+        return blob
+
+    def _state(self, f, repair=False):
+        """Parse the header and count the segments safely on disk.
+
+        Bytes past the last whole segment (a torn write, or a chunk being
+        written right now) are not counted; `repair` cuts them off, which
+        only append() may do, under the upload's lock.
+        """
+        header, segment_size, salt, prefix = _read_segment_header(f, self.path)
+        record_size = segment_size + SEGMENT_TAG_SIZE
+        last_index = max(0, -(-self.length // segment_size) - 1)
+        final_record = self.length - last_index * segment_size + SEGMENT_TAG_SIZE
+
+        body = os.fstat(f.fileno()).st_size - SEGMENT_HEADER.size
+        full = min(body // record_size, last_index)
+        complete = full == last_index and body - full * record_size == final_record
+        if repair and not complete and body != full * record_size:
+            f.truncate(SEGMENT_HEADER.size + full * record_size)  # drop a torn write
+        return header, segment_size, salt, prefix, full, complete
+
+    def _tail_key(self, salt: bytes) -> AESGCM:
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"flyvia-tail-v1")
+        return AESGCM(hkdf.derive(master_key(self.key_id)))
+
+    def _read_tail(self, header, salt, index) -> bytes:
+        try:
+            with open(self.tail_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return b""
+        tail_index, nonce = self.TAIL_HEADER.unpack_from(data)
+        if tail_index != index:
+            return b""  # already sealed into a segment before a crash
+        return self._tail_key(salt).decrypt(nonce, data[self.TAIL_HEADER.size:], header + struct.pack(">I", index))
+
+    def _write_tail(self, header, salt, index, plaintext: bytes):
+        if not plaintext:
+            if os.path.exists(self.tail_path):
+                os.remove(self.tail_path)
+            return
+        nonce = os.urandom(12)
+        sealed = self._tail_key(salt).encrypt(nonce, plaintext, header + struct.pack(">I", index))
+        with open(self.tail_path + ".part", "wb") as f:
+            f.write(self.TAIL_HEADER.pack(index, nonce) + sealed)
+        os.replace(self.tail_path + ".part", self.tail_path)
+
+    def offset(self) -> int:
+        """Plaintext bytes received so far; read-only, safe beside a running append()."""
+        with open(self.path, "rb") as f:
+            header, segment_size, salt, _, full, complete = self._state(f)
+        if complete:
+            return self.length
+        return full * segment_size + len(self._read_tail(header, salt, full))
+
+    def append(self, stream) -> int:
+        """Encrypt everything readable from `stream` onto the blob; returns the new offset.
+
+        Raises ValueError if the data runs past the declared length.
+        """
+        with open(self.path, "r+b") as f:
+            header, segment_size, salt, prefix, index, complete = self._state(f, repair=True)
+            if complete:
+                if stream.read(1):
+                    raise ValueError("upload is already complete")
+                return self.length
+            aesgcm = _segment_key(salt, self.key_id)
+            last_index = max(0, -(-self.length // segment_size) - 1)
+            last_size = self.length - last_index * segment_size
+            buffer = self._read_tail(header, salt, index)
+            f.seek(0, os.SEEK_END)
+
+            while True:
+                target = last_size if index == last_index else segment_size
+                data = _read_exact(stream, target - len(buffer))
+                buffer += data
+                if len(buffer) == target:
+                    final = index == last_index
+                    if final and stream.read(1):
+                        raise ValueError("chunk runs past the declared upload length")
+                    f.write(aesgcm.encrypt(_segment_nonce(prefix, index, final), buffer, header))
+                    buffer, index = b"", index + 1
+                    if final:
+                        break
+                if not data:
+                    break
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._write_tail(header, salt, index, buffer)
+        return min(index * segment_size, self.length) + len(buffer)
+
+    def remove(self):
+        for path in (self.path, self.tail_path, self.tail_path + ".part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _content_mac(owner_id: int, key_id: str = None):
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"flyvia-dedup-v1:%d" % owner_id)
+    return hmac.new(hkdf.derive(master_key(key_id)), digestmod="sha256")
+
+
+def content_hmac(owner_id: int, chunks, key_id: str = None):
+    """Keyed fingerprint of plaintext for per-owner deduplication.
+
+    The key is derived per owner from master key `key_id` (the one the blob
+    is encrypted with), so equal files of different users get unrelated
+    fingerprints, a stored value reveals nothing without that key, and
+    rotation re-keys fingerprints along with the blobs. Returns (hex
+    digest, plaintext size).
+    """
+    mac = _content_mac(owner_id, key_id)
+    size = 0
+    for chunk in chunks:
+        mac.update(chunk)
+        size += len(chunk)
+    return mac.hexdigest(), size
+
+
+class StoredContentMac:
+    """content_hmac() of a blob's plaintext, fed the blob's stored (possibly compressed) bytes."""
+
+    def __init__(self, owner_id: int, codec: str = None, key_id: str = None):
+        self._mac = _content_mac(owner_id, key_id)
+        self._decompressor = _decompressor(codec) if codec else None
+
+    def update(self, chunk: bytes):
+        self._mac.update(self._decompressor.decompress(chunk) if self._decompressor else chunk)
+
+    def hexdigest(self) -> str:
+        if self._decompressor:
+            self._mac.update(self._decompressor.flush())
+        return self._mac.hexdigest()
+
+
+def iter_stream(stream, chunk_size: int = None):
+    """Yield a readable stream in segment-sized chunks."""
+    chunk_size = chunk_size or Config.ENCRYPTION_SEGMENT_SIZE
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+# ==========================================================
+# 🗜 COMPRESSION (applied before encryption)
+# ==========================================================
+# Ciphertext doesn't compress, so compression has to happen first. Already
+# compressed formats (JPEG, PNG, most scanned PDFs) gain nothing, so a few
+# sample windows are test-compressed and the file is stored as-is unless
+# they shrink enough. The codec is recorded per document.
+COMPRESSION_SAMPLE_SIZE = 16 * 1024
+
+
+def _compressor(codec: str, level: int = None):
+    level = level or Config.COMPRESSION_LEVEL
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == "zlib":
+        return zlib.compressobj(level)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "zlib":
+        return zlib.decompressobj()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def default_codec():
+    """The configured codec, or None when compression is disabled."""
+    codec = Config.COMPRESSION_CODEC
+    if codec == "none":
+        return None
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec
+
+
+def sample_stream(stream, size: int = COMPRESSION_SAMPLE_SIZE) -> bytes:
+    """Bytes from the start, middle and end of a seekable stream; rewinds it."""
+    length = stream.seek(0, os.SEEK_END)
+    offsets = [0] if length <= 3 * size else [0, length // 2 - size // 2, length - size]
+    parts = []
+    for offset in offsets:
+        stream.seek(offset)
+        parts.append(stream.read(size))
+    stream.seek(0)
+    return b"".join(parts)
+
+
+def choose_codec(sample: bytes, codec: str = None, size: int = None):
+    """Codec to store a file with, or None if compressing the sample doesn't pay off.
+
+    Files of more than COMPRESSION_MAX_BYTES (`size`) are never compressed:
+    a range of a compressed blob is read by decompressing everything before
+    it, so large files, the ones viewers seek in, stay seekable.
+    """
+    codec = codec or default_codec()
+    if not codec or not sample:
+        return None
+    if size is not None and size > Config.COMPRESSION_MAX_BYTES:
+        return None
+    compressor = _compressor(codec, level=1)
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    return codec if compressed <= len(sample) * (1 - Config.COMPRESSION_MIN_SAVING) else None
+
+
+def choose_stream_codec(stream, codec: str = None):
+    """choose_codec() for a seekable stream, sized and sampled in place; rewinds it."""
+    size = stream.seek(0, os.SEEK_END)
+    return choose_codec(sample_stream(stream), codec, size)
+
+
+def iter_compress(chunks, codec: str):
+    compressor = _compressor(codec)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def iter_decompress(chunks, codec: str):
+    decompressor = _decompressor(codec)
+    for chunk in chunks:
+        out = decompressor.decompress(chunk)
+        if out:
+            yield out
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def iter_slice(chunks, start: int = 0, end: int = None):
+    """Yield bytes [start, end) of a chunk stream, skipping what comes before."""
+    position = 0
+    for chunk in chunks:
+        lo, hi = position, position + len(chunk)
+        position = hi
+        if hi <= start:
+            continue
+        if end is not None and lo >= end:
+            return
+        chunk = chunk[max(start - lo, 0):len(chunk) if end is None else min(end - lo, len(chunk))]
+        if chunk:
+            yield chunk
+
+
+class ChunkReader:
+    """Readable file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def iter_plaintext(stored_path: str, nonce_b64: str = None, codec: str = None, start: int = 0, end: int = None,
+                   key_id: str = None):
+    """Yield a document's original bytes: decrypt, then decompress if needed.
+
+    Compressed documents can't seek by offset, so a range is served by
+    decompressing from the start and skipping up to `start`; choose_codec()
+    only compresses files small enough for that to stay cheap.
+    """
+    if not codec:
+        yield from iter_decrypt_file(stored_path, nonce_b64, start=start, end=end, key_id=key_id)
+        return
+    yield from iter_slice(iter_decompress(iter_decrypt_file(stored_path, nonce_b64, key_id=key_id), codec), start, end)
 
 
 # ==========================================================
@@ -41,59 +540,393 @@ def decrypt_bytes(nonce_b64: str, cipher_b64: str) -> bytes:
 # ==========================================================
 def save_file_bytes(stored_path: str, cipher_b64: str):
     """Save encrypted base64 data to disk."""
-    with open(stored_path, "wb") as f:
-        f.write(base64.b64decode(cipher_b64))
+    data = base64.b64decode(cipher_b64)
+    with metrics.blob_op("file_write", len(data)), open(stored_path, "wb") as f:
+        f.write(data)
 
 
 def read_file_bytes_as_b64(stored_path: str) -> str:
     """Read file as base64 string."""
-    with open(stored_path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+    with metrics.blob_op("file_read"), open(stored_path, "rb") as f:
+        data = f.read()
+    metrics.blob_io_bytes.inc(len(data), op="file_read")
+    return base64.b64encode(data).decode()
+
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def try_lock_file(path: str):
+    """Non-blocking exclusive lock on `path`; yields False if it is already held."""
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(path, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    with open(path, "a+b") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_encrypted_stream(stored_path: str, src, codec: str = None, key_id: str = None) -> int:
+    """Stream-encrypt `src` (compressed with `codec`, if given) under key
+    `key_id`; the file only appears once complete. Returns the bytes encrypted."""
+    tmp_path = stored_path + ".part"
+    if codec:
+        src = ChunkReader(iter_compress(iter_stream(src), codec))
+    try:
+        # Includes reading (and compressing) the source and writing the file
+        with metrics.blob_io_seconds.time(op="encrypt_stream"), open(tmp_path, "wb") as f:
+            size = encrypt_stream(src, f, key_id=key_id)
+        os.replace(tmp_path, stored_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    metrics.blob_io_bytes.inc(size, op="encrypt_stream")
+    return size
+
+
+# ==========================================================
+# 📦 STREAMING ZIP ARCHIVES
+# ==========================================================
+class _ZipSink:
+    """Write-only, unseekable file object that collects zipfile's output."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Yield a ZIP archive piece by piece. `entries` yields
+    (arcname, modified datetime, plaintext size, chunk iterator); each member
+    is stored (PDFs and images are already compressed) and written with a
+    trailing data descriptor, so nothing is buffered beyond one chunk.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for arcname, modified, size, chunks in entries:
+            info = zipfile.ZipInfo(arcname, date_time=(modified or datetime.utcnow()).timetuple()[:6])
+            info.file_size = size  # lets zipfile pick zip64 for members over 4 GiB
+            with archive.open(info, "w") as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
 
 
 # ==========================================================
 # 🧾 AUDIT LOGGING
 # ==========================================================
+class AuditBuffer:
+    """
+    Collects audit entries logged outside any transaction and writes them
+    with bulk inserts: a background flusher writes them once
+    AUDIT_BATCH_SIZE entries are waiting or every AUDIT_FLUSH_INTERVAL
+    seconds, and once more at interpreter exit. Entries logged inside a
+    transaction stay on that session (see audit()).
+    """
+
+    def __init__(self, batch_size=200, flush_interval=2.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.app = None
+        self._rows = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, row):
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def drain(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        return rows
+
+    def requeue(self, rows):
+        with self._lock:
+            self._rows[:0] = rows
+
+    def flush(self):
+        """Write buffered entries in their own transaction."""
+        if self.app is None or not self._rows:
+            return
+        rows = self.drain()
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(AuditLog), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.requeue(rows)
+                print(f"⚠️ Audit flush failed: {e}")
+            finally:
+                db.session.remove()
+
+    def start(self, app):
+        """Start the background flusher and register the shutdown flush."""
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+audit_buffer = AuditBuffer(Config.AUDIT_BATCH_SIZE, Config.AUDIT_FLUSH_INTERVAL)
+
+
+def _write_session_audit(session):
+    rows = session.info.pop("audit_pending", None)
+    if rows:
+        session.execute(insert(AuditLog), rows)
+
+
+@event.listens_for(Session, "before_commit")
+def _audit_before_commit(session):
+    # A session's entries are written by its own commit, in one bulk insert
+    _write_session_audit(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _audit_after_transaction_end(session, transaction):
+    # Rolled back (or closed without committing): the actions never happened
+    if transaction.parent is None:
+        session.info.pop("audit_pending", None)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _audit_before_read(orm_execute_state):
+    # Reads of the audit log see everything audited so far
+    if orm_execute_state.is_select and any(
+        mapper.class_ is AuditLog for mapper in orm_execute_state.all_mappers
+    ):
+        _write_session_audit(orm_execute_state.session)
+        audit_buffer.flush()
+
+
 def audit(user_id: int, action: str, detail: str = ""):
-    """Log user actions (uploads, downloads, reminders, etc)."""
-    entry = AuditLog(user_id=user_id, action=action, detail=detail, timestamp=datetime.utcnow())
-    db.session.add(entry)
-    db.session.commit()
+    """Log user actions (uploads, downloads, reminders, etc).
+
+    Inside a transaction the entry is written when that transaction commits
+    and discarded if it rolls back; otherwise it goes to the shared buffer.
+    """
+    row = {"user_id": user_id, "action": action, "detail": detail, "timestamp": datetime.utcnow()}
+    session = db.session() if has_app_context() else None
+    if session is not None and session.in_transaction():
+        session.info.setdefault("audit_pending", []).append(row)
+    else:
+        audit_buffer.add(row)
 
 
 # ==========================================================
-# 📧 EMAIL SENDING (UTF-8 SAFE)
+# 👤 IDENTITY CACHE
 # ==========================================================
-def send_email(to_email, subject, body):
+class IdentityCache:
     """
-    Sends an email using Gmail SMTP with UTF-8 support.
-    Requires .env setup with SMTP credentials.
+    Bounded TTL/LRU cache of User rows keyed by id, so login_required can
+    rebuild the current user without a query. Entries are dropped when a
+    User is flushed as changed or deleted; the TTL bounds staleness from
+    changes made by other processes.
     """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The User for `user_id`, attached to the current session, or None."""
+        user = db.session.identity_map.get(db.inspect(User).identity_key_from_primary_key((user_id,)))
+        if user is not None:
+            return user
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                values = entry[1]
+            else:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                values = None
+
+        if values is None:
+            user = db.session.get(User, user_id)
+            if user is not None:
+                self.put(user)
+            return user
+
+        user = User(**values)
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    def put(self, user):
+        if self.maxsize <= 0:
+            return
+        values = {column.key: getattr(user, column.key) for column in db.inspect(User).column_attrs}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+identity_cache = IdentityCache(Config.IDENTITY_CACHE_SIZE, Config.IDENTITY_CACHE_TTL)
+
+
+@event.listens_for(Session, "after_flush")
+def _identity_after_flush(session, flush_context):
+    changed = [obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)]
+    for user_id in changed:
+        identity_cache.invalidate(user_id)
+    session.info.setdefault("changed_users", set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _identity_after_commit(session):
+    # Drop again after commit, in case a reader re-cached the old row meanwhile
+    for user_id in session.info.pop("changed_users", ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _identity_bulk_changes(orm_execute_state):
+    # Bulk UPDATE/DELETE statements bypass the unit of work
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and any(
+        mapper.class_ is User for mapper in orm_execute_state.all_mappers
+    ):
+        identity_cache.clear()
+
+
+# ==========================================================
+# 📇 LISTING VERSIONS
+# ==========================================================
+@event.listens_for(Session, "after_flush")
+def _bump_listing_versions(session, flush_context):
+    """Any flushed change to a document bumps its owner's listing_version."""
+    owners = {obj.owner_id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+              if isinstance(obj, Document) and obj.owner_id is not None}
+    if owners:
+        users = User.__table__
+        session.connection().execute(
+            users.update().where(users.c.id.in_(owners)).values(listing_version=users.c.listing_version + 1)
+        )
+
+
+# ==========================================================
+# 📧 EMAIL SENDING (UTF-8 SAFE)
+# ==========================================================
+def build_message(to_email, subject, body):
+    """Create a UTF-8 safe plain-text message."""
+    from_email = os.getenv("FROM_EMAIL") or os.getenv("SMTP_USER") or "no-reply@localhost"
+    msg = MIMEMultipart()
+    msg["From"] = formataddr(("Flyvia Docs", from_email))
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "plain", "utf-8"))
+    return msg
+
+
+def open_smtp(timeout=20):
+    """Open an SMTP session, upgraded to TLS and logged in when configured."""
     smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
     smtp_port = int(os.getenv("SMTP_PORT", 587))
     smtp_user = os.getenv("SMTP_USER")
     smtp_pass = os.getenv("SMTP_PASS")
-    from_email = os.getenv("FROM_EMAIL", smtp_user)
 
     print(f"📨 Attempting SMTP => host={smtp_host} user={smtp_user} port={smtp_port}")
-
+    server = smtplib.SMTP(smtp_host, smtp_port, timeout=timeout)
     try:
-        # Create UTF-8 safe message
-        msg = MIMEMultipart()
-        msg["From"] = formataddr(("Flyvia Docs", from_email))
-        msg["To"] = to_email
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain", "utf-8"))
-
-        # Connect and send
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=20) as server:
+        if os.getenv("SMTP_STARTTLS", "1") != "0":
             server.starttls()
+        if smtp_user:
             server.login(smtp_user, smtp_pass)
+    except BaseException:
+        server.close()
+        raise
+    return server
+
+
+def send_email(to_email, subject, body):
+    """
+    Sends an email using Gmail SMTP with UTF-8 support.
+    Requires .env setup with SMTP credentials.
+    Opens a fresh connection per call; bulk senders should use mailer.MailQueue.
+    """
+    started = time.perf_counter()
+    try:
+        msg = build_message(to_email, subject, body)
+        with open_smtp() as server:
             server.send_message(msg)
 
+        metrics.smtp_send_seconds.observe(time.perf_counter() - started, result="sent")
         print(f"✅ Email successfully sent to {to_email}")
         return True
 
     except Exception as e:
+        metrics.smtp_send_seconds.observe(time.perf_counter() - started, result="error")
         print(f"❌ Email send failed to {to_email}: {e}")
         return False